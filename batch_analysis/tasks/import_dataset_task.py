@@ -6,6 +6,11 @@ class ImportDatasetTask(batch_analysis.task.Task):
     """
     A task for importing a dataset. Result will be an image source id
     """
+
+    # The field of the task document where the progress of the import is recorded,
+    # for loaders that take a 'checkpoint' argument.
+    _CHECKPOINT_FIELD = 'import_progress'
+
     def __init__(self, module_name, path, additional_args=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._module_name = module_name
@@ -28,6 +33,8 @@ class ImportDatasetTask(batch_analysis.task.Task):
         import logging
         import traceback
         import importlib
+        import inspect
+        import dataset.import_checkpoint
 
         # Try and import the desired loader module
         try:
@@ -46,9 +53,16 @@ class ImportDatasetTask(batch_analysis.task.Task):
         else:
             logging.getLogger(__name__).info(
                 "Importing dataset from {0} using module {1}".format(self.path, self.module_name))
+            # Record progress on this task, so that if the import is interrupted, it can resume where it stopped
+            kwargs = dict(self.additional_args)
+            if (self.identifier is not None and
+                    'checkpoint' in inspect.signature(loader_module.import_dataset).parameters):
+                kwargs['checkpoint'] = dataset.import_checkpoint.ImportCheckpoint(
+                    db_client.tasks_collection, self.identifier, field=self._CHECKPOINT_FIELD)
+
             # noinspection PyBroadException
             try:
-                dataset_id = loader_module.import_dataset(self.path, db_client, **self.additional_args)
+                dataset_id = loader_module.import_dataset(self.path, db_client, **kwargs)
             except Exception:
                 dataset_id = None
                 logging.getLogger(__name__).error(
@@ -62,6 +76,9 @@ class ImportDatasetTask(batch_analysis.task.Task):
                 self.mark_job_failed()
             else:
                 self.mark_job_complete(dataset_id)
+                if 'checkpoint' in kwargs:
+                    # The import is done, we don't need the checkpoint anymore
+                    self._updates['$unset'][self._CHECKPOINT_FIELD] = True
                 logging.getLogger(__name__).info("Successfully imported dataset {0}".format(dataset_id))
 
     def serialize(self):
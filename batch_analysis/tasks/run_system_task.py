@@ -88,13 +88,16 @@ class RunSystemTask(batch_analysis.task.Task):
         return super().deserialize(serialized_representation, db_client, **kwargs)
 
 
-def run_system_with_source(system, image_source):
+def run_system_with_source(system, image_source, prefetch_depth=8, prefetch_max_bytes=512 * 1024 * 1024):
     """
     Run a given vision system with a given image source.
     This is the structure for how image sources and vision systems should be interacted with.
     Both should already be set up and configured.
     :param system: The system to run.
     :param image_source: The image source to get images from
+    :param prefetch_depth: The number of images to load in the background while the system is processing.
+    Default 8, 0 disables prefetching.
+    :param prefetch_max_bytes: The maximum amount of image data to load ahead, in bytes. Default 512MB.
     :return: The TrialResult storing the results of the run. Save it to the database, or None if there's a problem.
     """
     if system.is_image_source_appropriate(image_source):
@@ -102,6 +105,8 @@ def run_system_with_source(system, image_source):
         stereo_baseline = image_source.get_stereo_baseline()
         if stereo_baseline is not None:
             system.set_stereo_baseline(stereo_baseline)
+        image_source.set_required_image_channels(system.required_image_channels)
+        image_source.set_prefetch(prefetch_depth, prefetch_max_bytes)
         system.start_trial(image_source.sequence_type)
         with image_source:
             while not image_source.is_complete():
@@ -1,7 +1,12 @@
 # Copyright (c) 2017, John Skinner
 import unittest
+import unittest.mock as mock
+import types
 import numpy as np
+import bson
 import database.tests.test_entity
+import database.tests.mock_database_client as mock_client_factory
+import dataset.import_checkpoint
 import util.dict_utils as du
 import batch_analysis.task
 import batch_analysis.tasks.import_dataset_task as task
@@ -51,3 +56,60 @@ class TestImportDatasetTask(database.tests.test_entity.EntityContract, unittest.
         self.assertEqual(task1.num_gpus, task2.num_gpus)
         self.assertEqual(task1.memory_requirements, task2.memory_requirements)
         self.assertEqual(task1.expected_duration, task2.expected_duration)
+
+
+class TestImportDatasetTaskCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.db_client = mock_client_factory.create().mock
+        self.subject = task.ImportDatasetTask(module_name='dataset.mock_loader', path='/tmp/dataset',
+                                              additional_args={'foo': 'bar'},
+                                              state=batch_analysis.task.JobState.RUNNING)
+        self.subject.save_updates(self.db_client.tasks_collection)
+
+    def test_passes_checkpoint_to_loaders_that_take_it(self):
+        dataset_id = bson.ObjectId()
+        received = {}
+
+        def import_dataset(path, db_client, foo, checkpoint=None):
+            received['foo'] = foo
+            received['checkpoint'] = checkpoint
+            checkpoint.record({1.0: bson.ObjectId()})
+            return dataset_id
+
+        with mock.patch('importlib.import_module', return_value=types.SimpleNamespace(import_dataset=import_dataset)):
+            self.subject.run_task(self.db_client)
+        self.assertEqual('bar', received['foo'])
+        self.assertIsInstance(received['checkpoint'], dataset.import_checkpoint.ImportCheckpoint)
+        self.assertTrue(self.subject.is_finished)
+        self.assertEqual(dataset_id, self.subject.result)
+
+        # The checkpoint is removed when the task is complete
+        self.subject.save_updates(self.db_client.tasks_collection)
+        s_task = self.db_client.tasks_collection.find_one({'_id': self.subject.identifier})
+        self.assertNotIn('import_progress', s_task)
+
+    def test_keeps_checkpoint_if_import_fails(self):
+        image_id = bson.ObjectId()
+
+        def import_dataset(path, db_client, foo, checkpoint=None):
+            checkpoint.record({1.0: image_id})
+            raise RuntimeError("Out of time")
+
+        with mock.patch('importlib.import_module', return_value=types.SimpleNamespace(import_dataset=import_dataset)):
+            self.subject.run_task(self.db_client)
+        self.assertFalse(self.subject.is_finished)
+        self.subject.save_updates(self.db_client.tasks_collection)
+        s_task = self.db_client.tasks_collection.find_one({'_id': self.subject.identifier})
+        self.assertEqual([[1.0, image_id]], s_task['import_progress'])
+
+    def test_does_not_pass_checkpoint_to_other_loaders(self):
+        received = {}
+
+        def import_dataset(path, db_client, **kwargs):
+            received.update(kwargs)
+            return bson.ObjectId()
+
+        with mock.patch('importlib.import_module', return_value=types.SimpleNamespace(import_dataset=import_dataset)):
+            self.subject.run_task(self.db_client)
+        self.assertEqual({'foo': 'bar'}, received)
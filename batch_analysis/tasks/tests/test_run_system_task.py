@@ -5,6 +5,7 @@ import numpy as np
 import bson
 import database.tests.test_entity
 import core.image_source
+import core.image_channel
 import core.system
 import util.dict_utils as du
 import batch_analysis.task
@@ -101,16 +102,29 @@ class TestTrialRunner(unittest.TestCase):
     def test_run_system_calls_iteration_functions_in_order(self):
         task.run_system_with_source(self._system, self._image_source)
         mock_calls = self._image_source.mock_calls
-        # get_camera_intrinsics; get_stereo_baseline; begin; 10 pairs of  is complete and get image; final is complete
-        self.assertEqual(25, len(mock_calls))
+        # get_camera_intrinsics; get_stereo_baseline; set_required_image_channels; set_prefetch; begin;
+        # 10 pairs of  is complete and get image; final is complete
+        self.assertEqual(27, len(mock_calls))
         self.assertEqual('get_camera_intrinsics', mock_calls[0][0])
         self.assertEqual('get_stereo_baseline', mock_calls[1][0])
-        self.assertEqual('__enter__', mock_calls[2][0])
+        self.assertEqual('set_required_image_channels', mock_calls[2][0])
+        self.assertEqual('set_prefetch', mock_calls[3][0])
+        self.assertEqual('__enter__', mock_calls[4][0])
         for i in range(10):
-            self.assertEqual('is_complete', mock_calls[3 + 2 * i][0])
-            self.assertEqual('get_next_image', mock_calls[4 + 2 * i][0])
-        self.assertEqual('is_complete', mock_calls[23][0])
-        self.assertEqual('__exit__', mock_calls[24][0])
+            self.assertEqual('is_complete', mock_calls[5 + 2 * i][0])
+            self.assertEqual('get_next_image', mock_calls[6 + 2 * i][0])
+        self.assertEqual('is_complete', mock_calls[25][0])
+        self.assertEqual('__exit__', mock_calls[26][0])
+
+    def test_run_system_passes_required_channels_to_image_source(self):
+        self._system.required_image_channels = {core.image_channel.ImageChannel.RGB}
+        task.run_system_with_source(self._system, self._image_source)
+        self.assertIn(mock.call({core.image_channel.ImageChannel.RGB}),
+                      self._image_source.set_required_image_channels.call_args_list)
+
+    def test_run_system_sets_image_source_prefetch(self):
+        task.run_system_with_source(self._system, self._image_source, prefetch_depth=3, prefetch_max_bytes=1024)
+        self.assertIn(mock.call(3, 1024), self._image_source.set_prefetch.call_args_list)
 
     def test_run_system_returns_trial_result(self):
         result = task.run_system_with_source(self._system, self._image_source)
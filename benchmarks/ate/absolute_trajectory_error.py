@@ -33,6 +33,7 @@
 
 import numpy as np
 import util.associate as ass
+import util.trajectory
 import core.benchmark
 import benchmarks.ate.ate_result
 
@@ -44,22 +45,26 @@ class BenchmarkATE(core.benchmark.Benchmark):
     See: https://vision.in.tum.de/data/datasets/rgbd-dataset/tools
     """
 
-    def __init__(self, offset=0, max_difference=0.02, scale=1.0, id_=None):
+    def __init__(self, offset=0, max_difference=0.02, scale=1.0, estimate_scale=False, id_=None):
         """
         Create a Absolute Trajectory Error benchmark.
 
-        There are 3 configuration properties for calculating ATE, which can be set as parameters:
+        There are 4 configuration properties for calculating ATE, which can be set as parameters:
         - offset: A uniform offset to the timstamps of the calculated trajectory, relative to the ground truth
         - max_difference: The maximum difference between matched timestamps
         - scale: A scaling factor between the test trajectory and the ground truth trajectory locations
+        - estimate_scale: Whether to also find the best scale when aligning the trajectories,
+        for systems such as monocular SLAM that cannot observe the scale of the world
         :param offset:
         :param max_difference:
         :param scale:
+        :param estimate_scale:
         """
         super().__init__(id_=id_)
         self._offset = offset
         self._max_difference = max_difference
         self._scale = scale     # TODO:
+        self._estimate_scale = bool(estimate_scale)
 
     @property
     def offset(self):
@@ -77,6 +82,14 @@ class BenchmarkATE(core.benchmark.Benchmark):
     def scale(self, scale):
         self._scale = scale
 
+    @property
+    def estimate_scale(self):
+        return self._estimate_scale
+
+    @estimate_scale.setter
+    def estimate_scale(self, estimate_scale):
+        self._estimate_scale = bool(estimate_scale)
+
     @property
     def max_difference(self):
         return self._max_difference
@@ -90,7 +103,8 @@ class BenchmarkATE(core.benchmark.Benchmark):
         return {
             'offset': self.offset,
             'scale': self.scale,
-            'max_difference': self.max_difference
+            'max_difference': self.max_difference,
+            'estimate_scale': self.estimate_scale
         }
 
     def serialize(self):
@@ -98,6 +112,7 @@ class BenchmarkATE(core.benchmark.Benchmark):
         output['offset'] = self.offset
         output['max_difference'] = self.max_difference
         output['scale'] = self.scale
+        output['estimate_scale'] = self.estimate_scale
         return output
 
     @classmethod
@@ -108,6 +123,8 @@ class BenchmarkATE(core.benchmark.Benchmark):
             kwargs['max_difference'] = serialized_representation['max_difference']
         if 'scale' in serialized_representation:
             kwargs['scale'] = serialized_representation['scale']
+        if 'estimate_scale' in serialized_representation:
+            kwargs['estimate_scale'] = serialized_representation['estimate_scale']
         return super().deserialize(serialized_representation, db_client, **kwargs)
 
     @classmethod
@@ -126,69 +143,95 @@ class BenchmarkATE(core.benchmark.Benchmark):
         :return:
         :rtype BenchmarkResult:
         """
-        ground_truth_traj = trial_result.get_ground_truth_camera_poses()
-        result_traj = trial_result.get_computed_camera_poses()
-        # TODO: Fix the format of these trajectories to what is expected below
-        matches = ass.associate(ground_truth_traj, result_traj, self.offset, self.max_difference)
-        if len(matches) < 2:
-            return core.benchmark.FailedBenchmark(self.identifier, trial_result.identifier,
-                                                  "Couldn't find matching timestamp pairs "
-                                                  "between groundtruth and estimated trajectory! "
-                                                  "Did you choose the correct sequence?")
-
-        # Construct matrices of the ground truth and calculated poses
-        ground_truth_xyz = []
-        result_xyz = []
-        gt_timestamps = []
-        for gt_stamp, result_stamp in matches:
-            ground_truth_xyz.append(ground_truth_traj[gt_stamp].location)
-            result_xyz.append(result_traj[result_stamp].location * float(self.scale))
-            gt_timestamps.append(gt_stamp)
-
-        # Align the two trajectories, based on the matching timestamps from both
-        ground_truth_xyz = np.matrix(ground_truth_xyz).transpose()
-        result_xyz = np.matrix(result_xyz).transpose()
-        rot, trans, trans_error = align(result_xyz, ground_truth_xyz)
-
-        # Match the trans error back to its ground-truth timestamps
-        mapped_error = {}
-        for col_num, timestamp in enumerate(gt_timestamps):
-            mapped_error[timestamp] = trans_error[col_num]
-
-        return benchmarks.ate.ate_result.BenchmarkATEResult(self.identifier, trial_result.identifier,
-                                                            mapped_error, self.get_settings())
-
-
-def align(model, data):
+        return self.benchmark_trials([trial_result])[0]
+
+    def benchmark_trials(self, trial_results):
+        """
+        Benchmark several trial results, such as repeated runs of the same system on the same dataset.
+        Trials that match the same ground truth poses are all aligned to it in a single call to align.
+        :param trial_results: A list of trial results
+        :return: A list of BenchmarkResult, one for each trial result in the same order
+        """
+        results = [None for _ in range(len(trial_results))]
+        groups = {}
+        for idx, trial_result in enumerate(trial_results):
+            ground_truth_traj = util.trajectory.Trajectory.from_poses(trial_result.get_ground_truth_camera_poses())
+            result_traj = util.trajectory.Trajectory.from_poses(trial_result.get_computed_camera_poses())
+            gt_indexes, result_indexes = ass.associate_arrays(ground_truth_traj.timestamps, result_traj.timestamps,
+                                                              self.offset, self.max_difference)
+            if len(gt_indexes) < 2:
+                results[idx] = core.benchmark.FailedBenchmark(self.identifier, trial_result.identifier,
+                                                              "Couldn't find matching timestamp pairs "
+                                                              "between groundtruth and estimated trajectory! "
+                                                              "Did you choose the correct sequence?")
+                continue
+
+            # Group the trials by the ground truth poses they were matched to
+            gt_timestamps = ground_truth_traj.timestamps[gt_indexes]
+            ground_truth_xyz = ground_truth_traj.locations[gt_indexes].T
+            key = (gt_timestamps.tobytes(), ground_truth_xyz.tobytes())
+            if key not in groups:
+                groups[key] = (gt_timestamps, ground_truth_xyz, [])
+            groups[key][2].append((idx, result_traj.locations[result_indexes].T * float(self.scale)))
+
+        for gt_timestamps, ground_truth_xyz, trials in groups.values():
+            # Align all the trials to the ground truth at once
+            result_xyz = np.stack([trial_xyz for _, trial_xyz in trials])
+            _, _, trans_errors, _ = align(result_xyz, ground_truth_xyz, with_scale=self.estimate_scale)
+
+            for (idx, _), trans_error in zip(trials, trans_errors):
+                # Match the trans error back to its ground-truth timestamps
+                mapped_error = dict(zip(gt_timestamps.tolist(), trans_error.tolist()))
+                results[idx] = benchmarks.ate.ate_result.BenchmarkATEResult(
+                    self.identifier, trial_results[idx].identifier, mapped_error, self.get_settings())
+        return results
+
+
+def align(model, data, with_scale=False):
     """Align two trajectories using the method of Horn (closed-form).
+    With scale, this is the similarity alignment of Umeyama.
+    The model may be a stack of several trajectories to be aligned to the same data,
+    in which case they are all aligned at once and each output has an extra first dimension.
 
     Input:
-    model -- first trajectory (3xn)
+    model -- first trajectory (3xn), or K trajectories (Kx3xn)
     data -- second trajectory (3xn)
+    with_scale -- also find the scale of the model relative to the data (default: False)
 
     Output:
     rot -- rotation matrix (3x3)
     trans -- translation vector (3x1)
-    trans_error -- translational error per point (1xn)
+    trans_error -- translational error per point (n)
+    scale -- the scale applied to the model, 1 unless with_scale is true
 
     """
-    np.set_printoptions(precision=3, suppress=True)
-    model_zerocentered = model - model.mean(1)
-    data_zerocentered = data - data.mean(1)
-
-    W = np.zeros((3, 3))
-    for column in range(model.shape[1]):
-        W += np.outer(model_zerocentered[:, column], data_zerocentered[:, column])
-    U, d, Vh = np.linalg.linalg.svd(W.transpose())
-    S = np.matrix(np.identity(3))
-    if (np.linalg.det(U) * np.linalg.det(Vh) < 0):
-        S[2, 2] = -1
-    rot = U * S * Vh
-    trans = data.mean(1) - rot * model.mean(1)
-
-    model_aligned = rot * model + trans
+    model = np.asarray(model, dtype=np.float64)
+    data = np.asarray(data, dtype=np.float64)
+    single = model.ndim == 2
+    if single:
+        model = model[np.newaxis]
+
+    model_mean = model.mean(axis=2, keepdims=True)
+    data_mean = data.mean(axis=1, keepdims=True)
+    model_zerocentered = model - model_mean
+    data_zerocentered = data - data_mean
+
+    W = np.matmul(model_zerocentered, data_zerocentered.T)
+    U, d, Vh = np.linalg.svd(np.swapaxes(W, 1, 2))
+    S = np.ones((len(model), 3))
+    S[np.linalg.det(U) * np.linalg.det(Vh) < 0, 2] = -1
+    rot = np.matmul(U * S[:, np.newaxis, :], Vh)
+    if with_scale:
+        scale = np.sum(d * S, axis=1) / np.sum(model_zerocentered * model_zerocentered, axis=(1, 2))
+    else:
+        scale = np.ones(len(model))
+    trans = data_mean - scale[:, np.newaxis, np.newaxis] * np.matmul(rot, model_mean)
+
+    model_aligned = scale[:, np.newaxis, np.newaxis] * np.matmul(rot, model) + trans
     alignment_error = model_aligned - data
 
-    trans_error = np.sqrt(np.sum(np.multiply(alignment_error, alignment_error), 0)).A[0]
+    trans_error = np.sqrt(np.sum(alignment_error * alignment_error, axis=1))
 
-    return rot, trans, trans_error
+    if single:
+        return rot[0], trans[0], trans_error[0], scale[0]
+    return rot, trans, trans_error, scale
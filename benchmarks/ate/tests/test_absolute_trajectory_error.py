@@ -98,6 +98,7 @@ class TestBenchmarkATE(database.tests.test_entity.EntityContract, unittest.TestC
         self.assertEqual(benchmark1.offset, benchmark2.offset)
         self.assertEqual(benchmark1.max_difference, benchmark2.max_difference)
         self.assertEqual(benchmark1.scale, benchmark2.scale)
+        self.assertEqual(benchmark1.estimate_scale, benchmark2.estimate_scale)
 
     def test_benchmark_results_returns_a_benchmark_result(self):
         benchmark = ate.BenchmarkATE()
@@ -202,3 +203,99 @@ class TestBenchmarkATE(database.tests.test_entity.EntityContract, unittest.TestC
         benchmark.scale = scale
         result = benchmark.benchmark_results(self.trial_result)
         self.assertLess(result.max, unscaled_result.max)
+
+    def test_estimate_scale_finds_unknown_scale(self):
+        comp_traj, noise = create_noise(self.trial_result.ground_truth_trajectory, self.random,
+                                        time_noise=0, loc_noise=0)
+        self.trial_result.computed_trajectory = {time: tf.Transform(location=pose.location / 443,
+                                                                    rotation=pose.rotation_quat(True), w_first=True)
+                                                 for time, pose in comp_traj.items()}
+
+        benchmark = ate.BenchmarkATE(estimate_scale=True)
+        result = benchmark.benchmark_results(self.trial_result)
+        for time, error in result.translational_error.items():
+            self.assertAlmostEqual(0, error, places=6)
+
+    def test_benchmark_trials_matches_benchmark_results(self):
+        trial_results = [self.trial_result]
+        for _ in range(3):
+            comp_traj, _ = create_noise(self.trial_result.ground_truth_trajectory, self.random)
+            trial_results.append(MockTrialResult(self.trial_result.ground_truth_trajectory, comp_traj))
+        trial_results.append(MockTrialResult(self.trial_result.ground_truth_trajectory,
+                                             create_random_trajectory(self.random, 600, 10)))
+
+        benchmark = ate.BenchmarkATE()
+        results = benchmark.benchmark_trials(trial_results)
+        self.assertEqual(len(trial_results), len(results))
+        for trial_result, result in zip(trial_results, results):
+            expected = benchmark.benchmark_results(trial_result)
+            self.assertEqual(type(expected), type(result))
+            if not isinstance(expected, core.benchmark.FailedBenchmark):
+                self.assertEqual(set(expected.translational_error.keys()), set(result.translational_error.keys()))
+                for time, error in expected.translational_error.items():
+                    self.assertAlmostEqual(error, result.translational_error[time])
+
+
+class TestAlign(unittest.TestCase):
+
+    def setUp(self):
+        self.random = np.random.RandomState(2661)
+        self.data = self.random.uniform(-100, 100, (3, 50))
+
+    def test_matches_loop_implementation(self):
+        model = self.random.uniform(-100, 100, (3, 50))
+        rot, trans, trans_error, scale = ate.align(model, self.data)
+        expected_rot, expected_trans, expected_error = align_columns(np.matrix(model), np.matrix(self.data))
+        self.assertTrue(np.allclose(expected_rot, rot))
+        self.assertTrue(np.allclose(expected_trans, trans))
+        self.assertTrue(np.allclose(expected_error, trans_error))
+        self.assertEqual(1, scale)
+
+    def test_recovers_rigid_transform(self):
+        true_rot = tf.Transform(rotation=self.random.uniform(-np.pi, np.pi, 3)).transform_matrix[0:3, 0:3]
+        true_trans = self.random.uniform(-10, 10, (3, 1))
+        model = np.dot(true_rot.T, self.data - true_trans)
+        rot, trans, trans_error, _ = ate.align(model, self.data)
+        self.assertTrue(np.allclose(true_rot, rot))
+        self.assertTrue(np.allclose(true_trans, trans))
+        self.assertTrue(np.allclose(0, trans_error))
+
+    def test_recovers_scale(self):
+        model = self.data / 12.5 + self.random.uniform(-10, 10, (3, 1))
+        rot, trans, trans_error, scale = ate.align(model, self.data, with_scale=True)
+        self.assertAlmostEqual(12.5, scale)
+        self.assertTrue(np.allclose(np.identity(3), rot))
+        self.assertTrue(np.allclose(0, trans_error))
+
+    def test_aligns_stack_of_trials(self):
+        models = self.random.uniform(-100, 100, (5, 3, 50))
+        for with_scale in (False, True):
+            rots, trans, trans_errors, scales = ate.align(models, self.data, with_scale=with_scale)
+            self.assertEqual((5, 3, 3), rots.shape)
+            self.assertEqual((5, 3, 1), trans.shape)
+            self.assertEqual((5, 50), trans_errors.shape)
+            for idx in range(len(models)):
+                rot, tran, trans_error, scale = ate.align(models[idx], self.data, with_scale=with_scale)
+                self.assertTrue(np.allclose(rot, rots[idx]))
+                self.assertTrue(np.allclose(tran, trans[idx]))
+                self.assertTrue(np.allclose(trans_error, trans_errors[idx]))
+                self.assertAlmostEqual(scale, scales[idx])
+
+
+def align_columns(model, data):
+    """
+    The alignment from evaluate_ate.py in the TUM benchmark tools, building W one column at a time
+    """
+    model_zerocentered = model - model.mean(1)
+    data_zerocentered = data - data.mean(1)
+    W = np.zeros((3, 3))
+    for column in range(model.shape[1]):
+        W += np.outer(model_zerocentered[:, column], data_zerocentered[:, column])
+    U, d, Vh = np.linalg.svd(W.transpose())
+    S = np.matrix(np.identity(3))
+    if np.linalg.det(U) * np.linalg.det(Vh) < 0:
+        S[2, 2] = -1
+    rot = U * S * Vh
+    trans = data.mean(1) - rot * model.mean(1)
+    alignment_error = rot * model + trans - data
+    return rot, trans, np.sqrt(np.sum(np.multiply(alignment_error, alignment_error), 0)).A[0]
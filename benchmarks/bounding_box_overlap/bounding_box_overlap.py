@@ -1,4 +1,6 @@
 # Copyright (c) 2017, John Skinner
+import numpy as np
+import util.assignment
 import core.benchmark
 import benchmarks.bounding_box_overlap.bounding_box_overlap_result as bbox_result
 
@@ -12,21 +14,37 @@ class BoundingBoxOverlapBenchmark(core.benchmark.Benchmark):
     Final score is F1 score times detection confidence
     """
 
-    def __init__(self, id_=None):
+    def __init__(self, assignment='greedy', id_=None):
         """
-        Create a new benchmark instance. No configuration.
+        Create a new benchmark instance.
+        :param assignment: How to match detected bounding boxes to ground truth boxes:
+        'greedy' to repeatedly match the pair with the largest overlap, or 'optimal' for the matching
+        with the largest total overlap, found with the Hungarian algorithm. Default 'greedy'.
         """
         super().__init__(id_=id_)
+        if assignment == 'greedy' or assignment == 'optimal':
+            self._assignment = assignment
+        else:
+            self._assignment = 'greedy'
+
+    @property
+    def assignment(self):
+        return self._assignment
+
+    def get_settings(self):
+        return {
+            'assignment': self.assignment
+        }
 
     def serialize(self):
         output = super().serialize()
-        # output['initializing_is_lost'] = self._initializing_is_lost
+        output['assignment'] = self.assignment
         return output
 
     @classmethod
     def deserialize(cls, serialized_representation, db_client, **kwargs):
-        # if 'initializing_is_lost' in serialized_representation:
-        #    kwargs['initializing_is_lost'] = serialized_representation['initializing_is_lost']
+        if 'assignment' in serialized_representation:
+            kwargs['assignment'] = serialized_representation['assignment']
         return super().deserialize(serialized_representation, db_client, **kwargs)
 
     @classmethod
@@ -48,6 +66,39 @@ class BoundingBoxOverlapBenchmark(core.benchmark.Benchmark):
         ground_truth_bboxes = trial_result.get_ground_truth_bounding_boxes()
         detected_bboxes = trial_result.get_bounding_boxes()
 
+        # Gather the bounding boxes from every image, to compute all the overlaps at once
+        image_ids = [image_id for image_id in ground_truth_bboxes.keys() if image_id in detected_bboxes]
+        gt_list = [ground_truth_bboxes[image_id] for image_id in image_ids]
+        detected_list = [detected_bboxes[image_id] for image_id in image_ids]
+        gt_images, gt_indexes, detected_indexes, overlaps = compute_overlaps(gt_list, detected_list)
+
+        if self.assignment == 'optimal':
+            # Find the matching with the largest total overlap in each image
+            accepted = []
+            for image_idx in np.unique(gt_images):
+                in_image = np.nonzero(gt_images == image_idx)[0]
+                scores = np.zeros((len(gt_list[image_idx]), len(detected_list[image_idx])))
+                scores[gt_indexes[in_image], detected_indexes[in_image]] = overlaps[in_image]
+                rows, cols = util.assignment.optimal_assignment(scores)
+                pair_ids = np.full(scores.shape, -1, dtype=np.int64)
+                pair_ids[gt_indexes[in_image], detected_indexes[in_image]] = in_image
+                accepted.append(pair_ids[rows, cols][pair_ids[rows, cols] >= 0])
+            accepted = np.concatenate(accepted) if len(accepted) > 0 else np.zeros(0, dtype=np.int64)
+        else:
+            # Take the largest overlaps first, breaking ties by the highest ground truth and then detection index
+            gt_offsets = np.cumsum([0] + [len(bboxes) for bboxes in gt_list])
+            detected_offsets = np.cumsum([0] + [len(bboxes) for bboxes in detected_list])
+            order = np.lexsort((-detected_indexes, -gt_indexes, -overlaps))
+            accepted = order[util.assignment.greedy_assignment(
+                gt_offsets[gt_images[order]] + gt_indexes[order],
+                detected_offsets[gt_images[order]] + detected_indexes[order])]
+
+        matches = [[] for _ in range(len(image_ids))]
+        for image_idx, gt_idx, idx, overlap in zip(gt_images[accepted].tolist(), gt_indexes[accepted].tolist(),
+                                                    detected_indexes[accepted].tolist(), overlaps[accepted].tolist()):
+            matches[image_idx].append((gt_idx, idx, overlap))
+        matches = dict(zip(image_ids, matches))
+
         results = {}
         for image_id in ground_truth_bboxes.keys():
             results[image_id] = [{
@@ -60,30 +111,18 @@ class BoundingBoxOverlapBenchmark(core.benchmark.Benchmark):
             } for gt_bbox in ground_truth_bboxes[image_id]]
 
             if image_id in detected_bboxes:
-
-                potential_matches = [(compute_overlap(gt_bbox, bbox), gt_idx, idx)
-                                     for gt_idx, gt_bbox in enumerate(ground_truth_bboxes[image_id])
-                                     for idx, bbox in enumerate(detected_bboxes[image_id])]
-                potential_matches.sort(reverse=True)
-
-                gt_indexes = set(range(len(ground_truth_bboxes[image_id])))
                 bbox_indexes = set(range(len(detected_bboxes[image_id])))
-                for overlap, gt_idx, idx in potential_matches:
-                    if overlap <= 0:
-                        break
-                    if idx in bbox_indexes and gt_idx in gt_indexes:
-                        gt_indexes.remove(gt_idx)
-                        bbox_indexes.remove(idx)
-
-                        bbox = detected_bboxes[image_id][idx]
+                for gt_idx, idx, overlap in matches[image_id]:
+                    bbox_indexes.remove(idx)
+                    bbox = detected_bboxes[image_id][idx]
 
-                        results[image_id][gt_idx]['overlap'] = overlap
-                        results[image_id][gt_idx]['confidence'] = bbox.confidence
-                        results[image_id][gt_idx]['bounding_box_area'] = bbox.width * bbox.height
-                        results[image_id][gt_idx]['bounding_box_classes'] = bbox.class_names
+                    results[image_id][gt_idx]['overlap'] = overlap
+                    results[image_id][gt_idx]['confidence'] = bbox.confidence
+                    results[image_id][gt_idx]['bounding_box_area'] = bbox.width * bbox.height
+                    results[image_id][gt_idx]['bounding_box_classes'] = bbox.class_names
 
                 # Record results for additionally detected bboxes
-                for bbox_index in bbox_indexes:
+                for bbox_index in sorted(bbox_indexes):
                     bbox = detected_bboxes[image_id][bbox_index]
                     results[image_id].append({
                         'overlap': 0,
@@ -97,7 +136,74 @@ class BoundingBoxOverlapBenchmark(core.benchmark.Benchmark):
         return bbox_result.BoundingBoxOverlapBenchmarkResult(benchmark_id=self.identifier,
                                                              trial_result_id=trial_result.identifier,
                                                              overlaps=results,
-                                                             settings={})
+                                                             settings=self.get_settings())
+
+
+def compute_overlaps(gt_bboxes, detected_bboxes):
+    """
+    Compute the overlap area between every ground truth and detected bounding box in the same image,
+    for many images at once. Boxes that have no class names in common do not overlap.
+    :param gt_bboxes: A list of lists of ground truth bounding boxes, one list for each image
+    :param detected_bboxes: A list of lists of detected bounding boxes, for the same images
+    :return: Four arrays of the same length, one entry for each pair of boxes with a positive overlap:
+    The image index, the index of the ground truth box in that image, the index of the detected box in that image,
+    and the area of overlap.
+    """
+    gt_counts = np.array([len(bboxes) for bboxes in gt_bboxes], dtype=np.int64)
+    detected_counts = np.array([len(bboxes) for bboxes in detected_bboxes], dtype=np.int64)
+    all_gt = [bbox for bboxes in gt_bboxes for bbox in bboxes]
+    all_detected = [bbox for bboxes in detected_bboxes for bbox in bboxes]
+    if len(all_gt) <= 0 or len(all_detected) <= 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, np.zeros(0, dtype=np.int64)
+
+    # Every pair of a ground truth box and a detected box from the same image
+    gt_images = np.repeat(np.arange(len(gt_counts)), gt_counts)
+    pair_counts = detected_counts[gt_images]
+    pair_gt = np.repeat(np.arange(len(all_gt)), pair_counts)
+    pair_images = gt_images[pair_gt]
+    detected_starts = np.cumsum(detected_counts) - detected_counts
+    pair_detected = (np.arange(len(pair_gt)) - np.repeat(np.cumsum(pair_counts) - pair_counts, pair_counts) +
+                     detected_starts[pair_images])
+
+    # Only boxes sharing a class can overlap. Each box gets a bitmask of its classes, 64 classes per word.
+    class_ids = {}
+    for bbox in all_gt + all_detected:
+        for class_name in bbox.class_names:
+            class_ids.setdefault(class_name, len(class_ids))
+    gt_classes = _make_class_masks(all_gt, class_ids)
+    detected_classes = _make_class_masks(all_detected, class_ids)
+    shares_class = np.any((gt_classes[pair_gt] & detected_classes[pair_detected]) != 0, axis=1)
+
+    gt_coords = np.array([(bbox.x, bbox.y, bbox.width, bbox.height) for bbox in all_gt])
+    detected_coords = np.array([(bbox.x, bbox.y, bbox.width, bbox.height) for bbox in all_detected])
+    gt_coords = gt_coords[pair_gt]
+    detected_coords = detected_coords[pair_detected]
+    overlap_x = np.maximum(gt_coords[:, 0], detected_coords[:, 0])
+    overlap_y = np.maximum(gt_coords[:, 1], detected_coords[:, 1])
+    overlap_upper_x = np.minimum(gt_coords[:, 0] + gt_coords[:, 2], detected_coords[:, 0] + detected_coords[:, 2])
+    overlap_upper_y = np.minimum(gt_coords[:, 1] + gt_coords[:, 3], detected_coords[:, 1] + detected_coords[:, 3])
+    valid = shares_class & (overlap_upper_x > overlap_x) & (overlap_upper_y > overlap_y)
+
+    gt_offsets = np.cumsum(gt_counts) - gt_counts
+    return (pair_images[valid], pair_gt[valid] - gt_offsets[pair_images[valid]],
+            pair_detected[valid] - detected_starts[pair_images[valid]],
+            (overlap_upper_x[valid] - overlap_x[valid]) * (overlap_upper_y[valid] - overlap_y[valid]))
+
+
+def _make_class_masks(bboxes, class_ids):
+    """
+    Make a bitmask of the classes of each bounding box
+    :param bboxes: A list of bounding boxes
+    :param class_ids: A map of class name to bit index
+    :return: An NxW array of unsigned 64 bit integers, where W is the number of words needed for all the classes
+    """
+    masks = np.zeros((len(bboxes), max(1, (len(class_ids) + 63) // 64)), dtype=np.uint64)
+    for idx, bbox in enumerate(bboxes):
+        for class_name in bbox.class_names:
+            class_id = class_ids[class_name]
+            masks[idx, class_id // 64] |= np.uint64(1) << np.uint64(class_id % 64)
+    return masks
 
 
 def compute_overlap(bbox1, bbox2):
@@ -1,5 +1,6 @@
 # Copyright (c) 2017, John Skinner
 import unittest
+import numpy as np
 import bson.objectid as oid
 import database.tests.test_entity
 import core.benchmark
@@ -44,6 +45,7 @@ class TestBoundingBoxOverlapBenchmark(database.tests.test_entity.EntityContract,
                 not isinstance(benchmark2, bbox_overlap.BoundingBoxOverlapBenchmark)):
             self.fail('object was not a BoundingBoxOverlapBenchmark')
         self.assertEqual(benchmark1.identifier, benchmark2.identifier)
+        self.assertEqual(benchmark1.assignment, benchmark2.assignment)
 
     def test_benchmark_results_returns_a_benchmark_result(self):
         trial_result = MockTrialResult(
@@ -253,3 +255,91 @@ class TestBoundingBoxOverlapBenchmark(database.tests.test_entity.EntityContract,
         bbox1 = bbox_trial.BoundingBox({'cup'}, 1, 15, 22, 10, 10)
         bbox2 = bbox_trial.BoundingBox({'cup'}, 1, 190, 197, 10, 10)
         self.assertEqual(0, bbox_overlap.compute_overlap(bbox1, bbox2))
+
+    def test_compute_overlaps_matches_compute_overlap(self):
+        random = np.random.RandomState(7123)
+        gt_bboxes = [make_random_bboxes(random, random.randint(0, 10)) for _ in range(10)]
+        detected_bboxes = [make_random_bboxes(random, random.randint(0, 10)) for _ in range(10)]
+        image_idx, gt_idx, idx, overlaps = bbox_overlap.compute_overlaps(gt_bboxes, detected_bboxes)
+        found = {(i, g, d): overlap for i, g, d, overlap in zip(image_idx, gt_idx, idx, overlaps)}
+        for i in range(10):
+            for g, gt_bbox in enumerate(gt_bboxes[i]):
+                for d, bbox in enumerate(detected_bboxes[i]):
+                    self.assertEqual(bbox_overlap.compute_overlap(gt_bbox, bbox), found.get((i, g, d), 0))
+
+    def test_greedy_assignment_matches_pairwise_greedy_matching(self):
+        random = np.random.RandomState(2251)
+        gt_bboxes = {oid.ObjectId(): make_random_bboxes(random, random.randint(0, 20)) for _ in range(10)}
+        bboxes = {image_id: make_random_bboxes(random, random.randint(0, 20)) for image_id in gt_bboxes.keys()}
+        result = bbox_overlap.BoundingBoxOverlapBenchmark().benchmark_results(MockTrialResult(gt_bboxes, bboxes))
+        for image_id in gt_bboxes.keys():
+            self.assertEqual(greedy_match_bboxes(gt_bboxes[image_id], bboxes[image_id]), result.overlaps[image_id])
+
+    def test_optimal_assignment_maximises_total_overlap(self):
+        id1 = oid.ObjectId()
+        # Greedy takes the largest overlap first, which leaves the second ground truth box without a match
+        trial_result = MockTrialResult(
+            gt_bboxes={
+                id1: [bbox_trial.BoundingBox({'cup'}, 1, 0, 0, 19, 1),
+                      bbox_trial.BoundingBox({'cup'}, 1, 2, 0, 8, 1)]
+            },
+            bboxes={
+                id1: [bbox_trial.BoundingBox({'cup'}, 1, 0, 0, 10, 1),
+                      bbox_trial.BoundingBox({'cup'}, 1, 10, 0, 9, 1)],
+            }
+        )
+        result = bbox_overlap.BoundingBoxOverlapBenchmark().benchmark_results(trial_result)
+        self.assertEqual(10, result.overlaps[id1][0]['overlap'])
+        self.assertEqual(0, result.overlaps[id1][1]['overlap'])
+        self.assertEqual(3, len(result.overlaps[id1]))
+
+        result = bbox_overlap.BoundingBoxOverlapBenchmark(assignment='optimal').benchmark_results(trial_result)
+        self.assertEqual(9, result.overlaps[id1][0]['overlap'])
+        self.assertEqual(8, result.overlaps[id1][1]['overlap'])
+        self.assertEqual(2, len(result.overlaps[id1]))
+
+
+def make_random_bboxes(random, count):
+    return [bbox_trial.BoundingBox(random.choice(['cup', 'car', 'cat'], random.randint(1, 3), replace=False),
+                                   random.uniform(0, 1), random.randint(0, 100), random.randint(0, 100),
+                                   random.randint(1, 60), random.randint(1, 60))
+            for _ in range(count)]
+
+
+def greedy_match_bboxes(gt_bboxes, bboxes):
+    """
+    Match the bounding boxes by sorting all the pairs by overlap, and taking them one at a time
+    """
+    results = [{
+        'overlap': 0,
+        'bounding_box_area': 0,
+        'ground_truth_area': gt_bbox.height * gt_bbox.width,
+        'confidence': 0,
+        'bounding_box_classes': tuple(),
+        'ground_truth_classes': gt_bbox.class_names
+    } for gt_bbox in gt_bboxes]
+    potential_matches = sorted(((bbox_overlap.compute_overlap(gt_bbox, bbox), gt_idx, idx)
+                                for gt_idx, gt_bbox in enumerate(gt_bboxes)
+                                for idx, bbox in enumerate(bboxes)), reverse=True)
+    gt_indexes = set(range(len(gt_bboxes)))
+    bbox_indexes = set(range(len(bboxes)))
+    for overlap, gt_idx, idx in potential_matches:
+        if overlap <= 0:
+            break
+        if idx in bbox_indexes and gt_idx in gt_indexes:
+            gt_indexes.remove(gt_idx)
+            bbox_indexes.remove(idx)
+            results[gt_idx]['overlap'] = overlap
+            results[gt_idx]['confidence'] = bboxes[idx].confidence
+            results[gt_idx]['bounding_box_area'] = bboxes[idx].width * bboxes[idx].height
+            results[gt_idx]['bounding_box_classes'] = bboxes[idx].class_names
+    for idx in sorted(bbox_indexes):
+        results.append({
+            'overlap': 0,
+            'bounding_box_area': bboxes[idx].height * bboxes[idx].width,
+            'ground_truth_area': 0,
+            'confidence': bboxes[idx].confidence,
+            'bounding_box_classes': bboxes[idx].class_names,
+            'ground_truth_classes': tuple()
+        })
+    return results
@@ -2,6 +2,8 @@
 import logging
 import pickle
 import numpy as np
+import util.spatial_index
+import util.assignment
 import core.trial_comparison
 import core.benchmark
 import trials.feature_detection.feature_detector_result as detector_result
@@ -26,39 +28,23 @@ class FeatureDetectionComparison(core.trial_comparison.TrialComparison):
                                                       reference_trial_result.identifier))
 
         # First, we need to find images taken from the same place
-        matching_timestamps = [
-            (image_id1, image_id2)
-            for image_id1 in trial_result.camera_poses.keys()
-            for image_id2 in reference_trial_result.camera_poses.keys()
-            if is_pose_similar(trial_result.camera_poses[image_id1], reference_trial_result.camera_poses[image_id2])
-        ]
+        matching_timestamps = find_similar_poses(trial_result.camera_poses, reference_trial_result.camera_poses)
         if len(matching_timestamps) <= 0:
             return core.benchmark.FailedBenchmark(self.identifier, reference_trial_result.identifier,
                                                   "Given trials were never in the same place")
         # Then, for each pair of images, find changes in detected features
         results = []
         for trial_image_id, reference_image_id in matching_timestamps:
-            points1 = {point.pt for point in trial_result.keypoints[trial_image_id]}
-            points2 = {point.pt for point in reference_trial_result.keypoints[reference_image_id]}
-            potential_matches = sorted(
-                (point_dist(point1, point2), point1, point2)
-                for point1 in points1
-                for point2 in points2
-                if point_dist(point1, point2) < self._acceptable_radius * self._acceptable_radius)
-            point_matches = []
-            for match in potential_matches:
-                coords1 = match[1]
-                coords2 = match[2]
-                if coords1 in points1 and coords2 in points2:
-                    points1.remove(coords1)
-                    points2.remove(coords2)
-                    point_matches.append((match[1], match[2]))
+            point_matches, new_trial_points, missing_reference_points = match_points(
+                {point.pt for point in trial_result.keypoints[trial_image_id]},
+                {point.pt for point in reference_trial_result.keypoints[reference_image_id]},
+                self._acceptable_radius)
             results.append({
                 'trial_image_id': trial_image_id,
                 'reference_image_id': reference_image_id,
                 'point_matches': point_matches,
-                'new_trial_points': list(points1),
-                'missing_reference_points': list(points2)
+                'new_trial_points': new_trial_points,
+                'missing_reference_points': missing_reference_points
             })
         return FeatureDetectionComparisonResult(
             benchmark_id=self.identifier,
@@ -152,6 +138,75 @@ def is_pose_similar(pose1, pose2):
                                                        np.dot(rot_diff2, rot_diff2) < 0.001)
 
 
+def find_similar_poses(poses1, poses2):
+    """
+    Find all the pairs of poses that are similar, as is_pose_similar, between two sets of poses.
+    Rather than comparing every pose to every other pose, this searches a spatial index of the locations,
+    and only checks the orientations of the poses that are close enough together.
+    :param poses1: A dict of id to Transform
+    :param poses2: Another dict of id to Transform
+    :return: A list of pairs of ids (id1, id2) for similar poses, in the order of the first and then second dicts
+    """
+    ids1 = list(poses1.keys())
+    ids2 = list(poses2.keys())
+    if len(ids1) <= 0 or len(ids2) <= 0:
+        return []
+    locations1 = np.array([poses1[pose_id].location for pose_id in ids1])
+    locations2 = np.array([poses2[pose_id].location for pose_id in ids2])
+    quats1 = np.array([poses1[pose_id].rotation_quat(w_first=True) for pose_id in ids1])
+    quats2 = np.array([poses2[pose_id].rotation_quat(w_first=True) for pose_id in ids2])
+
+    # Search slightly further than the threshold, the exact threshold is checked below
+    radius = np.sqrt(0.001) * 1.001
+    spatial_index = util.spatial_index.GridIndex(locations2, radius)
+    indexes1, indexes2, _ = spatial_index.query_radius(locations1, radius)
+
+    trans_diff = locations1[indexes1] - locations2[indexes2]
+    rot_diff1 = quats1[indexes1] - quats2[indexes2]
+    rot_diff2 = quats1[indexes1] + quats2[indexes2]
+    similar = ((np.sum(trans_diff * trans_diff, axis=1) < 0.001) &
+               ((np.sum(rot_diff1 * rot_diff1, axis=1) < 0.001) | (np.sum(rot_diff2 * rot_diff2, axis=1) < 0.001)))
+    return [(ids1[idx1], ids2[idx2]) for idx1, idx2 in zip(indexes1[similar], indexes2[similar])]
+
+
+def match_points(points1, points2, radius):
+    """
+    Greedily match two sets of feature points, closest first, such that each point matches at most one other.
+    Ties in distance are broken by the coordinates of the first and then the second point.
+    Candidate matches are found with a spatial index, and then assigned with util.assignment.greedy_assignment,
+    which gives the same matches as taking the sorted candidates one at a time.
+    :param points1: A set of (x, y) point coordinates
+    :param points2: Another set of (x, y) point coordinates
+    :param radius: The maximum distance between matched points, exclusive
+    :return: A list of matched pairs of points (point1, point2), in the order they were matched,
+    followed by a list of the unmatched points from points1, and a list of the unmatched points from points2
+    """
+    points1 = set(points1)
+    points2 = set(points2)
+    list1 = list(points1)
+    list2 = list(points2)
+    radius = abs(radius)
+    if len(list1) <= 0 or len(list2) <= 0 or radius <= 0:
+        return [], list(points1), list(points2)
+    coords1 = np.array(list1, dtype=np.float64).reshape(-1, 2)
+    coords2 = np.array(list2, dtype=np.float64).reshape(-1, 2)
+
+    spatial_index = util.spatial_index.GridIndex(coords2, radius)
+    indexes1, indexes2, square_dist = spatial_index.query_radius(coords1, radius)
+    order = np.lexsort((coords2[indexes2, 1], coords2[indexes2, 0],
+                        coords1[indexes1, 1], coords1[indexes1, 0], square_dist))
+    indexes1 = indexes1[order]
+    indexes2 = indexes2[order]
+
+    accepted = util.assignment.greedy_assignment(indexes1, indexes2)
+    point_matches = []
+    for idx1, idx2 in zip(indexes1[accepted], indexes2[accepted]):
+        points1.remove(list1[idx1])
+        points2.remove(list2[idx2])
+        point_matches.append((list1[idx1], list2[idx2]))
+    return point_matches, list(points1), list(points2)
+
+
 def point_dist(point1, point2):
     """
     Get the square euclidean distance between feature points
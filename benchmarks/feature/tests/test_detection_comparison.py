@@ -136,3 +136,62 @@ class TestFeatureDetectionComparisonResult(entity_test.EntityContract, unittest.
         self.assertTrue(mock_db_client.grid_fs.put.called)
         stored_changes = pickle.loads(mock_db_client.grid_fs.put.call_args[0][0])
         self.assertEqual(self.changes, stored_changes)
+
+
+class TestFindSimilarPoses(unittest.TestCase):
+
+    def test_matches_pairwise_comparison(self):
+        random = np.random.RandomState(5512)
+        poses1 = {bson.ObjectId(): tf.Transform(location=random.uniform(-0.1, 0.1, 3),
+                                                rotation=random.uniform(-0.05, 0.05, 3))
+                  for _ in range(100)}
+        poses2 = {bson.ObjectId(): tf.Transform(location=random.uniform(-0.1, 0.1, 3),
+                                                rotation=random.uniform(-0.05, 0.05, 3))
+                  for _ in range(100)}
+        # Some poses with quaternions of opposite sign, which are the same orientation
+        for pose_id, pose in list(poses1.items())[:10]:
+            poses2[bson.ObjectId()] = tf.Transform(location=pose.location, rotation=-pose.rotation_quat(True),
+                                                   w_first=True)
+        expected = [(id1, id2) for id1 in poses1.keys() for id2 in poses2.keys()
+                    if detection_comp.is_pose_similar(poses1[id1], poses2[id2])]
+        self.assertGreater(len(expected), 10)
+        self.assertEqual(expected, detection_comp.find_similar_poses(poses1, poses2))
+
+
+class TestMatchPoints(unittest.TestCase):
+
+    def test_matches_sorted_greedy_matching(self):
+        random = np.random.RandomState(9216)
+        for _ in range(10):
+            # Integer coordinates, so that there are lots of ties
+            points1 = {(float(p[0]), float(p[1])) for p in random.randint(0, 100, (300, 2))}
+            points2 = {(float(p[0]), float(p[1])) for p in random.randint(0, 100, (300, 2))}
+            point_matches, new_points, missing_points = detection_comp.match_points(points1, points2, 4)
+            expected_matches, expected_new, expected_missing = greedy_match_points(points1, points2, 4)
+            self.assertEqual(expected_matches, point_matches)
+            self.assertEqual(set(expected_new), set(new_points))
+            self.assertEqual(set(expected_missing), set(missing_points))
+
+    def test_handles_no_points(self):
+        self.assertEqual(([], [], [(1.0, 2.0)]), detection_comp.match_points(set(), {(1.0, 2.0)}, 4))
+        self.assertEqual(([], [(1.0, 2.0)], []), detection_comp.match_points({(1.0, 2.0)}, set(), 4))
+
+
+def greedy_match_points(points1, points2, radius):
+    """
+    Match points by sorting every pair within the radius, and taking them one at a time
+    """
+    points1 = set(points1)
+    points2 = set(points2)
+    potential_matches = sorted(
+        (detection_comp.point_dist(point1, point2), point1, point2)
+        for point1 in points1
+        for point2 in points2
+        if detection_comp.point_dist(point1, point2) < radius * radius)
+    point_matches = []
+    for _, point1, point2 in potential_matches:
+        if point1 in points1 and point2 in points2:
+            points1.remove(point1)
+            points2.remove(point2)
+            point_matches.append((point1, point2))
+    return point_matches, list(points1), list(points2)
@@ -1,6 +1,7 @@
 # Copyright (c) 2017, John Skinner
 import numpy as np
 import core.benchmark
+import util.spatial_index
 import benchmarks.matching.matching_result as match_res
 
 
@@ -85,7 +86,6 @@ class BenchmarkLoopClosure(core.benchmark.Benchmark):
             # TODO: Maybe need to resolve differences between closure indexes and pose indexes
             image_location = poses[idx].location
             match_location = poses[closure_index].location
-            indexes.remove(idx)
 
             diff = match_location - image_location
             square_dist = np.dot(diff, diff)
@@ -100,21 +100,23 @@ class BenchmarkLoopClosure(core.benchmark.Benchmark):
                 # wasn't close enough to current location, or was trivial.
                 matches[idx] = match_res.MatchType.FALSE_POSITIVE
 
-        # Now go through all the remaining indexes to make sure there was not a match there
-        for unmatched_idx in indexes:
-            unmatched_pose = poses[unmatched_idx].location
-            found_closure = False
-            for index, pose in poses.items():
-                if index < unmatched_idx - self.trivial_closure_index_distance:
-                    diff = unmatched_pose - pose.location
-                    square_dist = np.dot(diff, diff)
-
-                    if square_dist < threshold_distance_squared:
-                        matches[unmatched_idx] = match_res.MatchType.FALSE_NEGATIVE
-                        found_closure = True
-                        break
-            if not found_closure:
-                matches[unmatched_idx] = match_res.MatchType.TRUE_NEGATIVE
+        # Now go through all the remaining indexes to make sure there was not a match there.
+        # There was a closure if there is an earlier pose within the threshold distance, outside the trivial window.
+        unmatched = np.array([pos for pos, idx in enumerate(indexes) if idx not in matches], dtype=np.int64)
+        found_closure = np.zeros(len(unmatched), dtype=bool)
+        if len(unmatched) > 0 and threshold_distance_squared > 0:
+            locations = np.array([poses[idx].location for idx in indexes])
+            index_array = np.array(indexes)
+            earliest_trivial = np.searchsorted(
+                index_array, index_array[unmatched] - self.trivial_closure_index_distance, side='left')
+            spatial_index = util.spatial_index.GridIndex(locations, abs(self.threshold_distance))
+            found_closure = spatial_index.any_within(locations[unmatched], abs(self.threshold_distance),
+                                                     max_index=earliest_trivial)
+        for pos, found in zip(unmatched, found_closure):
+            if found:
+                matches[indexes[pos]] = match_res.MatchType.FALSE_NEGATIVE
+            else:
+                matches[indexes[pos]] = match_res.MatchType.TRUE_NEGATIVE
 
         return match_res.MatchBenchmarkResult(benchmark_id=self.identifier,
                                               trial_result_id=trial_result.identifier,
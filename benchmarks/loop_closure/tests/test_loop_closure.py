@@ -218,3 +218,19 @@ class TestBenchmarkLoopClosure(database.tests.test_entity.EntityContract, unitte
             trial_result.loop_closures = {idx: closure}
             result = benchmark.benchmark_results(trial_result)
             self.assertEqual(match_res.MatchType.TRUE_POSITIVE, result.matches[idx])
+
+    def test_negatives_match_exhaustive_search(self):
+        random = np.random.RandomState(4411)
+        trajectory = {idx: tf.Transform(location=random.uniform(-100, 100, 3), rotation=(0, 0, 0, 1))
+                      for idx in range(300)}
+        trial_result = MockTrialResult(gt_trajectory=trajectory, loop_closures={150: 20})
+        benchmark = lc.BenchmarkLoopClosure(distance_threshold=15, trivial_closure_index_distance=5)
+        result = benchmark.benchmark_results(trial_result)
+
+        for idx, pose in trajectory.items():
+            if idx == 150:
+                continue
+            has_closure = any(np.linalg.norm(pose.location - other.location) < 15
+                              for other_idx, other in trajectory.items() if other_idx < idx - 5)
+            self.assertEqual(match_res.MatchType.FALSE_NEGATIVE if has_closure else match_res.MatchType.TRUE_NEGATIVE,
+                             result.matches[idx])
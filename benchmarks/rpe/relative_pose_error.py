@@ -39,9 +39,9 @@ This script computes the relative pose error from the ground truth trajectory
 and the estimated trajectory.
 """
 
-import random
 import numpy
 import core.benchmark
+import util.trajectory
 import benchmarks.rpe.rpe_result
 
 
@@ -174,8 +174,11 @@ class BenchmarkRPE(core.benchmark.Benchmark):
         ground_truth_traj = trial_result.get_ground_truth_camera_poses()
         result_traj = trial_result.get_computed_camera_poses()
 
-        ground_truth_traj = {stamp: pose.transform_matrix for stamp, pose in ground_truth_traj.items()}
-        result_traj = {stamp: pose.transform_matrix for stamp, pose in result_traj.items()}
+        # Build all the transform matrices at once, rather than one pose at a time
+        ground_truth_traj = util.trajectory.Trajectory.from_poses(ground_truth_traj)
+        ground_truth_traj = dict(zip(ground_truth_traj.keys(), ground_truth_traj.transform_matrices))
+        result_traj = util.trajectory.Trajectory.from_poses(result_traj)
+        result_traj = dict(zip(result_traj.keys(), result_traj.transform_matrices))
 
         result = evaluate_trajectory(traj_gt=ground_truth_traj,
                                      traj_est=result_traj,
@@ -191,7 +194,6 @@ class BenchmarkRPE(core.benchmark.Benchmark):
                                                   reason="Couldn't find matching timestamp pairs between"
                                                          "groundtruth and estimated trajectory!")
 
-        result = numpy.array(result)
         gt_post_timestamps = result[:, 3]
         trans_error = result[:, 4]
         rot_error = result[:, 5]
@@ -230,6 +232,46 @@ def find_closest_index(L, t):
     return best
 
 
+def find_closest_indices(L, t):
+    """
+    Find the index of the closest value in a sorted array for many values at once.
+    This runs the same binary search as find_closest_index for all the values together,
+    so that it picks the same index when two elements are equally close.
+
+    Input:
+    L -- the sorted array
+    t -- the array of values to be found
+
+    Output:
+    array of indexes of the closest elements, the same shape as t
+    """
+    L = numpy.asarray(L, dtype=numpy.float64)
+    t = numpy.asarray(t, dtype=numpy.float64)
+    beginning = numpy.zeros(t.shape, dtype=numpy.int64)
+    end = numpy.full(t.shape, len(L), dtype=numpy.int64)
+    best = numpy.zeros(t.shape, dtype=numpy.int64)
+    difference = numpy.abs(L[0] - t)
+    active = beginning < end
+    while numpy.any(active):
+        middle = (end + beginning) // 2
+        middle_value = L[numpy.minimum(middle, len(L) - 1)]
+        middle_difference = numpy.abs(middle_value - t)
+
+        improved = active & (middle_difference < difference)
+        difference = numpy.where(improved, middle_difference, difference)
+        best = numpy.where(improved, middle, best)
+
+        found = active & (t == middle_value)
+        best = numpy.where(found, middle, best)
+        go_left = active & ~found & (middle_value > t)
+        go_right = active & ~found & ~(middle_value > t)
+        end = numpy.where(go_left, middle, end)
+        beginning = numpy.where(go_right, middle + 1, beginning)
+        end = numpy.where(found, beginning, end)   # Stop searching once we find an exact match
+        active = beginning < end
+    return best
+
+
 def ominus(a, b):
     """
     Compute the relative 3D transformation between a and b.
@@ -271,40 +313,59 @@ def compute_angle(transform):
     return numpy.arccos(min(1, max(-1, (numpy.trace(transform[0:3, 0:3]) - 1) / 2)))
 
 
+def compute_distances(transforms):
+    """
+    Compute the distance of the translational component of a stack of 4x4 homogeneous matrices.
+    """
+    return numpy.linalg.norm(transforms[:, 0:3, 3], axis=1)
+
+
+def compute_angles(transforms):
+    """
+    Compute the rotation angles from a stack of 4x4 homogeneous matrices.
+    """
+    return numpy.arccos(numpy.clip((numpy.trace(transforms[:, 0:3, 0:3], axis1=1, axis2=2) - 1) / 2, -1, 1))
+
+
+def stack_trajectory(traj):
+    """
+    Sort a trajectory by time, and stack the poses into a single array.
+
+    Input:
+    traj -- a dict of timestamp to 4x4 homogeneous matrix
+
+    Output:
+    the sorted timestamps, and an Nx4x4 array of poses in the same order
+    """
+    stamps = sorted(traj.keys())
+    if len(stamps) <= 0:
+        return numpy.zeros(0), numpy.zeros((0, 4, 4))
+    return numpy.array(stamps, dtype=numpy.float64), numpy.stack([traj[stamp] for stamp in stamps])
+
+
 def distances_along_trajectory(traj):
     """
     Compute the translational distances along a trajectory.
     """
-    keys = traj.keys()
-    keys.sort()
-    motion = [ominus(traj[keys[i + 1]], traj[keys[i]]) for i in range(len(keys) - 1)]
-    distances = [0]
-    total = 0
-    for t in motion:
-        total += compute_distance(t)
-        distances.append(total)
-    return distances
+    _, poses = stack_trajectory(traj)
+    motion = numpy.matmul(numpy.linalg.inv(poses[1:]), poses[:-1])
+    return numpy.concatenate(([0], numpy.cumsum(compute_distances(motion))))
 
 
 def rotations_along_trajectory(traj, scale_):
     """
     Compute the angular rotations along a trajectory.
     """
-    keys = traj.keys()
-    keys.sort()
-    motion = [ominus(traj[keys[i + 1]], traj[keys[i]]) for i in range(len(keys) - 1)]
-    distances = [0]
-    total = 0
-    for t in motion:
-        total += compute_angle(t) * scale_
-        distances.append(total)
-    return distances
+    _, poses = stack_trajectory(traj)
+    motion = numpy.matmul(numpy.linalg.inv(poses[1:]), poses[:-1])
+    return numpy.concatenate(([0], numpy.cumsum(compute_angles(motion) * scale_)))
 
 
 def evaluate_trajectory(traj_gt, traj_est, param_max_pairs=10000, param_fixed_delta=False, param_delta=1.00,
-                        param_delta_unit="s", param_offset=0.00, param_scale=1.00):
+                        param_delta_unit="s", param_offset=0.00, param_scale=1.00, param_seed=None):
     """
     Compute the relative pose error between two trajectories.
+    All the pairs are evaluated at once as stacks of matrices, rather than one pair at a time.
 
     Input:
     traj_gt -- the first trajectory (ground truth)
@@ -321,28 +382,26 @@ def evaluate_trajectory(traj_gt, traj_est, param_max_pairs=10000, param_fixed_de
                         "f": frames
     param_offset -- time offset between two trajectories (to model the delay)
     param_scale -- scale to be applied to the second trajectory
+    param_seed -- seed for the random choice of pairs, or a numpy RandomState. None for a different choice each time.
 
     Output:
-    list of compared poses and the resulting translation and rotation error
+    Nx6 array of compared poses and the resulting translation and rotation error, where each row is
+    (stamp_est_0, stamp_est_1, stamp_gt_0, stamp_gt_1, trans, rot), or None if the trajectories do not match.
     """
-    stamps_gt = list(traj_gt.keys())
-    stamps_est = list(traj_est.keys())
-    stamps_gt.sort()
-    stamps_est.sort()
-
-    stamps_est_return = []
-    for t_est in stamps_est:
-        t_gt = stamps_gt[find_closest_index(stamps_gt, t_est + param_offset)]
-        t_est_return = stamps_est[find_closest_index(stamps_est, t_gt - param_offset)]
-        # t_gt_return = stamps_gt[find_closest_index(stamps_gt, t_est_return + param_offset)]
-        if t_est_return not in stamps_est_return:
-            stamps_est_return.append(t_est_return)
-    if len(stamps_est_return) < 2:
+    stamps_gt, poses_gt = stack_trajectory(traj_gt)
+    stamps_est, poses_est = stack_trajectory(traj_est)
+    if len(stamps_gt) <= 0 or len(stamps_est) <= 0:
+        return None
+
+    # Each estimated stamp is matched to the closest ground truth stamp, and back again.
+    # We need at least two different estimated stamps to come back.
+    closest_gt = find_closest_indices(stamps_gt, stamps_est + param_offset)
+    stamps_est_return = find_closest_indices(stamps_est, stamps_gt[closest_gt] - param_offset)
+    if len(numpy.unique(stamps_est_return)) < 2:
         return None
 
     if param_delta_unit == "s":
-        index_est = list(traj_est.keys())
-        index_est.sort()
+        index_est = stamps_est
     elif param_delta_unit == "m":
         index_est = distances_along_trajectory(traj_est)
     elif param_delta_unit == "rad":
@@ -350,46 +409,55 @@ def evaluate_trajectory(traj_gt, traj_est, param_max_pairs=10000, param_fixed_de
     elif param_delta_unit == "deg":
         index_est = rotations_along_trajectory(traj_est, 180 / numpy.pi)
     elif param_delta_unit == "f":
-        index_est = range(len(traj_est))
+        index_est = numpy.arange(len(stamps_est))
     else:
         raise Exception("Unknown unit for delta: '%s'" % param_delta_unit)
 
+    if isinstance(param_seed, numpy.random.RandomState):
+        random_state = param_seed
+    else:
+        random_state = numpy.random.RandomState(param_seed)
+    num_est = len(stamps_est)
     if not param_fixed_delta:
-        if param_max_pairs == 0 or len(traj_est) < numpy.sqrt(param_max_pairs):
-            pairs = [(i, j) for i in range(len(traj_est)) for j in range(len(traj_est))]
+        if param_max_pairs == 0 or num_est < numpy.sqrt(param_max_pairs):
+            pairs_i, pairs_j = numpy.indices((num_est, num_est)).reshape(2, -1)
         else:
-            pairs = [(random.randint(0, len(traj_est) - 1), random.randint(0, len(traj_est) - 1))
-                     for _ in range(param_max_pairs)]
+            pairs_i, pairs_j = random_state.randint(0, num_est, size=(2, param_max_pairs))
     else:
-        pairs = []
-        for i in range(len(traj_est)):
-            j = find_closest_index(index_est, index_est[i] + param_delta)
-            if j != len(traj_est) - 1:
-                pairs.append((i, j))
-        if param_max_pairs != 0 and len(pairs) > param_max_pairs:
-            pairs = random.sample(pairs, param_max_pairs)
-
-    gt_interval = numpy.median([s - t for s, t in zip(stamps_gt[1:], stamps_gt[:-1])])
+        pairs_i = numpy.arange(num_est)
+        pairs_j = find_closest_indices(index_est, index_est + param_delta)
+        valid = pairs_j != num_est - 1
+        pairs_i = pairs_i[valid]
+        pairs_j = pairs_j[valid]
+        if param_max_pairs != 0 and len(pairs_i) > param_max_pairs:
+            chosen = random_state.choice(len(pairs_i), param_max_pairs, replace=False)
+            pairs_i = pairs_i[chosen]
+            pairs_j = pairs_j[chosen]
+
+    gt_interval = numpy.median(stamps_gt[1:] - stamps_gt[:-1])
     gt_max_time_difference = 2 * gt_interval
 
-    result = []
-    for i, j in pairs:
-        stamp_est_0 = stamps_est[i]
-        stamp_est_1 = stamps_est[j]
-
-        stamp_gt_0 = stamps_gt[find_closest_index(stamps_gt, stamp_est_0 + param_offset)]
-        stamp_gt_1 = stamps_gt[find_closest_index(stamps_gt, stamp_est_1 + param_offset)]
-
-        if (abs(stamp_gt_0 - (stamp_est_0 + param_offset)) > gt_max_time_difference or
-                abs(stamp_gt_1 - (stamp_est_1 + param_offset)) > gt_max_time_difference):
-            continue
-
-        error44 = ominus(scale(
-            ominus(traj_est[stamp_est_1], traj_est[stamp_est_0]), param_scale),
-            ominus(traj_gt[stamp_gt_1], traj_gt[stamp_gt_0]))
-
-        trans = compute_distance(error44)
-        rot = compute_angle(error44)
-
-        result.append([stamp_est_0, stamp_est_1, stamp_gt_0, stamp_gt_1, trans, rot])
-    return result
+    # Drop pairs where either end is too far from the nearest ground truth
+    close_enough = ~(numpy.abs(stamps_gt[closest_gt] - (stamps_est + param_offset)) > gt_max_time_difference)
+    valid = close_enough[pairs_i] & close_enough[pairs_j]
+    pairs_i = pairs_i[valid]
+    pairs_j = pairs_j[valid]
+    pairs_gt_0 = closest_gt[pairs_i]
+    pairs_gt_1 = closest_gt[pairs_j]
+
+    # Invert each pose once, rather than once for every pair it is part of
+    inv_est = numpy.linalg.inv(poses_est)
+    inv_gt = numpy.linalg.inv(poses_gt)
+    motion_est = numpy.matmul(inv_est[pairs_j], poses_est[pairs_i])
+    motion_est[:, 0:3, 3] *= param_scale
+    motion_gt = numpy.matmul(inv_gt[pairs_gt_1], poses_gt[pairs_gt_0])
+    error44 = numpy.matmul(numpy.linalg.inv(motion_est), motion_gt)
+
+    return numpy.stack((
+        stamps_est[pairs_i],
+        stamps_est[pairs_j],
+        stamps_gt[pairs_gt_0],
+        stamps_gt[pairs_gt_1],
+        compute_distances(error44),
+        compute_angles(error44)
+    ), axis=1)
@@ -196,3 +196,77 @@ class TestBenchmarkRPE(database.tests.test_entity.EntityContract, unittest.TestC
         result = benchmark.benchmark_results(self.trial_result)
         self.assertLess(result.trans_max, unscaled_result.trans_max)
         # We don't test rotation error, it isn't affected by scale
+
+
+class TestEvaluateTrajectory(unittest.TestCase):
+
+    def setUp(self):
+        self.random = np.random.RandomState(1523)
+        trajectory = create_random_trajectory(self.random, length=30)
+        noisy_trajectory, _ = create_noise(trajectory, self.random)
+        self.traj_gt = {stamp: pose.transform_matrix for stamp, pose in trajectory.items()}
+        self.traj_est = {stamp: pose.transform_matrix for stamp, pose in noisy_trajectory.items()}
+
+    def test_find_closest_indices_matches_find_closest_index(self):
+        values = np.sort(self.random.uniform(0, 100, 50))
+        targets = np.concatenate((self.random.uniform(-10, 110, 100), values))
+        result = rpe.find_closest_indices(values, targets)
+        for idx, target in enumerate(targets):
+            self.assertEqual(rpe.find_closest_index(values, target), result[idx])
+
+    def test_find_closest_indices_breaks_ties_like_find_closest_index(self):
+        values = np.arange(0, 20, 2)
+        targets = np.arange(-1, 21, 1)
+        result = rpe.find_closest_indices(values, targets)
+        for idx, target in enumerate(targets):
+            self.assertEqual(rpe.find_closest_index(values, target), result[idx])
+
+    def test_matches_per_pair_evaluation_for_all_pairs(self):
+        result = rpe.evaluate_trajectory(self.traj_gt, self.traj_est, param_max_pairs=0)
+        expected = evaluate_pairs(self.traj_gt, self.traj_est,
+                                  [(i, j) for i in range(len(self.traj_est)) for j in range(len(self.traj_est))])
+        self.assertEqual(len(expected), len(result))
+        self.assertTrue(np.allclose(expected, result))
+
+    def test_matches_per_pair_evaluation_for_fixed_delta(self):
+        for unit in ('s', 'f'):
+            result = rpe.evaluate_trajectory(self.traj_gt, self.traj_est, param_max_pairs=0, param_fixed_delta=True,
+                                             param_delta=2, param_delta_unit=unit, param_scale=1.5)
+            stamps_est = sorted(self.traj_est.keys())
+            index_est = stamps_est if unit == 's' else list(range(len(stamps_est)))
+            pairs = [(i, rpe.find_closest_index(index_est, index_est[i] + 2)) for i in range(len(stamps_est))]
+            expected = evaluate_pairs(self.traj_gt, self.traj_est,
+                                      [(i, j) for i, j in pairs if j != len(stamps_est) - 1], scale=1.5)
+            self.assertEqual(len(expected), len(result))
+            self.assertTrue(np.allclose(expected, result))
+
+    def test_sampled_pairs_are_the_same_for_a_fixed_seed(self):
+        result1 = rpe.evaluate_trajectory(self.traj_gt, self.traj_est, param_max_pairs=100, param_seed=42)
+        result2 = rpe.evaluate_trajectory(self.traj_gt, self.traj_est, param_max_pairs=100, param_seed=42)
+        self.assertTrue(np.array_equal(result1, result2))
+        self.assertLessEqual(len(result1), 100)
+
+    def test_distances_along_trajectory(self):
+        traj = {float(idx): tf.Transform(location=(idx * idx, 0, 0)).transform_matrix for idx in range(5)}
+        self.assertTrue(np.allclose([0, 1, 4, 9, 16], rpe.distances_along_trajectory(traj)))
+
+
+def evaluate_pairs(traj_gt, traj_est, pairs, scale=1.0):
+    """
+    Evaluate the given pairs one at a time, as the TUM benchmark tools do
+    """
+    stamps_gt = sorted(traj_gt.keys())
+    stamps_est = sorted(traj_est.keys())
+    gt_max_time_difference = 2 * np.median([s - t for s, t in zip(stamps_gt[1:], stamps_gt[:-1])])
+    result = []
+    for i, j in pairs:
+        stamp_gt_0 = stamps_gt[rpe.find_closest_index(stamps_gt, stamps_est[i])]
+        stamp_gt_1 = stamps_gt[rpe.find_closest_index(stamps_gt, stamps_est[j])]
+        if (abs(stamp_gt_0 - stamps_est[i]) > gt_max_time_difference or
+                abs(stamp_gt_1 - stamps_est[j]) > gt_max_time_difference):
+            continue
+        error44 = rpe.ominus(rpe.scale(rpe.ominus(traj_est[stamps_est[j]], traj_est[stamps_est[i]]), scale),
+                             rpe.ominus(traj_gt[stamp_gt_1], traj_gt[stamp_gt_0]))
+        result.append([stamps_est[i], stamps_est[j], stamp_gt_0, stamp_gt_1,
+                       rpe.compute_distance(error44), rpe.compute_angle(error44)])
+    return np.array(result)
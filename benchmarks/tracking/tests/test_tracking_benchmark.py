@@ -1,5 +1,6 @@
 # Copyright (c) 2017, John Skinner
 import unittest
+import numpy as np
 import database.tests.test_entity
 import core.benchmark
 import util.transform as tf
@@ -128,3 +129,76 @@ class TestTrackingBenchmark(database.tests.test_entity.EntityContract, unittest.
         self.assertEqual(0, result.lost_intervals[3].duration)
         self.assertEqual(0, result.lost_intervals[3].distance)
         self.assertEqual(1, result.lost_intervals[3].frames)
+
+    def test_total_distance_is_whole_trajectory(self):
+        self.tracking_states[1.3333] = trials.slam.tracking_state.TrackingState.OK
+        benchmark = tracking.TrackingBenchmark()
+        result = benchmark.benchmark_results(self.trial_result)
+        self.assertEqual(3, result.times_lost)
+        self.assertEqual(100, result._total_distance)
+        self.assertAlmostEqual(0.5, result.fraction_distance_lost)
+
+    def test_initializing_is_lost_false_ignores_initializing(self):
+        benchmark = tracking.TrackingBenchmark(initializing_is_lost=False)
+        result = benchmark.benchmark_results(self.trial_result)
+        self.assertEqual(3, result.times_lost)
+        self.assertEqual(2.3333, result.lost_intervals[0].start_time)
+
+
+class TestAnalyseTracking(unittest.TestCase):
+
+    def test_produces_per_frame_statistics(self):
+        timestamps = np.arange(8, dtype=np.float64)
+        locations = np.zeros((8, 3))
+        locations[:, 0] = np.arange(8) * 2
+        lost = np.array([False, True, True, False, False, True, False, True])
+        analysis = tracking.analyse_tracking(timestamps, locations, lost)
+        self.assertTrue(np.array_equal(lost, analysis.lost))
+        self.assertTrue(np.array_equal(np.arange(8) * 2, analysis.cumulative_distance))
+        self.assertTrue(np.array_equal([0, 0, 2, 0, 0, 0, 0, 0], analysis.distance_lost))
+        self.assertEqual(14, analysis.total_distance)
+        self.assertTrue(np.array_equal([1, 5, 7], analysis.start_indexes))
+        self.assertTrue(np.array_equal([3, 6, 7], analysis.end_indexes))
+        self.assertTrue(np.array_equal([2, 1, 1], analysis.num_frames))
+        self.assertTrue(np.array_equal([4, 2, 0], analysis.distances))
+
+    def test_handles_no_frames(self):
+        analysis = tracking.analyse_tracking(np.zeros(0), np.zeros((0, 3)), np.zeros(0, dtype=bool))
+        self.assertEqual(0, analysis.total_distance)
+        self.assertEqual(0, len(analysis.start_indexes))
+        self.assertEqual(0, len(analysis.distances))
+
+    def test_matches_frame_by_frame_loop(self):
+        random = np.random.RandomState(16)
+        for _ in range(10):
+            num_frames = random.randint(1, 200)
+            timestamps = np.sort(random.uniform(0, 100, num_frames))
+            locations = random.uniform(-10, 10, (num_frames, 3))
+            lost = random.uniform(0, 1, num_frames) < 0.4
+            analysis = tracking.analyse_tracking(timestamps, locations, lost)
+
+            # Find the intervals one frame at a time
+            intervals = []
+            current = None
+            for idx in range(num_frames):
+                step = np.linalg.norm(locations[idx] - locations[idx - 1]) if idx > 0 else 0
+                if current is not None:
+                    current[3] += step
+                    if not lost[idx]:
+                        current[1] = idx
+                        intervals.append(current)
+                        current = None
+                    else:
+                        current[2] += 1
+                elif lost[idx]:
+                    current = [idx, idx, 1, 0]
+            if current is not None:
+                current[1] = num_frames - 1
+                intervals.append(current)
+
+            self.assertEqual(len(intervals), len(analysis.start_indexes))
+            for idx, (start, end, frames, distance) in enumerate(intervals):
+                self.assertEqual(start, analysis.start_indexes[idx])
+                self.assertEqual(end, analysis.end_indexes[idx])
+                self.assertEqual(frames, analysis.num_frames[idx])
+                self.assertAlmostEqual(distance, analysis.distances[idx])
@@ -1,7 +1,9 @@
 # Copyright (c) 2017, John Skinner
+import collections
 import numpy as np
 import core.benchmark
 import trials.slam.tracking_state
+import util.trajectory
 import benchmarks.tracking.tracking_result
 
 
@@ -78,6 +80,17 @@ class TrackingBenchmark(core.benchmark.Benchmark):
         return state is trials.slam.tracking_state.TrackingState.LOST or (
             self._initializing_is_lost and state is trials.slam.tracking_state.TrackingState.NOT_INITIALIZED)
 
+    def get_lost_mask(self, state_codes):
+        """
+        Check which of an array of tracking states count as lost, like is_lost
+        :param state_codes: An integer array of TrackingState values, see get_state_arrays
+        :return: A boolean array
+        """
+        lost = state_codes == trials.slam.tracking_state.TrackingState.LOST.value
+        if self._initializing_is_lost:
+            lost |= state_codes == trials.slam.tracking_state.TrackingState.NOT_INITIALIZED.value
+        return lost
+
     @classmethod
     def get_trial_requirements(cls):
         return {'success': True, 'tracking_stats': {'$exists': True, '$ne': []}}
@@ -94,60 +107,95 @@ class TrackingBenchmark(core.benchmark.Benchmark):
         :return:
         :rtype BenchmarkResult:
         """
-        ground_truth_traj = trial_result.get_ground_truth_camera_poses()
+        ground_truth_traj = util.trajectory.Trajectory.from_poses(trial_result.get_ground_truth_camera_poses())
         states = trial_result.get_tracking_states()
-
-        timestamps = list(ground_truth_traj.keys())
-        timestamps.sort()
-
-        currently_lost = False
-        lost_start = 0
-        lost_distance = 0
-        prev_location = None
-        total_distance = 0
-        num_frames = 0
-        lost_intervals = []
-
-        for timestamp in timestamps:
-            pose = ground_truth_traj[timestamp]
-            distance = 0
-            if prev_location is not None:
-                distance = pose.location - prev_location
-                distance = np.sqrt(np.dot(distance, distance))
-                prev_location = pose.location
-                total_distance += distance
-
-            if self.is_lost(states[timestamp]):
-                if currently_lost:
-                    if distance is not None:
-                        lost_distance += distance
-                    prev_location = pose.location
-                    num_frames += 1
-                else:
-                    currently_lost = True
-                    lost_start = timestamp
-                    lost_distance = 0
-                    num_frames = 1
-                    prev_location = pose.location
-            elif currently_lost:
-                currently_lost = False
-                lost_distance += distance
-                lost_intervals.append(LostInterval(start_time=lost_start,
-                                                   end_time=timestamp,
-                                                   distance=lost_distance,
-                                                   num_frames=num_frames))
-        # We're still lost at the end, add the final distance
-        if currently_lost:
-            lost_intervals.append(LostInterval(start_time=lost_start,
-                                               end_time=timestamps[-1],
-                                               distance=lost_distance,
-                                               num_frames=num_frames))
+        timestamps = ground_truth_traj.timestamps
+        _, _, state_codes = get_state_arrays(states, ground_truth_traj.keys())
+
+        analysis = analyse_tracking(timestamps, ground_truth_traj.locations, self.get_lost_mask(state_codes))
+        lost_intervals = [
+            LostInterval(start_time=float(start_time), end_time=float(end_time),
+                         distance=float(distance), num_frames=int(num_frames))
+            for start_time, end_time, distance, num_frames in zip(
+                timestamps[analysis.start_indexes], timestamps[analysis.end_indexes],
+                analysis.distances, analysis.num_frames)
+        ]
 
         return benchmarks.tracking.tracking_result.TrackingBenchmarkResult(benchmark_id=self.identifier,
                                                                            trial_result_id=trial_result.identifier,
                                                                            lost_intervals=lost_intervals,
-                                                                           total_distance=total_distance,
+                                                                           total_distance=analysis.total_distance,
                                                                            total_time=(timestamps[-1] - timestamps[0]
                                                                                        if len(timestamps) > 1 else 0),
                                                                            total_frames=len(timestamps),
                                                                            settings=self.get_settings())
+
+
+TrackingAnalysis = collections.namedtuple('TrackingAnalysis', [
+    'lost', 'cumulative_distance', 'distance_lost', 'total_distance',
+    'start_indexes', 'end_indexes', 'num_frames', 'distances'
+])
+
+
+def get_state_arrays(tracking_states, timestamps=None):
+    """
+    Convert a dict of timestamp to tracking state into arrays, for comparing states all at once
+    :param tracking_states: A dict of timestamp to TrackingState
+    :param timestamps: The timestamps to look up, in order. Default None, for all the timestamps in sorted order.
+    :return: The list of timestamps as they were in the dict, an array of the timestamps,
+    and an integer array of the TrackingState values
+    """
+    if timestamps is None:
+        timestamps = sorted(tracking_states.keys())
+    else:
+        timestamps = list(timestamps)
+    stamps = np.array(timestamps, dtype=np.float64)
+    codes = np.fromiter((tracking_states[timestamp].value for timestamp in timestamps),
+                        dtype=np.int64, count=len(timestamps))
+    return timestamps, stamps, codes
+
+
+def analyse_tracking(timestamps, locations, lost):
+    """
+    Find the intervals where the system was lost, and how far it moved while it was lost,
+    as a run-length encoding of the lost frames.
+    An interval starts at the first lost frame, and ends at the next frame that is not lost,
+    or the last frame if it is still lost at the end. The distance for each interval is the path length
+    between those frames, so it includes the step to the frame where tracking was recovered.
+    :param timestamps: The sorted array of N timestamps
+    :param locations: An Nx3 array of the ground truth location at each timestamp
+    :param lost: A boolean array of length N, is the system lost at each frame
+    :return: A TrackingAnalysis, with arrays for each frame: whether it was lost, the cumulative path length,
+    and the distance since the system became lost (zero while tracking),
+    the total path length, and arrays for each interval: the index of the first lost frame,
+    the index of the end frame, the number of lost frames, and the distance travelled.
+    """
+    locations = np.asarray(locations, dtype=np.float64).reshape(len(timestamps), 3)
+    lost = np.asarray(lost, dtype=bool)
+    num_frames = len(lost)
+
+    cumulative_distance = np.zeros(num_frames)
+    if num_frames > 1:
+        np.cumsum(np.linalg.norm(np.diff(locations, axis=0), axis=1), out=cumulative_distance[1:])
+
+    # Changes in the padded mask mark where each run of lost frames starts and stops
+    changes = np.diff(np.concatenate(([0], lost.astype(np.int8), [0])))
+    start_indexes = np.nonzero(changes > 0)[0]
+    stop_indexes = np.nonzero(changes < 0)[0]
+    end_indexes = np.minimum(stop_indexes, num_frames - 1)
+
+    run_index = np.maximum(np.cumsum(changes[:-1] > 0) - 1, 0)
+    distance_lost = np.zeros(num_frames)
+    if len(start_indexes) > 0:
+        distance_lost[lost] = (cumulative_distance - cumulative_distance[start_indexes[run_index]])[lost]
+
+    return TrackingAnalysis(
+        lost=lost,
+        cumulative_distance=cumulative_distance,
+        distance_lost=distance_lost,
+        total_distance=float(cumulative_distance[-1]) if num_frames > 0 else 0.0,
+        start_indexes=start_indexes,
+        end_indexes=end_indexes,
+        num_frames=stop_indexes - start_indexes,
+        distances=cumulative_distance[end_indexes] - cumulative_distance[start_indexes]
+    )
@@ -2,6 +2,7 @@
 import util.associate
 import core.trial_comparison
 import core.benchmark
+import benchmarks.tracking.tracking_benchmark as tracking_benchmark
 import benchmarks.tracking.tracking_comparison_result as track_comp_res
 
 
@@ -61,17 +62,21 @@ class TrackingComparisonBenchmark(core.trial_comparison.TrialComparison):
         comp_tracking_stats = trial_result.get_tracking_states()
         ref_tracking_stats = reference_trial_result.get_tracking_states()
 
-        matches = util.associate.associate(comp_tracking_stats, ref_tracking_stats,
-                                           offset=self.offset, max_difference=self.max_difference)
+        comp_stamps, comp_stamp_array, comp_codes = tracking_benchmark.get_state_arrays(comp_tracking_stats)
+        ref_stamps, ref_stamp_array, ref_codes = tracking_benchmark.get_state_arrays(ref_tracking_stats)
+        comp_indexes, ref_indexes = util.associate.associate_arrays(comp_stamp_array, ref_stamp_array,
+                                                                    offset=self.offset,
+                                                                    max_difference=self.max_difference)
 
-        if len(matches) < 2:
+        if len(comp_indexes) < 2:
             return core.benchmark.FailedBenchmark(benchmark_id=self.identifier,
                                                   trial_result_id=trial_result.identifier,
                                                   reason="Not enough matches between tracking statistics")
 
-        changes = {ref_idx: (ref_tracking_stats[ref_idx], comp_tracking_stats[comp_idx])
-                   for comp_idx, ref_idx in matches
-                   if ref_tracking_stats[ref_idx] != comp_tracking_stats[comp_idx]}
+        different = comp_codes[comp_indexes] != ref_codes[ref_indexes]
+        changes = {ref_stamps[ref_idx]: (ref_tracking_stats[ref_stamps[ref_idx]],
+                                         comp_tracking_stats[comp_stamps[comp_idx]])
+                   for comp_idx, ref_idx in zip(comp_indexes[different], ref_indexes[different])}
         return track_comp_res.TrackingComparisonResult(benchmark_id=self.identifier,
                                                        trial_result_id=trial_result.identifier,
                                                        reference_id=reference_trial_result.identifier,
@@ -0,0 +1,130 @@
+# Copyright (c) 2017, John Skinner
+import unittest
+import numpy as np
+import util.transform as tf
+import core.benchmark
+import benchmarks.trajectory_drift.trajectory_drift as drift
+
+
+def create_random_trajectory(random_state, length=200, step=2.0):
+    """
+    Make a trajectory that wanders forward, with a pose every 0.1 seconds
+    """
+    trajectory = {}
+    location = np.zeros(3)
+    for idx in range(length):
+        location = location + random_state.uniform(0, step, 3)
+        trajectory[idx * 0.1] = tf.Transform(location=location, rotation=random_state.uniform(-np.pi, np.pi, 3))
+    return trajectory
+
+
+def create_noise(trajectory, random_state, loc_noise=1.0, rot_noise=0.05):
+    return {time: tf.Transform(location=pose.location + random_state.uniform(-loc_noise, loc_noise, 3),
+                               rotation=pose.euler + random_state.uniform(-rot_noise, rot_noise, 3))
+            for time, pose in trajectory.items()}
+
+
+class MockTrialResult:
+
+    def __init__(self, gt_trajectory, comp_trajectory):
+        self._gt_traj = gt_trajectory
+        self._comp_traj = comp_trajectory
+
+    @property
+    def identifier(self):
+        return 'ThisIsAMockTrialResult'
+
+    def get_ground_truth_camera_poses(self):
+        return self._gt_traj
+
+    def get_computed_camera_poses(self):
+        return self._comp_traj
+
+
+class TestBenchmarkTrajectoryDrift(unittest.TestCase):
+
+    def setUp(self):
+        self.random = np.random.RandomState(6215)
+        self.trajectory = create_random_trajectory(self.random)
+
+    def test_benchmark_results_estimates_no_error_for_identical_trajectory(self):
+        benchmark = drift.BenchmarkTrajectoryDrift(segment_lengths=[10, 50, 100], step_size=5)
+        result = benchmark.benchmark_results(MockTrialResult(self.trajectory, dict(self.trajectory)))
+        self.assertNotIsInstance(result, core.benchmark.FailedBenchmark)
+        self.assertGreater(len(result.raw_errors), 0)
+        for error in result.translational_error:
+            self.assertAlmostEqual(0, error)
+        for error in result.rotational_error:
+            self.assertAlmostEqual(0, error)
+
+    def test_benchmark_results_uses_step_size(self):
+        benchmark = drift.BenchmarkTrajectoryDrift(segment_lengths=[10], step_size=7)
+        result = benchmark.benchmark_results(MockTrialResult(self.trajectory, dict(self.trajectory)))
+        self.assertEqual(list(range(0, 7 * len(result.raw_errors), 7)),
+                         [error['first_frame'] for error in result.raw_errors])
+
+
+class TestCalcSequenceErrors(unittest.TestCase):
+
+    def setUp(self):
+        self.random = np.random.RandomState(3516)
+        trajectory = create_random_trajectory(self.random)
+        noisy = create_noise(trajectory, self.random)
+        self.poses_gt = [trajectory[time].transform_matrix for time in sorted(trajectory.keys())]
+        self.poses_result = [noisy[time].transform_matrix for time in sorted(noisy.keys())]
+
+    def test_matches_per_segment_evaluation(self):
+        segment_lengths = [20, 50, 100, 200, 400]
+        result = drift.calc_sequence_errors(self.poses_gt, self.poses_result, segment_lengths, step_size=3)
+        expected = evaluate_segments(self.poses_gt, self.poses_result, segment_lengths, step_size=3)
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(len(expected), len(result))
+        for expected_err, err in zip(expected, result):
+            self.assertEqual(expected_err['first_frame'], err['first_frame'])
+            self.assertEqual(expected_err['len'], err['len'])
+            self.assertAlmostEqual(expected_err['speed'], err['speed'])
+            self.assertAlmostEqual(expected_err['r_err'], err['r_err'])
+            self.assertAlmostEqual(expected_err['t_err'], err['t_err'])
+
+    def test_trajectory_distances(self):
+        poses = [tf.Transform(location=(idx * idx, 0, 0)).transform_matrix for idx in range(5)]
+        self.assertTrue(np.array_equal([0, 1, 4, 9, 16], drift.trajectory_distances(poses)))
+
+    def test_last_frame_from_segment_length(self):
+        dist = [0, 1, 4, 9, 16]
+        self.assertEqual(2, drift.last_frame_from_segment_length(dist, 0, 1))
+        self.assertEqual(3, drift.last_frame_from_segment_length(dist, 1, 4))
+        self.assertEqual(-1, drift.last_frame_from_segment_length(dist, 2, 12))
+        self.assertTrue(np.array_equal([2, 3, -1], drift.last_frame_from_segment_length(dist, [0, 1, 2], [1, 4, 12])))
+
+
+def evaluate_segments(poses_gt, poses_result, segment_lengths, step_size):
+    """
+    Evaluate each segment one at a time, as evaluate_odometry.cpp does
+    """
+    dist = [0]
+    for i in range(1, len(poses_gt)):
+        dist.append(dist[i - 1] + np.linalg.norm(poses_gt[i - 1][0:3, 3] - poses_gt[i][0:3, 3]))
+    errors = []
+    for first_frame in range(0, len(poses_gt), step_size):
+        for seg_len in segment_lengths:
+            last_frame = -1
+            for i in range(first_frame, len(dist)):
+                if dist[i] > dist[first_frame] + seg_len:
+                    last_frame = i
+                    break
+            if last_frame <= -1:
+                continue
+            pose_delta_gt = np.dot(np.linalg.inv(poses_gt[first_frame]), poses_gt[last_frame])
+            pose_delta_result = np.dot(np.linalg.inv(poses_result[first_frame]), poses_result[last_frame])
+            pose_error = np.dot(np.linalg.inv(pose_delta_result), pose_delta_gt)
+            r_err = np.arccos(max(min(0.5 * (np.trace(pose_error[0:3, 0:3]) - 1.0), 1.0), -1.0))
+            t_err = np.linalg.norm(pose_error[0:3, 3])
+            errors.append({
+                'first_frame': first_frame,
+                'r_err': r_err / seg_len,
+                't_err': t_err / seg_len,
+                'len': seg_len,
+                'speed': seg_len / (0.1 * (last_frame - first_frame + 1))
+            })
+    return errors
@@ -1,6 +1,7 @@
 import numpy as np
 import core.benchmark
 import util.associate
+import util.trajectory
 import benchmarks.trajectory_drift.trajectory_drift_result as drif_result
 
 
@@ -61,8 +62,11 @@ class BenchmarkTrajectoryDrift(core.benchmark.Benchmark):
         ground_truth_traj = trial_result.get_ground_truth_camera_poses()
         result_traj = trial_result.get_computed_camera_poses()
 
-        ground_truth_traj = {stamp: pose.transform_matrix for stamp, pose in ground_truth_traj.items()}
-        result_traj = {stamp: pose.transform_matrix for stamp, pose in result_traj.items()}
+        # Build all the transform matrices at once, rather than one pose at a time
+        ground_truth_traj = util.trajectory.Trajectory.from_poses(ground_truth_traj)
+        ground_truth_traj = dict(zip(ground_truth_traj.keys(), ground_truth_traj.transform_matrices))
+        result_traj = util.trajectory.Trajectory.from_poses(result_traj)
+        result_traj = dict(zip(result_traj.keys(), result_traj.transform_matrices))
 
         # TODO: Configure association?
         matches = util.associate.associate(ground_truth_traj, result_traj, offset=0, max_difference=1)
@@ -72,9 +76,10 @@ class BenchmarkTrajectoryDrift(core.benchmark.Benchmark):
                                                   reason="Couldn't find matching timestamp pairs between"
                                                          "groundtruth and estimated trajectory!")
 
-        gt_poses = [ground_truth_traj[match[0]] for match in matches]
-        result_poses = [result_traj[match[1]] for match in matches]
-        errors = calc_sequence_errors(gt_poses, result_poses, segment_lengths=self._segment_lengths, step_size=10)
+        gt_poses = np.array([ground_truth_traj[match[0]] for match in matches])
+        result_poses = np.array([result_traj[match[1]] for match in matches])
+        errors = calc_sequence_errors(gt_poses, result_poses, segment_lengths=self._segment_lengths,
+                                      step_size=self._step_size)
 
         return drif_result.TrajectoryDriftBenchmarkResult(benchmark_id=self.identifier,
                                                           trial_result_id=trial_result.identifier,
@@ -85,69 +90,66 @@ def calc_sequence_errors(poses_gt, poses_result, segment_lengths, step_size=10):
     """
     Find the error in a list of computed poses, over different segment lengths
     Based on "calcSequenceErrors" in "evaluate_odometry.cpp" ln 81
-    :param poses_gt: The list of ground truth poses, in order. Must be a list and not frames
-    :param poses_result: The list of computed poses, in order. Must be a list of the same length as poses_gt
+    All the segments, for every start frame and segment length, are evaluated at once as stacks of matrices.
+    :param poses_gt: The ground truth poses, in order, as a list or Nx4x4 array of homogeneous matrices
+    :param poses_result: The computed poses, in order, as a list or array of the same length as poses_gt
     :param segment_lengths: The list of segment lengths to test
     :param step_size: The step size between start frames when choosing segments. Default 10.
-    :return: A list of dictionaries containing the computed rotational and translational errors
+    :return: A list of dictionaries containing the computed rotational and translational errors,
+    ordered by first frame and then by segment length
     """
-    err = []    # error vector
+    poses_gt = np.asarray(poses_gt, dtype=np.float64).reshape(-1, 4, 4)
+    poses_result = np.asarray(poses_result, dtype=np.float64).reshape(-1, 4, 4)
     dist = trajectory_distances(poses_gt)    # pre - compute distances from ground truth as reference)
 
-    # for all start positions do
-    for first_frame in range(0, len(poses_gt), step_size):
-        # for all segment lengths do
-        for i in range(0, len(segment_lengths)):
-            # current length
-            seg_len = segment_lengths[i]
-
-            # compute last frame
-            last_frame = last_frame_from_segment_length(dist, first_frame, seg_len)
-
-            # continue, if sequence not long enough
-            if last_frame <= -1:
-                    continue
-
-            # compute rotational and translational errors
-            pose_delta_gt = np.linalg.inv(poses_gt[first_frame]) * poses_gt[last_frame]
-            pose_delta_result = np.linalg.inv(poses_result[first_frame]) * poses_result[last_frame]
-            pose_error = np.linalg.inv(pose_delta_result) * pose_delta_gt
-            r_err = rotation_error(pose_error)
-            t_err = translation_error(pose_error)
-
-            # compute speed
-            num_frames = last_frame - first_frame + 1
-            speed = seg_len / (0.1 * num_frames)
-
-            # write to file
-            err.append({
-                'first_frame': first_frame,
-                'r_err': r_err / seg_len,
-                't_err': t_err / seg_len,
-                'len': seg_len,
-                'speed': speed
-            })
-
-    # return error vector
-    return err
+    # Find the last frame for every start position and segment length, as a (starts x lengths) grid
+    first_frames = np.arange(0, len(poses_gt), step_size)
+    seg_lens = np.asarray(segment_lengths, dtype=np.float64)
+    first_frames, seg_lens = (grid.ravel() for grid in np.meshgrid(first_frames, seg_lens, indexing='ij'))
+    last_frames = last_frame_from_segment_length(dist, first_frames, seg_lens)
+
+    # skip segments where the sequence is not long enough
+    valid = last_frames > -1
+    first_frames = first_frames[valid]
+    last_frames = last_frames[valid]
+    seg_lens = seg_lens[valid]
+
+    # compute rotational and translational errors, inverting each pose only once
+    inv_gt = np.linalg.inv(poses_gt)
+    inv_result = np.linalg.inv(poses_result)
+    pose_delta_gt = np.matmul(inv_gt[first_frames], poses_gt[last_frames])
+    pose_delta_result = np.matmul(inv_result[first_frames], poses_result[last_frames])
+    pose_error = np.matmul(np.linalg.inv(pose_delta_result), pose_delta_gt)
+    r_err = rotation_error(pose_error)
+    t_err = translation_error(pose_error)
+
+    # compute speed
+    num_frames = last_frames - first_frames + 1
+    speed = seg_lens / (0.1 * num_frames)
+
+    lengths = [segment_lengths[idx % len(segment_lengths)] for idx in np.nonzero(valid)[0]]
+    return [{
+        'first_frame': first_frame,
+        'r_err': r,
+        't_err': t,
+        'len': seg_len,
+        'speed': v
+    } for first_frame, r, t, seg_len, v in zip(first_frames.tolist(), (r_err / seg_lens).tolist(),
+                                               (t_err / seg_lens).tolist(), lengths, speed.tolist())]
 
 
 def trajectory_distances(poses):
     """
     Compute the distance along the trajectory for each recorded pose.
     Based on "trajectoryDistances" in "evaluate_odometry.cpp" ln 45
-    :param poses: A list of poses in the order they occurred
-    :return: A list of the total trajectory length for each pose in the provided length
+    :param poses: A list or Nx4x4 array of poses in the order they occurred
+    :return: An array of the total trajectory length for each pose in the provided length
     """
-    dist = [0]
-    for i in range(1, len(poses)):
-        p1 = poses[i-1]
-        p2 = poses[i]
-        dx = p1[0][3] - p2[0][3]
-        dy = p1[1][3] - p2[1][3]
-        dz = p1[2][3] - p2[2][3]
-        dist.append(dist[i-1] + np.sqrt(dx * dx + dy * dy + dz * dz))
-    return dist
+    poses = np.asarray(poses, dtype=np.float64).reshape(-1, 4, 4)
+    if len(poses) <= 0:
+        return np.zeros(0)
+    steps = np.linalg.norm(poses[:-1, 0:3, 3] - poses[1:, 0:3, 3], axis=1)
+    return np.concatenate(([0], np.cumsum(steps)))
 
 
 def last_frame_from_segment_length(dist, first_frame, seg_len):
@@ -155,39 +157,44 @@ def last_frame_from_segment_length(dist, first_frame, seg_len):
     Given a desired segment length, find the last frame such that the distance between
     between the first and last frame is just greater than the segment length.
     Based on "lastFrameFromSegmentLength" in "evaluate_odometry.cpp" ln 59
+    Since the distances are increasing, this is a binary search rather than a scan forward from the first frame.
     :param dist: A list of distances through the trajectory at each frame. See "trajectory_distances", above.
-    :param first_frame: The index of the first frame
-    :param seg_len:
-    :return: The index of the last frame, or -1 if there is not enough distance left in teh trajectory.
+    :param first_frame: The index of the first frame, or an array of first frames
+    :param seg_len: The segment length, or an array of segment lengths the same shape as first_frame
+    :return: The index of the last frame, or -1 if there is not enough distance left in the trajectory.
+    Arrays of indexes if the arguments were arrays.
     """
-    for i in range(first_frame, len(dist)):
-        if dist[i] > dist[first_frame] + seg_len:
-            return i
-    return -1
+    dist = np.asarray(dist)
+    first_frame = np.asarray(first_frame)
+    last_frame = np.searchsorted(dist, dist[first_frame] + seg_len, side='right')
+    last_frame = np.maximum(last_frame, first_frame)
+    return np.where(last_frame < len(dist), last_frame, -1)
 
 
 def rotation_error(pose_error):
     """
     Compute the rotation error for a given error matrix.
     Based on "rotationError" in "evaluate_odometry.cpp" ln 66
-    :param pose_error:
-    :return: floating point rotation error for this pose error matrix
+    :param pose_error: A 4x4 error matrix, or an Nx4x4 array of them
+    :return: floating point rotation error for this pose error matrix, or an array of errors
     """
-    a = pose_error[0][0]
-    b = pose_error[1][1]
-    c = pose_error[2][2]
+    pose_error = np.asarray(pose_error)
+    a = pose_error[..., 0, 0]
+    b = pose_error[..., 1, 1]
+    c = pose_error[..., 2, 2]
     d = 0.5 * (a + b + c - 1.0)
-    return np.arccos(max(min(d, 1.0), -1.0))
+    return np.arccos(np.clip(d, -1.0, 1.0))
 
 
 def translation_error(pose_error):
     """
     Compute the translation error for a given error matrix
     Based on "translationError" in "evaluate_odometry.cpp" ln 74
-    :param pose_error:
-    :return:
+    :param pose_error: A 4x4 error matrix, or an Nx4x4 array of them
+    :return: floating point translation error, or an array of errors
     """
-    dx = pose_error[0][3]
-    dy = pose_error[1][3]
-    dz = pose_error[2][3]
+    pose_error = np.asarray(pose_error)
+    dx = pose_error[..., 0, 3]
+    dy = pose_error[..., 1, 3]
+    dz = pose_error[..., 2, 3]
     return np.sqrt(dx * dx + dy * dy + dz * dz)
@@ -21,6 +21,10 @@ def load_global_config(filename):
             'database_name': 'benchmark_system',
             'gridfs_bucket': 'fs',
             'temp_folder': 'temp',
+            'blob_cache': {
+                'folder': None,
+                'max_size': 10 * 1024 * 1024 * 1024
+            },
             'collections': {
                 'trainer_collection': 'trainers',
                 'trainee_collection': 'trainees',
@@ -31,7 +35,8 @@ def load_global_config(filename):
                 'benchmarks_collection': 'benchmarks',
                 'results_collection': 'results',
                 'experiments_collection': 'experiments',
-                'tasks_collection': 'tasks'
+                'tasks_collection': 'tasks',
+                'blob_collection': 'blobs'
             }
         },
         'task_config': {
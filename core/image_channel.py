@@ -0,0 +1,17 @@
+# Copyright (c) 2017, John Skinner
+import enum
+
+
+class ImageChannel(enum.Enum):
+    """
+    An enum for the different arrays of data that make up an image.
+    Vision systems use this to declare which parts of each image they actually need,
+    so that image sources can avoid loading the rest.
+    The depth, labels, and normals channels cover both images of a stereo pair.
+    """
+    RGB = 'rgb'
+    RIGHT_RGB = 'right_rgb'
+    DEPTH = 'depth'
+    GROUND_TRUTH_DEPTH = 'gt_depth'
+    LABELS = 'labels'
+    WORLD_NORMALS = 'normals'
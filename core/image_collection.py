@@ -1,5 +1,6 @@
 # Copyright (c) 2017, John Skinner
 import abc
+import threading
 import numpy as np
 import logging
 import database.entity
@@ -7,6 +8,9 @@ import core.image
 import core.sequence_type
 import core.image_source
 import util.database_helpers as dh
+import metadata.camera_intrinsics as cam_intr
+import metadata.image_metadata as imeta
+import util.prefetch
 import core.image_entity
 
 
@@ -16,7 +20,20 @@ class ImageCollection(core.image_source.ImageSource, database.entity.Entity, met
     This can be a sequential set of images like a video, or a random sampling of different pictures.
     """
 
-    def __init__(self, images, type_, db_client_, id_=None, **kwargs):
+    # When iterating, how many image documents to fetch from the database in each query
+    document_batch_size = 200
+
+    def __init__(self, images, type_, db_client_, id_=None, image_properties=None, **kwargs):
+        """
+        Create an image collection
+        :param images: A map of timestamp to image id
+        :param type_: The sequence type of the collection, SEQUENTIAL or NON_SEQUENTIAL
+        :param db_client_: The database client, used to load images
+        :param id_: The id of the collection, if it is stored in the database
+        :param image_properties: The properties of the images, as produced by compute_image_properties.
+        Default None, in which case they are read from the images in the database.
+        :param kwargs: Additional arguments passed to the entity constructor
+        """
         super().__init__(id_=id_, **kwargs)
 
         self._images = images
@@ -28,49 +45,24 @@ class ImageCollection(core.image_source.ImageSource, database.entity.Entity, met
             self._sequence_type = core.sequence_type.ImageSequenceType.NON_SEQUENTIAL
         self._timestamps = sorted(self._images.keys())
         self._current_index = 0
+        self._required_channels = None
+        self._prefetch_depth = 0
+        self._prefetch_max_bytes = None
+        self._prefetcher = None
+        self._document_buffer = {}
+        self._document_lock = threading.Lock()
 
         self._db_client = db_client_
-        if len(images) > 0:
-            image_ids = list(images.values())
-            self._is_depth_available = (db_client_.image_collection.find({
-                '_id': {'$in': image_ids},
-                'depth_data': None,
-                'left_depth_data': None,
-            }).count() <= 0)
-            self._is_labels_image_available = (db_client_.image_collection.find({
-                '_id': {'$in': image_ids},
-                'labels_data': None,
-                'left_labels_data': None
-            }).count() <= 0)
-            self._is_bboxes_available = (db_client_.image_collection.find({
-                '_id': {'$in': image_ids},
-                'metadata.labelled_objects': []
-            }).count() <= 0)
-            self._is_normals_available = (db_client_.image_collection.find({
-                '_id': {'$in': image_ids},
-                'world_normals_data': None,
-                'left_world_normals_data': None
-            }).count() <= 0)
-            self._is_stereo_available = (db_client_.image_collection.find({
-                '_id': {'$in': image_ids},
-                'left_data': None,
-                'right_data': None
-            }).count() <= 0)
-        else:
-            self._is_depth_available = False
-            self._is_labels_image_available = False
-            self._is_bboxes_available = False
-            self._is_normals_available = False
-            self._is_stereo_available = False
-
-        # Get some metadata from the first image in the collection
-        s_first_image = db_client_.image_collection.find_one({'_id': images[self._timestamps[0]]})
-        first_image = db_client_.deserialize_entity(s_first_image)
-        self._camera_intrinsics = first_image.metadata.camera_intrinsics
-        self._stereo_baseline = None
-        if self.is_stereo_available:
-            self._stereo_baseline = np.linalg.norm(first_image.left_camera_pose.location -
-                                                   first_image.right_camera_pose.location)
+        if image_properties is None:
+            image_properties = compute_image_properties(db_client_, images)
+        self._is_depth_available = bool(image_properties['is_depth_available'])
+        self._is_labels_image_available = bool(image_properties['is_per_pixel_labels_available'])
+        self._is_bboxes_available = bool(image_properties['is_labels_available'])
+        self._is_normals_available = bool(image_properties['is_normals_available'])
+        self._is_stereo_available = bool(image_properties['is_stereo_available'])
+        self._camera_intrinsics = (cam_intr.CameraIntrinsics.deserialize(image_properties['camera_intrinsics'])
+                                   if image_properties['camera_intrinsics'] is not None else None)
+        self._stereo_baseline = image_properties['stereo_baseline'] if self._is_stereo_available else None
 
     def __len__(self):
         """
@@ -118,15 +110,53 @@ class ImageCollection(core.image_source.ImageSource, database.entity.Entity, met
         """
         return self._timestamps
 
+    def set_required_image_channels(self, channels):
+        """
+        Set which channels of image data to read from the database when loading images.
+        Other image data is not read unless it is accessed.
+        :param channels: A collection of core.image_channel.ImageChannel, or None to load everything
+        :return:
+        """
+        self._required_channels = set(channels) if channels is not None else None
+
+    def set_prefetch(self, depth, max_bytes=None):
+        """
+        Load images ahead of time on background threads while iterating with get_next_image.
+        Images are still returned in order. Takes effect the next time begin is called.
+        :param depth: The maximum number of images to load ahead. 0 disables prefetching.
+        :param max_bytes: The maximum amount of image data to hold ahead, in bytes. Default None, for no limit.
+        :return:
+        """
+        self._prefetch_depth = max(0, int(depth))
+        self._prefetch_max_bytes = max_bytes
+
     def begin(self):
         """
         Start producing images.
-        Resets the current index to the start
+        Resets the current index to the start, and starts prefetching images if that is enabled.
         :return: True
         """
         self._current_index = 0
+        self._stop_prefetching()
+        with self._document_lock:
+            self._document_buffer = {}
+        if self._prefetch_depth > 0:
+            self._prefetcher = util.prefetch.OrderedPrefetcher(
+                load=self._get_in_sequence,
+                keys=range(len(self._timestamps)),
+                depth=self._prefetch_depth,
+                max_bytes=self._prefetch_max_bytes,
+                get_size=lambda image: image.loaded_data_size
+            )
         return True
 
+    def shutdown(self):
+        """
+        Stop any background loading of images.
+        :return:
+        """
+        self._stop_prefetching()
+
     def get(self, index):
         """
         A getter for random access, since we're storing a list
@@ -134,7 +164,8 @@ class ImageCollection(core.image_source.ImageSource, database.entity.Entity, met
         :return:
         """
         if index in self._images:
-            return dh.load_object(self._db_client, self._db_client.image_collection, self._images[index])
+            return dh.load_object(self._db_client, self._db_client.image_collection, self._images[index],
+                                  channels=self._required_channels)
         return None
 
     def get_next_image(self):
@@ -146,9 +177,14 @@ class ImageCollection(core.image_source.ImageSource, database.entity.Entity, met
         :return: An Image object (see core.image) or None, and a timestamp or None
         """
         if not self.is_complete():
+            if self._prefetcher is not None:
+                _, image = self._prefetcher.get_next()
+            else:
+                image = self._get_in_sequence(self._current_index)
             timestamp = self._timestamps[self._current_index]
-            image = self.get(timestamp)
             self._current_index += 1
+            if self.is_complete():
+                self._stop_prefetching()
             return image, timestamp
         return None, None
 
@@ -161,6 +197,44 @@ class ImageCollection(core.image_source.ImageSource, database.entity.Entity, met
         """
         return self._current_index >= len(self._timestamps)
 
+    def _get_in_sequence(self, index):
+        """
+        Load an image while iterating through the collection in order.
+        Rather than querying for each image, the image documents are fetched in batches.
+        Safe to call from prefetching threads.
+        :param index: The index of the image in the sorted timestamps
+        :return: The image entity, or None if it could not be found
+        """
+        image_id = self._images[self._timestamps[index]]
+        with self._document_lock:
+            if image_id not in self._document_buffer:
+                self._fetch_document_batch(index)
+            s_image = self._document_buffer.pop(image_id, None)
+        if s_image is None:
+            return None
+        return self._db_client.deserialize_entity(s_image, channels=self._required_channels)
+
+    def _fetch_document_batch(self, start_index):
+        """
+        Get the serialized images for a batch of timestamps with a single query, and store them in the buffer.
+        Must be called while holding the document lock.
+        :param start_index: The index of the first timestamp to fetch
+        :return:
+        """
+        image_ids = [self._images[timestamp]
+                     for timestamp in self._timestamps[start_index:start_index + self.document_batch_size]]
+        for s_image in self._db_client.image_collection.find({'_id': {'$in': image_ids}}):
+            self._document_buffer[s_image['_id']] = s_image
+
+    def _stop_prefetching(self):
+        """
+        Stop the background prefetching, if it is running
+        :return:
+        """
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+            self._prefetcher = None
+
     @property
     def supports_random_access(self):
         """
@@ -254,6 +328,16 @@ class ImageCollection(core.image_source.ImageSource, database.entity.Entity, met
         serialized = super().serialize()
         # Only include the image IDs here, they'll get turned back into objects for us
         serialized['images'] = [(stamp, image) for stamp, image in self._images.items()]
+        serialized['image_properties'] = {
+            'is_depth_available': self._is_depth_available,
+            'is_per_pixel_labels_available': self._is_labels_image_available,
+            'is_labels_available': self._is_bboxes_available,
+            'is_normals_available': self._is_normals_available,
+            'is_stereo_available': self._is_stereo_available,
+            'camera_intrinsics': (self._camera_intrinsics.serialize()
+                                  if self._camera_intrinsics is not None else None),
+            'stereo_baseline': self._stereo_baseline
+        }
         if self.sequence_type is core.sequence_type.ImageSequenceType.SEQUENTIAL:
             serialized['sequence_type'] = 'SEQ'
         else:
@@ -266,6 +350,7 @@ class ImageCollection(core.image_source.ImageSource, database.entity.Entity, met
         Load any collection of images.
         This handles the weird chicken-and-egg problem of deserializing
         the image collection and the individual images.
+        Collections saved before the image properties were stored have them calculated and saved now.
 
         :param serialized_representation: 
         :param db_client: An instance of database.client, from which to load the image collection
@@ -279,6 +364,8 @@ class ImageCollection(core.image_source.ImageSource, database.entity.Entity, met
             kwargs['type_'] = core.sequence_type.ImageSequenceType.SEQUENTIAL
         else:
             kwargs['type_'] = core.sequence_type.ImageSequenceType.NON_SEQUENTIAL
+        if 'images' in kwargs:
+            kwargs['image_properties'] = load_image_properties(db_client, serialized_representation)
         kwargs['db_client_'] = db_client
         return super().deserialize(serialized_representation, db_client, **kwargs)
 
@@ -314,10 +401,88 @@ class ImageCollection(core.image_source.ImageSource, database.entity.Entity, met
             return db_client.image_source_collection.insert({
                 '_type': cls.__module__ + '.' + cls.__name__,
                 'images': s_images_list,
-                'sequence_type': s_seq_type
+                'sequence_type': s_seq_type,
+                'image_properties': compute_image_properties(db_client, image_map)
             })
 
 
+def load_image_properties(db_client, s_image_collection):
+    """
+    Get the image properties stored on a serialized image collection.
+    Collections saved before the properties were stored have them computed, and saved back to the database,
+    so that this only needs to be done once.
+    :param db_client: The database client
+    :param s_image_collection: The serialized image collection, including the images
+    :return: A dict of image properties, see compute_image_properties
+    """
+    if 'image_properties' in s_image_collection:
+        return s_image_collection['image_properties']
+    image_properties = compute_image_properties(db_client, {
+        stamp: image_id for stamp, image_id in s_image_collection['images']})
+    if '_id' in s_image_collection:
+        db_client.image_source_collection.update_one({'_id': s_image_collection['_id']}, {
+            '$set': {'image_properties': image_properties}
+        })
+    return image_properties
+
+
+def compute_image_properties(db_client, images):
+    """
+    Work out what data is available for a set of images, as well as the camera intrinsics and stereo baseline.
+    This only reads image documents, not image data, and each check stops at the first image without that data.
+    Intrinsics and baseline are read from the image with the earliest timestamp.
+    The result can be stored in the database, and passed to the ImageCollection constructor.
+    :param db_client: The database client, to read the images
+    :param images: A map of timestamp to image id
+    :return: A dict of properties of the images.
+    """
+    if len(images) <= 0:
+        return {
+            'is_depth_available': False,
+            'is_per_pixel_labels_available': False,
+            'is_labels_available': False,
+            'is_normals_available': False,
+            'is_stereo_available': False,
+            'camera_intrinsics': None,
+            'stereo_baseline': None
+        }
+    image_ids = list(images.values())
+
+    def all_images_have(missing_query):
+        # True iff no image matches the query for missing data
+        missing_query['_id'] = {'$in': image_ids}
+        return db_client.image_collection.find_one(missing_query, {'_id': True}) is None
+
+    properties = {
+        'is_depth_available': all_images_have({'depth_data': None, 'left_depth_data': None}),
+        'is_per_pixel_labels_available': all_images_have({'labels_data': None, 'left_labels_data': None}),
+        'is_labels_available': all_images_have({'metadata.labelled_objects': []}),
+        'is_normals_available': all_images_have({'world_normals_data': None, 'left_world_normals_data': None}),
+        'is_stereo_available': all_images_have({'left_data': None, 'right_data': None}),
+        'camera_intrinsics': None,
+        'stereo_baseline': None
+    }
+
+    s_first_image = db_client.image_collection.find_one({'_id': images[min(images.keys())]}, {
+        'metadata._schema_version': True,
+        'metadata.width': True,
+        'metadata.height': True,
+        'metadata.intrinsics': True,
+        'metadata.camera_pose': True,
+        'metadata.right_camera_pose': True
+    })
+    if s_first_image is not None and 'metadata' in s_first_image:
+        s_metadata = s_first_image['metadata']
+        imeta.update_schema(s_metadata)
+        properties['camera_intrinsics'] = s_metadata.get('intrinsics', None)
+        if (properties['is_stereo_available'] and s_metadata.get('camera_pose', None) is not None and
+                s_metadata.get('right_camera_pose', None) is not None):
+            properties['stereo_baseline'] = float(np.linalg.norm(
+                np.asarray(s_metadata['camera_pose']['location']) -
+                np.asarray(s_metadata['right_camera_pose']['location'])))
+    return properties
+
+
 def delete_image_collection(db_client, image_collection_id):
     """
     A helper to delete image collections and all the images contained therein.
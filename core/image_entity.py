@@ -2,23 +2,107 @@
 import xxhash
 import numpy as np
 import copy
-import pickle
+import concurrent.futures
 import database.entity
-import util.database_helpers as db_help
+import database.blob_store as blob_store
+import util.array_codec as ac
 import metadata.image_metadata as imeta
 import core.image
+import core.image_channel as ic
 
 
 class ImageEntity(core.image.Image, database.entity.Entity):
 
     def __init__(self, data_id=None, depth_id=None, ground_truth_depth_id=None, labels_id=None, world_normals_id=None,
-                 **kwargs):
+                 db_client_=None, retain_loaded_data=True, **kwargs):
+        """
+        Create an image entity.
+        Image data can be left as None if the corresponding id is given along with a database client,
+        in which case it will be read from GridFS the first time it is accessed.
+        :param db_client_: A database client used to lazily load data from GridFS. Default None, for no lazy loading.
+        :param retain_loaded_data: Keep lazily loaded data in memory after it has been read. If false,
+        each access will read the data from GridFS again. Default True.
+        """
         super().__init__(**kwargs)
         self._data_id = data_id
         self._depth_id = depth_id
         self._gt_depth_id = ground_truth_depth_id
         self._labels_id = labels_id
         self._world_normals_id = world_normals_id
+        self._db_client = db_client_
+        self._retain_loaded_data = retain_loaded_data
+
+    @property
+    def data(self):
+        return self._get_lazy_data('_data', self._data_id)
+
+    @property
+    def depth_data(self):
+        return self._get_lazy_data('_depth_data', self._depth_id)
+
+    @property
+    def ground_truth_depth_data(self):
+        return self._get_lazy_data('_gt_depth_data', self._gt_depth_id)
+
+    @property
+    def labels_data(self):
+        return self._get_lazy_data('_labels_data', self._labels_id)
+
+    @property
+    def world_normals_data(self):
+        return self._get_lazy_data('_world_normals_data', self._world_normals_id)
+
+    @property
+    def loaded_data_size(self):
+        """
+        The total size of the image data currently held in memory, without loading any more.
+        :return: The size in bytes
+        """
+        size = 0
+        for attribute, _ in self._get_lazy_attributes():
+            value = getattr(self, attribute, None)
+            if value is not None:
+                size += getattr(value, 'nbytes', 0)
+        return size
+
+    def unload_data(self):
+        """
+        Drop any image data that can be read again from GridFS, freeing the memory.
+        Only does anything for lazily loaded images, data that has not been stored is always kept.
+        :return: void
+        """
+        if self._db_client is not None:
+            for attribute, data_id in self._get_lazy_attributes():
+                if data_id is not None:
+                    setattr(self, attribute, None)
+
+    def _get_lazy_attributes(self):
+        """
+        Get the names of the attributes holding image data, and the GridFS ids they can be loaded from.
+        Override this to add more image data, such as for stereo images.
+        :return: A list of attribute name, id pairs
+        """
+        return [
+            ('_data', self._data_id),
+            ('_depth_data', self._depth_id),
+            ('_gt_depth_data', self._gt_depth_id),
+            ('_labels_data', self._labels_id),
+            ('_world_normals_data', self._world_normals_id)
+        ]
+
+    def _get_lazy_data(self, attribute, data_id):
+        """
+        Get some image data, reading it from GridFS if it has not been loaded yet.
+        :param attribute: The name of the attribute holding the data
+        :param data_id: The GridFS id the data is stored under
+        :return: A numpy array, or None if the data is not available
+        """
+        value = getattr(self, attribute)
+        if value is None and data_id is not None and self._db_client is not None:
+            value = load_image_data(self._db_client, data_id)
+            if self._retain_loaded_data:
+                setattr(self, attribute, value)
+        return value
 
     def save_image_data(self, db_client, force_update=False):
         """
@@ -30,17 +114,15 @@ class ImageEntity(core.image.Image, database.entity.Entity):
         :return: void
         """
         if force_update or self._data_id is None:
-            self._data_id = db_client.grid_fs.put(pickle.dumps(self.data, protocol=pickle.HIGHEST_PROTOCOL))
+            self._data_id = blob_store.store_blob(db_client, ac.encode_array(self.data))
         if self.depth_data is not None and (force_update or self._depth_id is None):
-            self._depth_id = db_client.grid_fs.put(pickle.dumps(self.depth_data, protocol=pickle.HIGHEST_PROTOCOL))
+            self._depth_id = blob_store.store_blob(db_client, ac.encode_array(self.depth_data))
         if self.ground_truth_depth_data is not None and (force_update or self._gt_depth_id is None):
-            self._gt_depth_id = db_client.grid_fs.put(pickle.dumps(self.ground_truth_depth_data,
-                                                                   protocol=pickle.HIGHEST_PROTOCOL))
+            self._gt_depth_id = blob_store.store_blob(db_client, ac.encode_array(self.ground_truth_depth_data))
         if self.labels_data is not None and (force_update or self._labels_id is None):
-            self._labels_id = db_client.grid_fs.put(pickle.dumps(self.labels_data, protocol=pickle.HIGHEST_PROTOCOL))
+            self._labels_id = blob_store.store_blob(db_client, ac.encode_array(self.labels_data))
         if self.world_normals_data is not None and (force_update or self._world_normals_id is None):
-            self._world_normals_id = db_client.grid_fs.put(pickle.dumps(self.world_normals_data,
-                                                                        protocol=pickle.HIGHEST_PROTOCOL))
+            self._world_normals_id = blob_store.store_blob(db_client, ac.encode_array(self.world_normals_data))
 
     def validate(self):
         if self.data is None:
@@ -70,33 +152,51 @@ class ImageEntity(core.image.Image, database.entity.Entity):
         return serialized
 
     @classmethod
-    def deserialize(cls, serialized_representation, db_client, **kwargs):
+    def deserialize(cls, serialized_representation, db_client, load_lazily=False, retain_loaded_data=True,
+                    channels=None, **kwargs):
+        """
+        Load an image entity from the database.
+        :param serialized_representation: The serialized image
+        :param db_client: The database client, used to read the image data from GridFS
+        :param load_lazily: Don't read the image data now, fetch each array the first time it is accessed.
+        Default False, which reads all the image data immediately.
+        :param retain_loaded_data: When loading lazily, keep the data after it is first accessed. Default True.
+        :param channels: A collection of core.image_channel.ImageChannel to read immediately,
+        all other image data will be loaded lazily. Default None, in which case load_lazily is used.
+        :param kwargs: Additional arguments passed to the constructor
+        :return: The deserialized image entity
+        """
         if 'metadata' in serialized_representation:
             kwargs['metadata'] = imeta.ImageMetadata.deserialize(serialized_representation['metadata'])
         if 'additional_metadata' in serialized_representation:
             kwargs['additional_metadata'] = serialized_representation['additional_metadata']
 
+        eager_channels = get_eager_channels(load_lazily, channels)
+        if len(eager_channels) < len(ic.ImageChannel):
+            kwargs['db_client_'] = db_client
+            kwargs['retain_loaded_data'] = retain_loaded_data
+        if 'data' in serialized_representation and ic.ImageChannel.RGB not in eager_channels:
+            kwargs['data'] = None
         if 'data' in serialized_representation:
             kwargs['data_id'] = serialized_representation['data']
-            if kwargs['data_id'] is not None:
-                kwargs['data'] = pickle.loads(db_client.grid_fs.get(kwargs['data_id']).read())
+            if kwargs['data_id'] is not None and ic.ImageChannel.RGB in eager_channels:
+                kwargs['data'] = load_image_data(db_client, kwargs['data_id'])
         if 'depth_data' in serialized_representation:
             kwargs['depth_id'] = serialized_representation['depth_data']
-            if kwargs['depth_id'] is not None:
-                kwargs['depth_data'] = pickle.loads(db_client.grid_fs.get(kwargs['depth_id']).read())
+            if kwargs['depth_id'] is not None and ic.ImageChannel.DEPTH in eager_channels:
+                kwargs['depth_data'] = load_image_data(db_client, kwargs['depth_id'])
         if 'ground_truth_depth_data' in serialized_representation:
             kwargs['ground_truth_depth_id'] = serialized_representation['ground_truth_depth_data']
-            if kwargs['ground_truth_depth_id'] is not None:
-                kwargs['ground_truth_depth_data'] = pickle.loads(db_client.grid_fs.get(
-                    kwargs['ground_truth_depth_id']).read())
+            if kwargs['ground_truth_depth_id'] is not None and ic.ImageChannel.GROUND_TRUTH_DEPTH in eager_channels:
+                kwargs['ground_truth_depth_data'] = load_image_data(db_client, kwargs['ground_truth_depth_id'])
         if 'labels_data' in serialized_representation:
             kwargs['labels_id'] = serialized_representation['labels_data']
-            if kwargs['labels_id'] is not None:
-                kwargs['labels_data'] = pickle.loads(db_client.grid_fs.get(kwargs['labels_id']).read())
+            if kwargs['labels_id'] is not None and ic.ImageChannel.LABELS in eager_channels:
+                kwargs['labels_data'] = load_image_data(db_client, kwargs['labels_id'])
         if 'world_normals_data' in serialized_representation:
             kwargs['world_normals_id'] = serialized_representation['world_normals_data']
-            if kwargs['world_normals_id'] is not None:
-                kwargs['world_normals_data'] = pickle.loads(db_client.grid_fs.get(kwargs['world_normals_id']).read())
+            if kwargs['world_normals_id'] is not None and ic.ImageChannel.WORLD_NORMALS in eager_channels:
+                kwargs['world_normals_data'] = load_image_data(db_client, kwargs['world_normals_id'])
         return super().deserialize(serialized_representation, db_client, **kwargs)
 
 
@@ -119,6 +219,39 @@ class StereoImageEntity(core.image.StereoImage, ImageEntity):
         self._right_labels_id = right_labels_id
         self._right_world_normals_id = right_world_normals_id
 
+    @property
+    def right_data(self):
+        return self._get_lazy_data('_right_data', self._right_data_id)
+
+    @property
+    def right_depth_data(self):
+        return self._get_lazy_data('_right_depth_data', self._right_depth_id)
+
+    @property
+    def right_ground_truth_depth_data(self):
+        return self._get_lazy_data('_right_gt_depth_data', self._right_gt_depth_id)
+
+    @property
+    def right_labels_data(self):
+        return self._get_lazy_data('_right_labels_data', self._right_labels_id)
+
+    @property
+    def right_world_normals_data(self):
+        return self._get_lazy_data('_right_world_normals_data', self._right_world_normals_id)
+
+    def _get_lazy_attributes(self):
+        """
+        Overridden to include the data for the right image as well
+        :return: A list of attribute name, id pairs
+        """
+        return super()._get_lazy_attributes() + [
+            ('_right_data', self._right_data_id),
+            ('_right_depth_data', self._right_depth_id),
+            ('_right_gt_depth_data', self._right_gt_depth_id),
+            ('_right_labels_data', self._right_labels_id),
+            ('_right_world_normals_data', self._right_world_normals_id)
+        ]
+
     def save_image_data(self, db_client, force_update=False):
         """
         Store the data for this image in the GridFS.
@@ -131,20 +264,17 @@ class StereoImageEntity(core.image.StereoImage, ImageEntity):
         """
         super().save_image_data(db_client, force_update)
         if force_update or self._right_data_id is None:
-            self._right_data_id = db_client.grid_fs.put(pickle.dumps(self.right_data,
-                                                                     protocol=pickle.HIGHEST_PROTOCOL))
+            self._right_data_id = blob_store.store_blob(db_client, ac.encode_array(self.right_data))
         if self.right_depth_data is not None and (force_update or self._right_depth_id is None):
-            self._right_depth_id = db_client.grid_fs.put(pickle.dumps(self.right_depth_data,
-                                                                      protocol=pickle.HIGHEST_PROTOCOL))
+            self._right_depth_id = blob_store.store_blob(db_client, ac.encode_array(self.right_depth_data))
         if self.right_ground_truth_depth_data is not None and (force_update or self._right_gt_depth_id is None):
-            self._right_gt_depth_id = db_client.grid_fs.put(pickle.dumps(self.right_ground_truth_depth_data,
-                                                                         protocol=pickle.HIGHEST_PROTOCOL))
+            self._right_gt_depth_id = blob_store.store_blob(db_client,
+                                                            ac.encode_array(self.right_ground_truth_depth_data))
         if self.right_labels_data is not None and (force_update or self._right_labels_id is None):
-            self._right_labels_id = db_client.grid_fs.put(pickle.dumps(self.right_labels_data,
-                                                                       protocol=pickle.HIGHEST_PROTOCOL))
+            self._right_labels_id = blob_store.store_blob(db_client, ac.encode_array(self.right_labels_data))
         if self.right_world_normals_data is not None and (force_update or self._right_world_normals_id is None):
-            self._right_world_normals_id = db_client.grid_fs.put(pickle.dumps(self.right_world_normals_data,
-                                                                              protocol=pickle.HIGHEST_PROTOCOL))
+            self._right_world_normals_id = blob_store.store_blob(db_client,
+                                                                 ac.encode_array(self.right_world_normals_data))
 
     def validate(self):
         if not super().validate():
@@ -170,54 +300,64 @@ class StereoImageEntity(core.image.StereoImage, ImageEntity):
         return serialized
 
     @classmethod
-    def deserialize(cls, serialized_representation, db_client, **kwargs):
-
+    def deserialize(cls, serialized_representation, db_client, load_lazily=False, retain_loaded_data=True,
+                    channels=None, **kwargs):
+        """
+        Load a stereo image entity from the database.
+        See ImageEntity.deserialize for an explanation of the lazy loading parameters.
+        """
+        eager_channels = get_eager_channels(load_lazily, channels)
+        if 'left_data' in serialized_representation and ic.ImageChannel.RGB not in eager_channels:
+            kwargs['left_data'] = None
+        if 'right_data' in serialized_representation and ic.ImageChannel.RIGHT_RGB not in eager_channels:
+            kwargs['right_data'] = None
         if 'left_data' in serialized_representation:
             kwargs['left_data_id'] = serialized_representation['left_data']
-            if kwargs['left_data_id'] is not None:
-                kwargs['left_data'] = pickle.loads(db_client.grid_fs.get(kwargs['left_data_id']).read())
+            if kwargs['left_data_id'] is not None and ic.ImageChannel.RGB in eager_channels:
+                kwargs['left_data'] = load_image_data(db_client, kwargs['left_data_id'])
         if 'left_depth_data' in serialized_representation:
             kwargs['left_depth_id'] = serialized_representation['left_depth_data']
-            if kwargs['left_depth_id'] is not None:
-                kwargs['left_depth_data'] = pickle.loads(db_client.grid_fs.get(kwargs['left_depth_id']).read())
+            if kwargs['left_depth_id'] is not None and ic.ImageChannel.DEPTH in eager_channels:
+                kwargs['left_depth_data'] = load_image_data(db_client, kwargs['left_depth_id'])
         if 'left_ground_truth_depth_data' in serialized_representation:
             kwargs['left_ground_truth_depth_id'] = serialized_representation['left_ground_truth_depth_data']
-            if kwargs['left_ground_truth_depth_id'] is not None:
-                kwargs['left_ground_truth_depth_data'] = pickle.loads(db_client.grid_fs.get(
-                    kwargs['left_ground_truth_depth_id']).read())
+            if (kwargs['left_ground_truth_depth_id'] is not None and
+                    ic.ImageChannel.GROUND_TRUTH_DEPTH in eager_channels):
+                kwargs['left_ground_truth_depth_data'] = load_image_data(db_client,
+                                                                         kwargs['left_ground_truth_depth_id'])
         if 'left_labels_data' in serialized_representation:
             kwargs['left_labels_id'] = serialized_representation['left_labels_data']
-            if kwargs['left_labels_id'] is not None:
-                kwargs['left_labels_data'] = pickle.loads(db_client.grid_fs.get(kwargs['left_labels_id']).read())
+            if kwargs['left_labels_id'] is not None and ic.ImageChannel.LABELS in eager_channels:
+                kwargs['left_labels_data'] = load_image_data(db_client, kwargs['left_labels_id'])
         if 'left_world_normals_data' in serialized_representation:
             kwargs['left_world_normals_id'] = serialized_representation['left_world_normals_data']
-            if kwargs['left_world_normals_id'] is not None:
-                kwargs['left_world_normals_data'] = pickle.loads(db_client.grid_fs.get(
-                    kwargs['left_world_normals_id']).read())
+            if kwargs['left_world_normals_id'] is not None and ic.ImageChannel.WORLD_NORMALS in eager_channels:
+                kwargs['left_world_normals_data'] = load_image_data(db_client, kwargs['left_world_normals_id'])
 
         if 'right_data' in serialized_representation:
             kwargs['right_data_id'] = serialized_representation['right_data']
-            if kwargs['right_data_id'] is not None:
-                kwargs['right_data'] = pickle.loads(db_client.grid_fs.get(kwargs['right_data_id']).read())
+            if kwargs['right_data_id'] is not None and ic.ImageChannel.RIGHT_RGB in eager_channels:
+                kwargs['right_data'] = load_image_data(db_client, kwargs['right_data_id'])
         if 'right_depth_data' in serialized_representation:
             kwargs['right_depth_id'] = serialized_representation['right_depth_data']
-            if kwargs['right_depth_id'] is not None:
-                kwargs['right_depth_data'] = pickle.loads(db_client.grid_fs.get(kwargs['right_depth_id']).read())
+            if kwargs['right_depth_id'] is not None and ic.ImageChannel.DEPTH in eager_channels:
+                kwargs['right_depth_data'] = load_image_data(db_client, kwargs['right_depth_id'])
         if 'right_ground_truth_depth_data' in serialized_representation:
             kwargs['right_ground_truth_depth_id'] = serialized_representation['right_ground_truth_depth_data']
-            if kwargs['right_ground_truth_depth_id'] is not None:
-                kwargs['right_ground_truth_depth_data'] = pickle.loads(db_client.grid_fs.get(
-                    kwargs['right_ground_truth_depth_id']).read())
+            if (kwargs['right_ground_truth_depth_id'] is not None and
+                    ic.ImageChannel.GROUND_TRUTH_DEPTH in eager_channels):
+                kwargs['right_ground_truth_depth_data'] = load_image_data(db_client,
+                                                                          kwargs['right_ground_truth_depth_id'])
         if 'right_labels_data' in serialized_representation:
             kwargs['right_labels_id'] = serialized_representation['right_labels_data']
-            if kwargs['right_labels_id'] is not None:
-                kwargs['right_labels_data'] = pickle.loads(db_client.grid_fs.get(kwargs['right_labels_id']).read())
+            if kwargs['right_labels_id'] is not None and ic.ImageChannel.LABELS in eager_channels:
+                kwargs['right_labels_data'] = load_image_data(db_client, kwargs['right_labels_id'])
         if 'right_world_normals_data' in serialized_representation:
             kwargs['right_world_normals_id'] = serialized_representation['right_world_normals_data']
-            if kwargs['right_world_normals_id'] is not None:
-                kwargs['right_world_normals_data'] = pickle.loads(db_client.grid_fs.get(
-                    kwargs['right_world_normals_id']).read())
-        return super().deserialize(serialized_representation, db_client, **kwargs)
+            if kwargs['right_world_normals_id'] is not None and ic.ImageChannel.WORLD_NORMALS in eager_channels:
+                kwargs['right_world_normals_data'] = load_image_data(db_client, kwargs['right_world_normals_id'])
+        return super().deserialize(serialized_representation, db_client, load_lazily=load_lazily,
+                                   retain_loaded_data=retain_loaded_data, channels=channels, **kwargs)
 
 
 def image_to_entity(image):
@@ -256,11 +396,38 @@ def image_to_entity(image):
         return image
 
 
+def get_eager_channels(load_lazily=False, channels=None):
+    """
+    Work out which image channels should be read from the database immediately when loading an image.
+    :param load_lazily: Load all the image data lazily
+    :param channels: An explicit collection of channels to load, or None. Overrides load_lazily.
+    :return: A set of core.image_channel.ImageChannel
+    """
+    if channels is not None:
+        return set(channels)
+    elif load_lazily:
+        return set()
+    return set(ic.ImageChannel)
+
+
+def load_image_data(db_client, data_id):
+    """
+    Read a single array of image data from GridFS, or the local blob cache if it is enabled.
+    Handles both encoded arrays and arrays that were pickled before codecs were introduced.
+    :param db_client: The database client, for access to GridFS
+    :param data_id: The GridFS id of the data
+    :return: The stored numpy array
+    """
+    return ac.decode_array(blob_store.load_blob(db_client, data_id))
+
+
 def save_image(db_client, image):
     """
     Save an image to the database.
     First checks if the image already exists,
     and does not insert if it does.
+    Images are identified by their image hash and a hash of all their metadata,
+    so that checking if an image exists is a single lookup on an index.
     :param db_client: A database client object to use to save the image.
     :param image: An image entity or image object to be saved to the database
     :return: the id of the image in the database
@@ -270,49 +437,160 @@ def save_image(db_client, image):
             image = image_to_entity(image)
         else:
             return None
-    existing_query = image.serialize()
+    metadata_hash = get_metadata_hash(image.serialize())
 
     # Don't look at the GridFS links when determining if the image exists, only use metadata.
-    delete_keys = ['data', 'depth_data', 'ground_truth_depth_data', 'labels_data', 'world_normals_data']
-    for key in delete_keys:
-        if key in existing_query:
-            del existing_query[key]
-        if 'left_' + key in existing_query:
-            del existing_query['left_' + key]
-        if 'right_' + key in existing_query:
-            del existing_query['right_' + key]
-    db_help.query_to_dot_notation(existing_query, flatten_arrays=True)
-
-    existing = db_client.image_collection.find_one(existing_query, {'_id': True})
+    existing = db_client.image_collection.find_one({
+        'metadata.hash': image.metadata.hash,
+        'metadata_hash': metadata_hash
+    }, {'_id': True})
     if existing is None:
+        existing_id = _find_legacy_image(db_client, image.metadata.hash, metadata_hash)
+        if existing_id is not None:
+            return existing_id
         image.save_image_data(db_client)
         # Need to serialize again so we can store the newly created data ids.
-        return db_client.image_collection.insert(image.serialize())
+        s_image = image.serialize()
+        s_image['metadata_hash'] = metadata_hash
+        return db_client.image_collection.insert(s_image)
     else:
         # An identical image already exists, use that.
         return existing['_id']
 
 
+def save_images(db_client, images, max_workers=4):
+    """
+    Save a batch of images to the database, skipping those that already exist.
+    This does the same thing as calling save_image on each image, but with far fewer database round trips:
+    existing images are found with one query on the image hash, the image data for new images
+    is stored in GridFS from several threads at once, and the new images are inserted together.
+    Identical images within the batch are only stored once.
+    :param db_client: The database client
+    :param images: A list of image entities or image objects
+    :param max_workers: The number of threads used to store image data in GridFS. Default 4.
+    :return: A list of image ids, in the same order as the images. None for anything that is not an image.
+    """
+    entities = []
+    for image in images:
+        if not isinstance(image, ImageEntity) and isinstance(image, core.image.Image):
+            image = image_to_entity(image)
+        entities.append(image if isinstance(image, ImageEntity) else None)
+
+    # Find which images already exist, comparing everything except the GridFS links, like save_image does
+    image_hashes = list(set(entity.metadata.hash for entity in entities if entity is not None))
+    existing = {}
+    if len(image_hashes) > 0:
+        for s_existing in db_client.image_collection.find({'metadata.hash': {'$in': image_hashes}}, {
+                '_type': True, 'metadata': True, 'additional_metadata': True, 'metadata_hash': True}):
+            if 'metadata_hash' in s_existing:
+                existing[s_existing['metadata_hash']] = s_existing['_id']
+            else:
+                # Stored before images had a metadata hash, add it so they can be found by index next time
+                metadata_hash = get_metadata_hash(s_existing)
+                db_client.image_collection.update_one({'_id': s_existing['_id']},
+                                                      {'$set': {'metadata_hash': metadata_hash}})
+                existing[metadata_hash] = s_existing['_id']
+
+    image_ids = [None for _ in entities]
+    to_save = []
+    to_save_indexes = {}
+    for idx, entity in enumerate(entities):
+        if entity is None:
+            continue
+        metadata_hash = get_metadata_hash(entity.serialize())
+        if metadata_hash in existing:
+            image_ids[idx] = existing[metadata_hash]
+        elif metadata_hash in to_save_indexes:
+            to_save_indexes[metadata_hash].append(idx)
+        else:
+            to_save_indexes[metadata_hash] = [idx]
+            to_save.append((metadata_hash, entity))
+
+    if len(to_save) > 0:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(max_workers))) as executor:
+            # Consume the results so that any exceptions are raised here
+            list(executor.map(lambda pair: pair[1].save_image_data(db_client), to_save))
+        s_images = []
+        for metadata_hash, entity in to_save:
+            s_image = entity.serialize()
+            s_image['metadata_hash'] = metadata_hash
+            s_images.append(s_image)
+        result = db_client.image_collection.insert_many(s_images)
+        for (metadata_hash, _), image_id in zip(to_save, result.inserted_ids):
+            for idx in to_save_indexes[metadata_hash]:
+                image_ids[idx] = image_id
+    return image_ids
+
+
+def get_metadata_hash(s_image):
+    """
+    Get a hash of everything that identifies a serialized image, apart from the GridFS links and the id.
+    This is the type, the metadata, and the additional metadata, and is stored with each image
+    so that identical images can be found using an index.
+    The hash does not depend on the order of dictionary keys, and treats tuples and lists the same,
+    since the database changes both of those.
+    :param s_image: The serialized image
+    :return: The hash, as a hex string
+    """
+    key = _freeze({key: s_image.get(key, None) for key in ('_type', 'metadata', 'additional_metadata')})
+    return xxhash.xxh64(repr(key).encode('utf-8')).hexdigest()
+
+
+def _find_legacy_image(db_client, image_hash, metadata_hash):
+    """
+    Find an image stored before images had a metadata hash, which matches a given metadata hash.
+    The metadata hash is added to any matching image, so it will be found by the index from then on.
+    :param db_client: The database client
+    :param image_hash: The image hash, used to narrow down the search
+    :param metadata_hash: The metadata hash of the image we're looking for
+    :return: The id of the existing image, or None if there isn't one
+    """
+    for s_existing in db_client.image_collection.find({
+            'metadata.hash': image_hash,
+            'metadata_hash': {'$exists': False}
+    }, {'_type': True, 'metadata': True, 'additional_metadata': True}):
+        if get_metadata_hash(s_existing) == metadata_hash:
+            db_client.image_collection.update_one({'_id': s_existing['_id']},
+                                                  {'$set': {'metadata_hash': metadata_hash}})
+            return s_existing['_id']
+    return None
+
+
+def _freeze(value):
+    """
+    Recursively turn a serialized value into an equivalent immutable value, with a consistent representation
+    :param value: The serialized value
+    :return: A hashable equivalent
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((str(key), _freeze(inner)) for key, inner in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(_freeze(inner) for inner in value)
+    elif isinstance(value, np.generic):
+        # The database stores numpy numbers as plain python numbers
+        return value.item()
+    return value
+
+
 def delete_image(db_client, image_id):
     """
     Delete an image by id, including removing the data stored in GridFS.
+    Image data shared with other images is kept until the last image using it is deleted.
     :param db_client: The database client
     :param image_id: The image id.
     :return:
     """
     # Generate the keys that may point to GridFS data
     delete_keys = ['data', 'depth_data', 'ground_truth_depth_data', 'labels_data', 'world_normals_data']
-    delete_keys = [prefix + key for key in delete_keys for prefix in ('', 'left_', '_right_')]
+    delete_keys = [prefix + key for key in delete_keys for prefix in ('', 'left_', 'right_')]
 
     s_image = db_client.image_collection.find_one({'_id': image_id}, {key: True for key in delete_keys})
+    if s_image is None:
+        return
 
-    # Delete the data from the GridFS keys
+    # Release the data from the GridFS keys
     for key in delete_keys:
-        if key in s_image:
-            db_client.grid_fs.delete(s_image[key])
-        if 'left_' + key in s_image:
-            db_client.grid_fs.delete(s_image['left_' + key])
-        if 'right_' + key in s_image:
-            db_client.grid_fs.delete(s_image['right_' + key])
+        if key in s_image and s_image[key] is not None:
+            blob_store.release_blob(db_client, s_image[key])
 
     db_client.image_collection.delete_one({'_id': image_id})
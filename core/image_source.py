@@ -143,6 +143,28 @@ class ImageSource(metaclass=abc.ABCMeta):
         """
         return None
 
+    def set_required_image_channels(self, channels):
+        """
+        Tell the image source which channels of image data will actually be used, such as RGB and depth.
+        Image sources that load images from somewhere may use this to avoid loading data that isn't needed.
+        Other image sources don't need to override this, it will do nothing.
+        :param channels: A collection of core.image_channel.ImageChannel, or None if all channels are needed.
+        :return:
+        """
+        pass
+
+    def set_prefetch(self, depth, max_bytes=None):
+        """
+        Ask the image source to load images ahead of time in the background,
+        so that loading the next images overlaps with processing the current one.
+        This only applies to sequential iteration with get_next_image, and takes effect at the next begin.
+        Image sources that produce images on demand don't need to override this, it will do nothing.
+        :param depth: The maximum number of images to load ahead. 0 disables prefetching.
+        :param max_bytes: The maximum amount of image data to hold ahead, in bytes. Default None, for no limit.
+        :return:
+        """
+        pass
+
     @abc.abstractmethod
     def begin(self):
         """
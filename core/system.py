@@ -1,6 +1,7 @@
 # Copyright (c) 2017, John Skinner
 import abc
 import database.entity
+import core.image_channel
 
 
 class VisionSystem(database.entity.Entity, metaclass=database.entity.AbstractEntityMetaclass):
@@ -34,6 +35,16 @@ class VisionSystem(database.entity.Entity, metaclass=database.entity.AbstractEnt
         """
         pass
 
+    @property
+    def required_image_channels(self):
+        """
+        Which channels of the image data does this system use.
+        Image sources use this to avoid loading data the system won't look at.
+        Override this to declare fewer channels, by default systems use all the image data.
+        :return: A set of core.image_channel.ImageChannel
+        """
+        return set(core.image_channel.ImageChannel)
+
     @abc.abstractmethod
     def set_camera_intrinsics(self, camera_intrinsics):
         """
@@ -2,6 +2,7 @@
 import unittest
 import unittest.mock as mock
 import database.tests.test_entity
+import database.tests.mock_database_client as mock_client_factory
 import numpy as np
 import bson.objectid
 import util.dict_utils as du
@@ -11,6 +12,7 @@ import metadata.image_metadata as imeta
 import core.image_entity as ie
 import core.image_collection as ic
 import core.sequence_type
+import core.image_channel
 
 
 def make_image(index=1, **kwargs):
@@ -155,7 +157,7 @@ class TestImageCollection(database.tests.test_entity.EntityContract, unittest.Te
         self.db_client = super().create_mock_db_client()
 
         self.db_client.image_collection.find.return_value = [image.serialize() for image in self.images.values()]
-        self.db_client.deserialize_entity.side_effect = lambda s_image: self.image_map[str(s_image['_id'])]
+        self.db_client.deserialize_entity.side_effect = lambda s_image, **_: self.image_map[str(s_image['_id'])]
         return self.db_client
 
     def test_timestamps_returns_all_timestamps_in_order(self):
@@ -252,6 +254,97 @@ class TestImageCollection(database.tests.test_entity.EntityContract, unittest.Te
         self.assertTrue(subject.is_complete())
         self.assertEqual((None, None), subject.get_next_image())
 
+    def test_prefetching_returns_images_in_order(self):
+        subject = ic.ImageCollection(images={stamp: image.identifier for stamp, image in self.images.items()},
+                                     type_=core.sequence_type.ImageSequenceType.SEQUENTIAL,
+                                     db_client_=self.create_iteration_db_client())
+        subject.set_prefetch(3)
+        with subject:
+            for stamp in sorted(self.images.keys()):
+                result_image, timestamp = subject.get_next_image()
+                self.assertEqual(stamp, timestamp)
+                self.assertEqual(self.images[stamp].identifier, result_image.identifier)
+                self.assertTrue(np.array_equal(self.images[stamp].data, result_image.data))
+            self.assertTrue(subject.is_complete())
+            self.assertEqual((None, None), subject.get_next_image())
+
+    def test_prefetching_restarts_on_begin(self):
+        subject = ic.ImageCollection(images={stamp: image.identifier for stamp, image in self.images.items()},
+                                     type_=core.sequence_type.ImageSequenceType.SEQUENTIAL,
+                                     db_client_=self.create_iteration_db_client())
+        subject.set_prefetch(3, max_bytes=1024 * 1024)
+        subject.begin()
+        subject.get_next_image()
+        subject.get_next_image()
+
+        subject.begin()
+        for stamp in sorted(self.images.keys()):
+            result_image, timestamp = subject.get_next_image()
+            self.assertEqual(stamp, timestamp)
+            self.assertEqual(self.images[stamp].identifier, result_image.identifier)
+        self.assertTrue(subject.is_complete())
+        subject.shutdown()
+
+    def test_iteration_fetches_images_in_batches(self):
+        db_client = self.create_iteration_db_client()
+        subject = ic.ImageCollection(images={stamp: image.identifier for stamp, image in self.images.items()},
+                                     type_=core.sequence_type.ImageSequenceType.SEQUENTIAL,
+                                     db_client_=db_client)
+        subject.document_batch_size = 4
+        db_client.image_collection.find.reset_mock()
+        db_client.image_collection.find_one.reset_mock()
+        with subject:
+            for stamp in sorted(self.images.keys()):
+                result_image, timestamp = subject.get_next_image()
+                self.assertEqual(stamp, timestamp)
+                self.assertEqual(self.images[stamp].identifier, result_image.identifier)
+        self.assertFalse(db_client.image_collection.find_one.called)
+        self.assertEqual(3, db_client.image_collection.find.call_count)
+        for call in db_client.image_collection.find.call_args_list:
+            self.assertLessEqual(len(call[0][0]['_id']['$in']), 4)
+
+    def create_iteration_db_client(self):
+        db_client = self.create_mock_db_client()
+        mock_cursor = mock.MagicMock()
+        mock_cursor.count.return_value = 1
+
+        def find(query, *_, **__):
+            if set(query.keys()) == {'_id'} and set(query['_id'].keys()) == {'$in'}:
+                return [self.image_map[str(image_id)].serialize() for image_id in query['_id']['$in']]
+            return mock_cursor
+
+        db_client.image_collection.find.side_effect = find
+        db_client.image_collection.find_one.side_effect = lambda query, *_, **__: \
+            None if isinstance(query['_id'], dict) else self.image_map[str(query['_id'])].serialize()
+        return db_client
+
+    def test_get_loads_all_channels_by_default(self):
+        db_client = self.create_mock_db_client()
+        mock_cursor = mock.MagicMock()
+        mock_cursor.count.return_value = 1
+        db_client.image_collection.find.return_value = mock_cursor
+        db_client.image_collection.find_one.return_value = self.images[0].serialize()
+        subject = ic.ImageCollection(images={1: bson.objectid.ObjectId()},
+                                     type_=core.sequence_type.ImageSequenceType.SEQUENTIAL,
+                                     db_client_=db_client)
+        subject.get(1)
+        self.assertIsNone(db_client.deserialize_entity.call_args[1]['channels'])
+
+    def test_get_loads_only_required_channels(self):
+        db_client = self.create_mock_db_client()
+        mock_cursor = mock.MagicMock()
+        mock_cursor.count.return_value = 1
+        db_client.image_collection.find.return_value = mock_cursor
+        db_client.image_collection.find_one.return_value = self.images[0].serialize()
+        subject = ic.ImageCollection(images={1: bson.objectid.ObjectId()},
+                                     type_=core.sequence_type.ImageSequenceType.SEQUENTIAL,
+                                     db_client_=db_client)
+        subject.set_required_image_channels([core.image_channel.ImageChannel.RGB,
+                                             core.image_channel.ImageChannel.DEPTH])
+        subject.get(1)
+        self.assertEqual({core.image_channel.ImageChannel.RGB, core.image_channel.ImageChannel.DEPTH},
+                         db_client.deserialize_entity.call_args[1]['channels'])
+
     def test_deserializes_images(self):
         s_image_collection = {
             '_id': 12345,
@@ -342,3 +435,90 @@ class TestImageCollection(database.tests.test_entity.EntityContract, unittest.Te
 
         s_image_collection_2 = collection.serialize()
         self.assert_serialized_equal(s_image_collection, s_image_collection_2)
+
+
+class TestImageProperties(unittest.TestCase):
+
+    def setUp(self):
+        self.zombie_db_client = mock_client_factory.create()
+        self.db_client = self.zombie_db_client.mock
+
+    def store_images(self, images):
+        image_map = {}
+        for stamp, image in images.items():
+            image.save_image_data(self.db_client)
+            image_map[stamp] = self.db_client.image_collection.insert(image.serialize())
+        return image_map
+
+    def test_compute_image_properties_finds_available_data(self):
+        image_map = self.store_images({i * 1.2: make_image(i) for i in range(5)})
+        properties = ic.compute_image_properties(self.db_client, image_map)
+        self.assertTrue(properties['is_depth_available'])
+        self.assertTrue(properties['is_per_pixel_labels_available'])
+        self.assertTrue(properties['is_labels_available'])
+        self.assertTrue(properties['is_normals_available'])
+        self.assertFalse(properties['is_stereo_available'])
+        self.assertEqual(cam_intr.CameraIntrinsics(800, 600, 550.2, 750.2, 400, 300),
+                         cam_intr.CameraIntrinsics.deserialize(properties['camera_intrinsics']))
+        self.assertIsNone(properties['stereo_baseline'])
+
+    def test_compute_image_properties_requires_all_images_to_have_data(self):
+        images = {i * 1.2: make_image(i) for i in range(5)}
+        images[1.7] = make_image(depth_data=None, world_normals_data=None)
+        properties = ic.compute_image_properties(self.db_client, self.store_images(images))
+        self.assertFalse(properties['is_depth_available'])
+        self.assertTrue(properties['is_per_pixel_labels_available'])
+        self.assertFalse(properties['is_normals_available'])
+
+    def test_compute_image_properties_finds_stereo_baseline(self):
+        images = {i * 1.2: make_stereo_image(i) for i in range(5)}
+        first_image = images[0]
+        properties = ic.compute_image_properties(self.db_client, self.store_images(images))
+        self.assertTrue(properties['is_stereo_available'])
+        self.assertAlmostEqual(np.linalg.norm(first_image.left_camera_pose.location -
+                                              first_image.right_camera_pose.location),
+                               properties['stereo_baseline'])
+
+    def test_compute_image_properties_handles_no_images(self):
+        properties = ic.compute_image_properties(self.db_client, {})
+        self.assertFalse(properties['is_depth_available'])
+        self.assertIsNone(properties['camera_intrinsics'])
+
+    def test_create_and_save_stores_image_properties(self):
+        image_map = self.store_images({i * 1.2: make_image(i) for i in range(5)})
+        collection_id = ic.ImageCollection.create_and_save(self.db_client, image_map,
+                                                           core.sequence_type.ImageSequenceType.SEQUENTIAL)
+        s_collection = self.db_client.image_source_collection.find_one({'_id': collection_id})
+        self.assertEqual(ic.compute_image_properties(self.db_client, image_map), s_collection['image_properties'])
+
+    def test_deserialize_uses_stored_image_properties(self):
+        image_map = self.store_images({i * 1.2: make_image(i) for i in range(5)})
+        collection_id = ic.ImageCollection.create_and_save(self.db_client, image_map,
+                                                           core.sequence_type.ImageSequenceType.SEQUENTIAL)
+        s_collection = self.db_client.image_source_collection.find_one({'_id': collection_id})
+        self.db_client.image_collection.find.reset_mock()
+        self.db_client.image_collection.find_one.reset_mock()
+
+        collection = ic.ImageCollection.deserialize(s_collection, self.db_client)
+        self.assertFalse(self.db_client.image_collection.find.called)
+        self.assertFalse(self.db_client.image_collection.find_one.called)
+        self.assertTrue(collection.is_depth_available)
+        self.assertFalse(collection.is_stereo_available)
+        self.assertEqual(cam_intr.CameraIntrinsics(800, 600, 550.2, 750.2, 400, 300),
+                         collection.get_camera_intrinsics())
+
+    def test_deserialize_backfills_missing_image_properties(self):
+        image_map = self.store_images({i * 1.2: make_stereo_image(i) for i in range(5)})
+        collection_id = self.db_client.image_source_collection.insert({
+            '_type': 'core.image_collection.ImageCollection',
+            'images': list(image_map.items()),
+            'sequence_type': 'SEQ'
+        })
+        collection = ic.ImageCollection.deserialize(
+            self.db_client.image_source_collection.find_one({'_id': collection_id}), self.db_client)
+        self.assertTrue(collection.is_stereo_available)
+        self.assertIsNotNone(collection.get_stereo_baseline())
+
+        s_collection = self.db_client.image_source_collection.find_one({'_id': collection_id})
+        self.assertIn('image_properties', s_collection)
+        self.assertTrue(s_collection['image_properties']['is_stereo_available'])
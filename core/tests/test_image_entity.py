@@ -3,6 +3,7 @@ import unittest
 import unittest.mock as mock
 import pymongo.collection
 import numpy as np
+import xxhash
 import gridfs
 import pickle
 import bson.objectid
@@ -12,7 +13,9 @@ import metadata.camera_intrinsics as cam_intr
 import metadata.image_metadata as imeta
 import database.client
 import database.tests.test_entity as entity_test
+import database.tests.mock_database_client as mock_db_client_fac
 import core.image
+import core.image_channel
 import core.image_entity as ie
 
 
@@ -87,6 +90,8 @@ class TestImageEntity(entity_test.EntityContract, unittest.TestCase):
 
         self.db_client.grid_fs = unittest.mock.create_autospec(gridfs.GridFS)
         self.db_client.grid_fs.get.side_effect = lambda id_: MockReadable(self.data_map[id_])
+        self.db_client.grid_fs.put.side_effect = lambda _: bson.objectid.ObjectId()
+        self.db_client.blob_cache = None
 
         return self.db_client
 
@@ -140,6 +145,74 @@ class TestImageEntity(entity_test.EntityContract, unittest.TestCase):
         self.assertIn(mock.call(s_entity['labels_data']), mock_db_client.grid_fs.get.call_args_list)
         self.assertIn(mock.call(s_entity['world_normals_data']), mock_db_client.grid_fs.get.call_args_list)
 
+    def test_deserialize_lazily_does_not_call_gridfs(self):
+        mock_db_client = self.create_mock_db_client()
+        entity = self.make_instance(id_=12345)
+        s_entity = entity.serialize()
+        ie.ImageEntity.deserialize(s_entity, mock_db_client, load_lazily=True)
+        self.assertFalse(mock_db_client.grid_fs.get.called)
+
+    def test_deserialize_lazily_loads_data_on_access(self):
+        mock_db_client = self.create_mock_db_client()
+        entity = self.make_instance(id_=12345)
+        s_entity = entity.serialize()
+        lazy_entity = ie.ImageEntity.deserialize(s_entity, mock_db_client, load_lazily=True)
+
+        self.assertTrue(np.array_equal(self.data_map[0], lazy_entity.data))
+        self.assertEqual(1, mock_db_client.grid_fs.get.call_count)
+        self.assertIn(mock.call(s_entity['data']), mock_db_client.grid_fs.get.call_args_list)
+        self.assertTrue(np.array_equal(self.data_map[2], lazy_entity.ground_truth_depth_data))
+        self.assertEqual(2, mock_db_client.grid_fs.get.call_count)
+        self.assertIn(mock.call(s_entity['ground_truth_depth_data']), mock_db_client.grid_fs.get.call_args_list)
+        self.assert_models_equal(entity, lazy_entity)
+
+    def test_deserialize_lazily_retains_loaded_data(self):
+        mock_db_client = self.create_mock_db_client()
+        s_entity = self.make_instance(id_=12345).serialize()
+        lazy_entity = ie.ImageEntity.deserialize(s_entity, mock_db_client, load_lazily=True)
+        for _ in range(3):
+            self.assertTrue(np.array_equal(self.data_map[1], lazy_entity.depth_data))
+        self.assertEqual(1, mock_db_client.grid_fs.get.call_count)
+
+    def test_deserialize_lazily_can_drop_loaded_data(self):
+        mock_db_client = self.create_mock_db_client()
+        s_entity = self.make_instance(id_=12345).serialize()
+        lazy_entity = ie.ImageEntity.deserialize(s_entity, mock_db_client, load_lazily=True,
+                                                 retain_loaded_data=False)
+        for _ in range(3):
+            self.assertTrue(np.array_equal(self.data_map[1], lazy_entity.depth_data))
+        self.assertEqual(3, mock_db_client.grid_fs.get.call_count)
+
+    def test_deserialize_only_loads_given_channels(self):
+        mock_db_client = self.create_mock_db_client()
+        entity = self.make_instance(id_=12345)
+        s_entity = entity.serialize()
+        partial_entity = ie.ImageEntity.deserialize(s_entity, mock_db_client, channels={
+            core.image_channel.ImageChannel.RGB, core.image_channel.ImageChannel.LABELS})
+        self.assertEqual(2, mock_db_client.grid_fs.get.call_count)
+        self.assertIn(mock.call(s_entity['data']), mock_db_client.grid_fs.get.call_args_list)
+        self.assertIn(mock.call(s_entity['labels_data']), mock_db_client.grid_fs.get.call_args_list)
+
+        # Other channels are still available lazily
+        self.assertTrue(np.array_equal(self.data_map[1], partial_entity.depth_data))
+        self.assertEqual(3, mock_db_client.grid_fs.get.call_count)
+        self.assert_models_equal(entity, partial_entity)
+
+    def test_unload_data_reloads_on_next_access(self):
+        mock_db_client = self.create_mock_db_client()
+        s_entity = self.make_instance(id_=12345).serialize()
+        lazy_entity = ie.ImageEntity.deserialize(s_entity, mock_db_client, load_lazily=True)
+        self.assertTrue(np.array_equal(self.data_map[0], lazy_entity.data))
+        lazy_entity.unload_data()
+        self.assertTrue(np.array_equal(self.data_map[0], lazy_entity.data))
+        self.assertEqual(2, mock_db_client.grid_fs.get.call_count)
+
+    def test_unload_data_keeps_unsaved_data(self):
+        entity = self.make_instance(data_id=None)
+        entity.unload_data()
+        self.assertTrue(np.array_equal(self.data_map[0], entity.data))
+        self.assertTrue(np.array_equal(self.data_map[1], entity.depth_data))
+
     def test_does_not_deserialize_from_null_id(self):
         mock_db_client = self.create_mock_db_client()
         EntityClass = self.get_class()
@@ -170,6 +243,18 @@ class TestImageEntity(entity_test.EntityContract, unittest.TestCase):
         entity.save_image_data(mock_db_client, force_update=False)
         self.assertFalse(mock_db_client.grid_fs.put.called)
 
+    def test_save_image_data_can_be_loaded_again(self):
+        zombie_db_client = mock_db_client_fac.create()
+        entity = self.make_instance(data_id=None,
+                                    depth_data=np.random.uniform(0, 10, (32, 32)),
+                                    depth_id=None,
+                                    ground_truth_depth_id=None,
+                                    labels_id=None,
+                                    world_normals_id=None)
+        entity.save_image_data(zombie_db_client.mock)
+        loaded = ie.ImageEntity.deserialize(entity.serialize(), zombie_db_client.mock)
+        self.assert_models_equal(entity, loaded)
+
     def test_save_image_data_updates_ids(self):
         mock_db_client = self.create_mock_db_client()
         entity = self.make_instance(data_id=None,
@@ -265,6 +350,8 @@ class TestStereoImageEntity(entity_test.EntityContract, unittest.TestCase):
 
         self.db_client.grid_fs = unittest.mock.create_autospec(gridfs.GridFS)
         self.db_client.grid_fs.get.side_effect = lambda id_: MockReadable(self.data_map[id_])
+        self.db_client.grid_fs.put.side_effect = lambda _: bson.objectid.ObjectId()
+        self.db_client.blob_cache = None
 
         return self.db_client
 
@@ -335,6 +422,46 @@ class TestStereoImageEntity(entity_test.EntityContract, unittest.TestCase):
         self.assertIn(mock.call(s_entity['right_labels_data']), mock_db_client.grid_fs.get.call_args_list)
         self.assertIn(mock.call(s_entity['right_world_normals_data']), mock_db_client.grid_fs.get.call_args_list)
 
+    def test_deserialize_lazily_does_not_call_gridfs(self):
+        mock_db_client = self.create_mock_db_client()
+        entity = self.make_instance(id_=12345)
+        s_entity = entity.serialize()
+        ie.StereoImageEntity.deserialize(s_entity, mock_db_client, load_lazily=True)
+        self.assertFalse(mock_db_client.grid_fs.get.called)
+
+    def test_deserialize_lazily_loads_data_on_access(self):
+        mock_db_client = self.create_mock_db_client()
+        entity = self.make_instance(id_=12345)
+        s_entity = entity.serialize()
+        lazy_entity = ie.StereoImageEntity.deserialize(s_entity, mock_db_client, load_lazily=True)
+
+        self.assertTrue(np.array_equal(self.data_map[0], lazy_entity.left_data))
+        self.assertTrue(np.array_equal(self.data_map[5], lazy_entity.right_data))
+        self.assertEqual(2, mock_db_client.grid_fs.get.call_count)
+        self.assertIn(mock.call(s_entity['left_data']), mock_db_client.grid_fs.get.call_args_list)
+        self.assertIn(mock.call(s_entity['right_data']), mock_db_client.grid_fs.get.call_args_list)
+        self.assert_models_equal(entity, lazy_entity)
+
+    def test_deserialize_only_loads_given_channels(self):
+        mock_db_client = self.create_mock_db_client()
+        entity = self.make_instance(id_=12345)
+        s_entity = entity.serialize()
+        partial_entity = ie.StereoImageEntity.deserialize(s_entity, mock_db_client, channels={
+            core.image_channel.ImageChannel.RGB, core.image_channel.ImageChannel.RIGHT_RGB})
+        self.assertEqual(2, mock_db_client.grid_fs.get.call_count)
+        self.assertIn(mock.call(s_entity['left_data']), mock_db_client.grid_fs.get.call_args_list)
+        self.assertIn(mock.call(s_entity['right_data']), mock_db_client.grid_fs.get.call_args_list)
+        self.assert_models_equal(entity, partial_entity)
+
+    def test_unload_data_reloads_on_next_access(self):
+        mock_db_client = self.create_mock_db_client()
+        s_entity = self.make_instance(id_=12345).serialize()
+        lazy_entity = ie.StereoImageEntity.deserialize(s_entity, mock_db_client, load_lazily=True)
+        self.assertTrue(np.array_equal(self.data_map[8], lazy_entity.right_labels_data))
+        lazy_entity.unload_data()
+        self.assertTrue(np.array_equal(self.data_map[8], lazy_entity.right_labels_data))
+        self.assertEqual(2, mock_db_client.grid_fs.get.call_count)
+
     def test_does_not_deserialize_from_null_id(self):
         mock_db_client = self.create_mock_db_client()
         EntityClass = self.get_class()
@@ -459,6 +586,8 @@ class TestSaveImage(unittest.TestCase):
         self.mock_db_client.image_collection.find_one.return_value = None
         self.mock_db_client.image_collection.insert.return_value = bson.objectid.ObjectId()
         self.mock_db_client.grid_fs = mock.create_autospec(gridfs.GridFS)
+        self.mock_db_client.blob_collection = mock.create_autospec(pymongo.collection.Collection)
+        self.mock_db_client.blob_collection.find_one_and_update.return_value = None
 
     def test_save_image_does_nothing_for_not_an_image(self):
         result = ie.save_image(self.mock_db_client, 10)
@@ -576,3 +705,146 @@ class TestSaveImage(unittest.TestCase):
         ie.save_image(self.mock_db_client, image)
         s_image = self.mock_db_client.image_collection.insert.mock_calls[0][1][0]
         self.assertEqual(new_id, s_image['data'])
+
+    def test_save_image_looks_up_existing_images_by_hash(self):
+        image = core.image_entity.ImageEntity(
+            data=np.random.randint(0, 255, (32, 32, 3), dtype='uint8'),
+            data_id=0,
+            metadata=imeta.ImageMetadata(hash_=b'\xa5\xc9\x08\xaf$\x0b\x116',
+                                         source_type=imeta.ImageSourceType.SYNTHETIC))
+        ie.save_image(self.mock_db_client, image)
+        existing_query = self.mock_db_client.image_collection.find_one.mock_calls[0][1][0]
+        self.assertEqual({
+            'metadata.hash': b'\xa5\xc9\x08\xaf$\x0b\x116',
+            'metadata_hash': ie.get_metadata_hash(image.serialize())
+        }, existing_query)
+
+    def test_save_image_stores_metadata_hash(self):
+        image = core.image_entity.ImageEntity(
+            data=np.random.randint(0, 255, (32, 32, 3), dtype='uint8'),
+            data_id=0,
+            metadata=imeta.ImageMetadata(hash_=b'\xa5\xc9\x08\xaf$\x0b\x116',
+                                         source_type=imeta.ImageSourceType.SYNTHETIC))
+        ie.save_image(self.mock_db_client, image)
+        s_image = self.mock_db_client.image_collection.insert.mock_calls[0][1][0]
+        self.assertEqual(ie.get_metadata_hash(image.serialize()), s_image['metadata_hash'])
+
+
+class TestMetadataHash(unittest.TestCase):
+
+    def make_image(self, **kwargs):
+        return ie.ImageEntity(**du.defaults(kwargs, {
+            'data': np.random.randint(0, 255, (32, 32, 3), dtype='uint8'),
+            'metadata': imeta.ImageMetadata(
+                hash_=b'\xa5\xc9\x08\xaf$\x0b\x116',
+                source_type=imeta.ImageSourceType.SYNTHETIC,
+                camera_pose=tf.Transform(location=(1, 2, 3), rotation=(1, 0, 0, 0)),
+                labelled_objects=[imeta.LabelledObject(class_names=('cup',), bounding_box=(1, 2, 3, 4))]),
+            'additional_metadata': {'a': 1, 'b': [1, 2]}
+        }))
+
+    def test_ignores_data_ids(self):
+        image1 = self.make_image(data_id=bson.objectid.ObjectId())
+        image2 = self.make_image(data_id=bson.objectid.ObjectId(), depth_id=bson.objectid.ObjectId())
+        self.assertEqual(ie.get_metadata_hash(image1.serialize()), ie.get_metadata_hash(image2.serialize()))
+
+    def test_changes_with_metadata(self):
+        image1 = self.make_image()
+        image2 = self.make_image(additional_metadata={'a': 2, 'b': [1, 2]})
+        image3 = self.make_image(metadata=imeta.ImageMetadata(hash_=b'\xa5\xc9\x08\xaf$\x0b\x116',
+                                                              source_type=imeta.ImageSourceType.REAL_WORLD))
+        hashes = {ie.get_metadata_hash(image.serialize()) for image in (image1, image2, image3)}
+        self.assertEqual(3, len(hashes))
+
+    def test_is_unchanged_by_storing_in_database(self):
+        zombie_db_client = mock_db_client_fac.create()
+        image = self.make_image()
+        image_id = zombie_db_client.mock.image_collection.insert(image.serialize())
+        s_image = zombie_db_client.mock.image_collection.find_one({'_id': image_id})
+        self.assertEqual(ie.get_metadata_hash(image.serialize()), ie.get_metadata_hash(s_image))
+
+    def test_save_image_finds_images_without_metadata_hash(self):
+        zombie_db_client = mock_db_client_fac.create()
+        image = self.make_image()
+        image_id = zombie_db_client.mock.image_collection.insert(image.serialize())
+        self.assertEqual(image_id, ie.save_image(zombie_db_client.mock, self.make_image()))
+        s_image = zombie_db_client.mock.image_collection.find_one({'_id': image_id})
+        self.assertEqual(ie.get_metadata_hash(image.serialize()), s_image['metadata_hash'])
+        self.assertEqual(1, zombie_db_client.mock.image_collection.find({}).count())
+
+    def test_save_images_finds_images_without_metadata_hash(self):
+        zombie_db_client = mock_db_client_fac.create()
+        image_id = zombie_db_client.mock.image_collection.insert(self.make_image().serialize())
+        self.assertEqual([image_id], ie.save_images(zombie_db_client.mock, [self.make_image()]))
+        self.assertEqual(1, zombie_db_client.mock.image_collection.find({}).count())
+
+
+class TestSaveImages(unittest.TestCase):
+
+    def setUp(self):
+        self.zombie_db_client = mock_db_client_fac.create()
+        self.db_client = self.zombie_db_client.mock
+
+    def make_image(self, **kwargs):
+        data = np.random.randint(0, 255, (32, 32, 3), dtype='uint8')
+        return ie.ImageEntity(**du.defaults(kwargs, {
+            'data': data,
+            'depth_data': np.random.uniform(0, 10, (32, 32)),
+            'metadata': imeta.ImageMetadata(
+                hash_=xxhash.xxh64(data).digest(),
+                source_type=imeta.ImageSourceType.SYNTHETIC,
+                camera_pose=tf.Transform(location=np.random.uniform(-10, 10, 3),
+                                         rotation=(1, 0, 0, 0)),
+                intrinsics=cam_intr.CameraIntrinsics(32, 32, 20, 20, 16, 16))
+        }))
+
+    def test_saves_images_and_returns_ids_in_order(self):
+        images = [self.make_image() for _ in range(5)]
+        image_ids = ie.save_images(self.db_client, images)
+        self.assertEqual(5, len(image_ids))
+        self.assertEqual(5, len(set(image_ids)))
+        for image, image_id in zip(images, image_ids):
+            s_image = self.db_client.image_collection.find_one({'_id': image_id})
+            self.assertEqual(image.metadata.hash, s_image['metadata']['hash'])
+            self.assertTrue(np.array_equal(image.data, ie.load_image_data(self.db_client, s_image['data'])))
+
+    def test_inserts_all_images_at_once(self):
+        ie.save_images(self.db_client, [self.make_image() for _ in range(5)])
+        self.assertEqual(1, self.db_client.image_collection.insert_many.call_count)
+        self.assertEqual(1, self.db_client.image_collection.find.call_count)
+        self.assertFalse(self.db_client.image_collection.find_one.called)
+
+    def test_finds_existing_images(self):
+        images = [self.make_image() for _ in range(3)]
+        existing_id = ie.save_image(self.db_client, images[1])
+        self.db_client.grid_fs.put.reset_mock()
+
+        image_ids = ie.save_images(self.db_client, [image_to_entity_copy(image) for image in images])
+        self.assertEqual(existing_id, image_ids[1])
+        self.assertNotIn(existing_id, [image_ids[0], image_ids[2]])
+        self.assertEqual(2 * 2, self.db_client.grid_fs.put.call_count)
+
+    def test_saves_duplicate_images_once(self):
+        image = self.make_image()
+        image_ids = ie.save_images(self.db_client, [image, image_to_entity_copy(image)])
+        self.assertEqual(image_ids[0], image_ids[1])
+        self.assertEqual(1, self.db_client.image_collection.find({}).count())
+
+    def test_returns_none_for_things_that_are_not_images(self):
+        image_ids = ie.save_images(self.db_client, [10, self.make_image()])
+        self.assertIsNone(image_ids[0])
+        self.assertIsNotNone(image_ids[1])
+
+    def test_converts_image_objects(self):
+        image = core.image.Image(data=np.random.randint(0, 255, (32, 32, 3), dtype='uint8'),
+                                 metadata=imeta.ImageMetadata(hash_=b'\xa5\xc9\x08\xaf$\x0b\x116',
+                                                              source_type=imeta.ImageSourceType.SYNTHETIC))
+        image_ids = ie.save_images(self.db_client, [image])
+        self.assertIsNotNone(self.db_client.image_collection.find_one({'_id': image_ids[0]}))
+
+
+def image_to_entity_copy(image):
+    """
+    Make a copy of an unsaved image entity, sharing the same data and metadata
+    """
+    return ie.ImageEntity(data=image.data, depth_data=image.depth_data, metadata=image.metadata)
@@ -0,0 +1,184 @@
+# Copyright (c) 2017, John Skinner
+import os
+import time
+import tempfile
+import threading
+import logging
+
+
+class BlobCache:
+    """
+    A size-limited cache of GridFS files on the local disk, so that repeatedly reading the same images
+    doesn't have to fetch them from the database server every time.
+    Files are stored by their GridFS id, which never changes, so cached files never go stale.
+    When the cache grows larger than the maximum size, the least recently used files are removed.
+
+    Several processes on the same machine may share the same cache folder.
+    Files are written to a temporary name and then atomically renamed, so readers never see partial files,
+    and a file disappearing because another process evicted it is just treated as a cache miss.
+    """
+
+    # When evicting, reduce the size to this fraction of the maximum, so that we don't evict on every put
+    _EVICT_TO_FRACTION = 0.9
+    # Temporary files older than this (in seconds) were left behind by a process that died, and can be removed
+    _STALE_TEMP_AGE = 3600
+    _TEMP_SUFFIX = '.tmp'
+
+    def __init__(self, folder, max_size):
+        """
+        :param folder: The folder to store cached files in. Created if it doesn't exist.
+        :param max_size: The maximum total size of the cache, in bytes.
+        """
+        self._folder = os.path.expanduser(folder)
+        self._max_size = int(max_size)
+        self._estimated_size = None
+        self._lock = threading.Lock()
+        os.makedirs(self._folder, exist_ok=True)
+
+    @property
+    def folder(self):
+        return self._folder
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    def get(self, file_id):
+        """
+        Get the cached contents of a file, marking it as recently used.
+        :param file_id: The GridFS id of the file
+        :return: The bytes of the file, or None if it is not in the cache
+        """
+        path = self._get_path(file_id)
+        try:
+            with open(path, 'rb') as cache_file:
+                data = cache_file.read()
+        except OSError:
+            return None
+        try:
+            # Use the modification time to track use, access times are often disabled on the file system
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def put(self, file_id, data):
+        """
+        Store the contents of a file in the cache, evicting old files if the cache is too large.
+        :param file_id: The GridFS id of the file
+        :param data: The bytes of the file
+        :return: void
+        """
+        if len(data) > self._max_size:
+            return
+        path = self._get_path(file_id)
+        if os.path.isfile(path):
+            # Already cached, probably by another process
+            return
+        folder = os.path.dirname(path)
+        try:
+            os.makedirs(folder, exist_ok=True)
+            handle, temp_path = tempfile.mkstemp(suffix=self._TEMP_SUFFIX, prefix='.', dir=folder)
+            try:
+                with os.fdopen(handle, 'wb') as temp_file:
+                    temp_file.write(data)
+                os.replace(temp_path, path)
+            except OSError:
+                os.remove(temp_path)
+                raise
+        except OSError as ex:
+            # Failing to cache is never fatal, we can always get the data from the database again
+            logging.getLogger(__name__).warning("Failed to cache file {0}: {1}".format(file_id, ex))
+            return
+
+        with self._lock:
+            if self._estimated_size is None:
+                self._estimated_size = self._get_total_size()
+            else:
+                self._estimated_size += len(data)
+            needs_eviction = self._estimated_size > self._max_size
+        if needs_eviction:
+            self.evict()
+
+    def remove(self, file_id):
+        """
+        Remove a file from the cache, because it has been deleted from the database.
+        :param file_id: The GridFS id of the file
+        :return: void
+        """
+        try:
+            os.remove(self._get_path(file_id))
+        except OSError:
+            pass
+
+    def evict(self, target_size=None):
+        """
+        Remove the least recently used files until the cache is smaller than some target size.
+        The size is measured from the files actually on disk, which includes files cached by other processes.
+        :param target_size: The size to reduce the cache to, in bytes. Default is slightly less than the maximum size.
+        :return: void
+        """
+        if target_size is None:
+            target_size = int(self._max_size * self._EVICT_TO_FRACTION)
+        entries = []
+        total_size = 0
+        now = time.time()
+        for path, stat in self._scan():
+            if path.endswith(self._TEMP_SUFFIX):
+                if now - stat.st_mtime > self._STALE_TEMP_AGE:
+                    self._try_remove(path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+        if total_size > target_size:
+            entries.sort()
+            for _, size, path in entries:
+                if total_size <= target_size:
+                    break
+                # Even if some other process got to it first, the file is gone
+                self._try_remove(path)
+                total_size -= size
+        with self._lock:
+            self._estimated_size = total_size
+
+    def _get_path(self, file_id):
+        """
+        Get the path for a particular file in the cache.
+        Files are split into sub-folders on the last characters of the id, which vary the most between files,
+        to keep the number of files in each folder manageable.
+        :param file_id: The GridFS id
+        :return: The full path of the cached file
+        """
+        file_id = str(file_id)
+        return os.path.join(self._folder, file_id[-2:], file_id)
+
+    def _get_total_size(self):
+        return sum(stat.st_size for path, stat in self._scan() if not path.endswith(self._TEMP_SUFFIX))
+
+    def _scan(self):
+        """
+        Find all the files in the cache folder
+        :return: A generator of path, stat pairs
+        """
+        try:
+            sub_folders = list(os.scandir(self._folder))
+        except OSError:
+            return
+        for sub_folder in sub_folders:
+            if not sub_folder.is_dir():
+                continue
+            try:
+                for entry in os.scandir(sub_folder.path):
+                    try:
+                        yield entry.path, entry.stat()
+                    except OSError:
+                        pass    # Removed while we were looking at it
+            except OSError:
+                pass
+
+    @staticmethod
+    def _try_remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
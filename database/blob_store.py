@@ -0,0 +1,91 @@
+# Copyright (c) 2017, John Skinner
+import xxhash
+import pymongo
+import pymongo.errors
+
+
+def store_blob(db_client, data):
+    """
+    Store some bytes in GridFS, reusing an existing file if the exact same bytes have already been stored.
+    Files are found by a hash of their contents, and reference counted so that they can be shared.
+    Every call to this must be matched by a call to release_blob when the reference is no longer needed.
+    :param db_client: The database client, for access to GridFS and the blob collection.
+    :param data: The bytes to store
+    :return: The GridFS id of the stored file
+    """
+    blob_hash = xxhash.xxh64(data).hexdigest()
+    while True:
+        existing = db_client.blob_collection.find_one_and_update(
+            {'hash': blob_hash, 'size': len(data)},
+            {'$inc': {'references': 1}},
+            projection={'file_id': True})
+        if existing is not None:
+            return existing['file_id']
+
+        file_id = db_client.grid_fs.put(data)
+        try:
+            db_client.blob_collection.insert_one({
+                'hash': blob_hash,
+                'size': len(data),
+                'file_id': file_id,
+                'references': 1
+            })
+            return file_id
+        except pymongo.errors.DuplicateKeyError:
+            # Someone else stored the same data at the same time. Use their copy instead.
+            db_client.grid_fs.delete(file_id)
+
+
+def load_blob(db_client, file_id):
+    """
+    Read the contents of a GridFS file, using the local blob cache if the database client has one.
+    :param db_client: The database client
+    :param file_id: The GridFS id of the file
+    :return: The bytes of the file
+    """
+    cache = db_client.blob_cache
+    if cache is not None:
+        data = cache.get(file_id)
+        if data is not None:
+            return data
+    data = db_client.grid_fs.get(file_id).read()
+    if cache is not None:
+        cache.put(file_id, data)
+    return data
+
+
+def release_blob(db_client, file_id):
+    """
+    Release a reference to a file stored with store_blob, deleting it from GridFS if nothing else refers to it.
+    Files stored directly in GridFS, without reference counting, are always deleted.
+    :param db_client: The database client
+    :param file_id: The GridFS id of the file
+    :return: True iff the file was deleted from GridFS
+    """
+    record = db_client.blob_collection.find_one_and_update(
+        {'file_id': file_id},
+        {'$inc': {'references': -1}},
+        projection={'references': True},
+        return_document=pymongo.ReturnDocument.AFTER)
+    if record is None:
+        _delete_file(db_client, file_id)
+        return True
+    elif record['references'] <= 0:
+        # Only delete if nothing has claimed the blob since, so we don't delete data that is in use
+        result = db_client.blob_collection.delete_one({'_id': record['_id'], 'references': {'$lte': 0}})
+        if result.deleted_count > 0:
+            _delete_file(db_client, file_id)
+            return True
+    return False
+
+
+def _delete_file(db_client, file_id):
+    """
+    Delete a file from GridFS, and from the local cache
+    :param db_client: The database client
+    :param file_id: The GridFS id of the file
+    :return: void
+    """
+    db_client.grid_fs.delete(file_id)
+    if db_client.blob_cache is not None:
+        db_client.blob_cache.remove(file_id)
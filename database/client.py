@@ -8,6 +8,7 @@ import gridfs
 import importlib
 import database.entity
 import database.entity_registry
+import database.blob_cache
 import util.dict_utils as du
 
 
@@ -30,6 +31,10 @@ class DatabaseClient:
                 'database_name': <database name>,
                 'gridfs_bucket': <gridfs bucket name>,
                 'temp_folder': <folder to store temporary files>,
+                'blob_cache': {
+                    'folder': <folder to cache image data on this machine, or None to disable the cache>,
+                    'max_size': <maximum size of the cache, in bytes>
+                },
                 'collections': {
                     'trainer_collection': <collection name for trainers>
                     'trainee_collection': <collection name for trainees>
@@ -41,6 +46,7 @@ class DatabaseClient:
                     'results_collection': <collection name for benchmark results>
                     'experiments_collection': <collection name for experiments>
                     'tasks_collection': <collection name for tasks>
+                    'blob_collection': <collection name for reference counts of shared GridFS files>
                 }
             }
         }
@@ -58,6 +64,10 @@ class DatabaseClient:
             'database_name': 'benchmark_system',
             'gridfs_bucket': 'fs',
             'temp_folder': 'temp',
+            'blob_cache': {
+                'folder': None,
+                'max_size': 10 * 1024 * 1024 * 1024
+            },
             'collections': {
                 'trainer_collection': 'trainers',
                 'trainee_collection': 'trainees',
@@ -68,7 +78,8 @@ class DatabaseClient:
                 'benchmarks_collection': 'benchmarks',
                 'results_collection': 'results',
                 'experiments_collection': 'experiments',
-                'tasks_collection': 'tasks'
+                'tasks_collection': 'tasks',
+                'blob_collection': 'blobs'
             }
         }, modify_base=False)
 
@@ -76,6 +87,13 @@ class DatabaseClient:
         db_name = db_config['database_name']
         self._temp_folder = db_config['temp_folder']
         os.makedirs(self._temp_folder, exist_ok=True)   # Make sure the temp folder exists.
+        if db_config['blob_cache']['folder']:
+            self._blob_cache = database.blob_cache.BlobCache(
+                folder=db_config['blob_cache']['folder'],
+                max_size=db_config['blob_cache']['max_size']
+            )
+        else:
+            self._blob_cache = None
         self._trainer_collection_name = db_config['collections']['trainer_collection']
         self._trainee_collection_name = db_config['collections']['trainee_collection']
         self._system_collection_name = db_config['collections']['system_collection']
@@ -86,10 +104,12 @@ class DatabaseClient:
         self._results_collection_name = db_config['collections']['results_collection']
         self._experiments_collection_name = db_config['collections']['experiments_collection']
         self._tasks_collection_name = db_config['collections']['tasks_collection']
+        self._blob_collection_name = db_config['collections']['blob_collection']
 
         self._mongo_client = pymongo.MongoClient(**conn_kwargs)
         self._database = self._mongo_client[db_name]
         self._gridfs = gridfs.GridFS(self._database, collection=db_config['gridfs_bucket'])
+        self._create_indexes()
 
     @property
     def trainer_collection(self):
@@ -131,6 +151,10 @@ class DatabaseClient:
     def tasks_collection(self):
         return self._database[self._tasks_collection_name]
 
+    @property
+    def blob_collection(self):
+        return self._database[self._blob_collection_name]
+
     @property
     def grid_fs(self):
         return self._gridfs
@@ -139,6 +163,24 @@ class DatabaseClient:
     def temp_folder(self):
         return self._temp_folder
 
+    @property
+    def blob_cache(self):
+        """
+        The local cache of GridFS files, or None if caching is disabled
+        :return: A BlobCache, or None
+        """
+        return self._blob_cache
+
+    def _create_indexes(self):
+        """
+        Make sure the indexes we rely on for fast lookups exist.
+        Does nothing if they have already been created.
+        :return: void
+        """
+        self.blob_collection.create_index([('hash', pymongo.ASCENDING), ('size', pymongo.ASCENDING)], unique=True)
+        self.blob_collection.create_index('file_id')
+        self.image_collection.create_index([('metadata.hash', pymongo.ASCENDING), ('metadata_hash', pymongo.ASCENDING)])
+
     def deserialize_entity(self, s_entity, **kwargs):
         """
         Deserialize an entity, using the type to work out what module it's in,
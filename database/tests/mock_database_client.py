@@ -24,7 +24,8 @@ class ZombieDatabaseClient:
             'benchmarks_collection',
             'results_collection',
             'experiments_collection',
-            'tasks_collection'
+            'tasks_collection',
+            'blob_collection'
         ]:
             setattr(mock_db_client, coll_name, mock.Mock(wraps=getattr(mongomock_client.db, coll_name)))
 
@@ -34,6 +35,7 @@ class ZombieDatabaseClient:
         mock_db_client.grid_fs.get.side_effect = lambda id_: MockReadable(self._gridfs_data[id_])\
             if id_ in self._gridfs_data else None
         mock_db_client.grid_fs.put.side_effect = lambda bytes_: self.put(bytes_)
+        mock_db_client.blob_cache = None
 
         # Actually call through for deserialize entity
         mock_db_client.deserialize_entity.side_effect = (
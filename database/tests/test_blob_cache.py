@@ -0,0 +1,77 @@
+# Copyright (c) 2017, John Skinner
+import unittest
+import os
+import time
+import shutil
+import tempfile
+import bson
+import database.blob_cache as blob_cache
+
+
+class TestBlobCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_get_returns_none_for_missing_files(self):
+        subject = blob_cache.BlobCache(self.folder, 1024)
+        self.assertIsNone(subject.get(bson.ObjectId()))
+
+    def test_get_returns_stored_data(self):
+        subject = blob_cache.BlobCache(self.folder, 1024)
+        file_id = bson.ObjectId()
+        data = os.urandom(128)
+        subject.put(file_id, data)
+        self.assertEqual(data, subject.get(file_id))
+
+    def test_shares_files_between_instances(self):
+        file_id = bson.ObjectId()
+        data = os.urandom(128)
+        blob_cache.BlobCache(self.folder, 1024).put(file_id, data)
+        self.assertEqual(data, blob_cache.BlobCache(self.folder, 1024).get(file_id))
+
+    def test_remove_removes_file(self):
+        subject = blob_cache.BlobCache(self.folder, 1024)
+        file_id = bson.ObjectId()
+        subject.put(file_id, os.urandom(128))
+        subject.remove(file_id)
+        self.assertIsNone(subject.get(file_id))
+
+    def test_does_not_store_files_larger_than_the_cache(self):
+        subject = blob_cache.BlobCache(self.folder, 1024)
+        file_id = bson.ObjectId()
+        subject.put(file_id, os.urandom(2048))
+        self.assertIsNone(subject.get(file_id))
+
+    def test_evicts_least_recently_used_files(self):
+        subject = blob_cache.BlobCache(self.folder, 1000)
+        file_ids = [bson.ObjectId() for _ in range(4)]
+        for idx, file_id in enumerate(file_ids[:3]):
+            subject.put(file_id, os.urandom(300))
+            # Make sure the files have distinct modification times, oldest first
+            path = os.path.join(self.folder, str(file_id)[-2:], str(file_id))
+            os.utime(path, (time.time() - 100 + idx, time.time() - 100 + idx))
+        # Read the oldest file, so it is now the most recently used
+        self.assertIsNotNone(subject.get(file_ids[0]))
+
+        subject.put(file_ids[3], os.urandom(300))
+        self.assertIsNotNone(subject.get(file_ids[0]))
+        self.assertIsNone(subject.get(file_ids[1]))
+        self.assertIsNotNone(subject.get(file_ids[2]))
+        self.assertIsNotNone(subject.get(file_ids[3]))
+
+    def test_evict_removes_stale_temporary_files(self):
+        subject = blob_cache.BlobCache(self.folder, 1000)
+        os.makedirs(os.path.join(self.folder, 'ab'))
+        stale_path = os.path.join(self.folder, 'ab', '.stale.tmp')
+        fresh_path = os.path.join(self.folder, 'ab', '.fresh.tmp')
+        for path in (stale_path, fresh_path):
+            with open(path, 'wb') as temp_file:
+                temp_file.write(b'partial')
+        os.utime(stale_path, (time.time() - 7200, time.time() - 7200))
+        subject.evict()
+        self.assertFalse(os.path.exists(stale_path))
+        self.assertTrue(os.path.exists(fresh_path))
@@ -0,0 +1,81 @@
+# Copyright (c) 2017, John Skinner
+import unittest
+import os
+import unittest.mock as mock
+import database.tests.mock_database_client as mock_client_factory
+import database.blob_cache as blob_cache
+import database.blob_store as blob_store
+
+
+class TestBlobStore(unittest.TestCase):
+
+    def setUp(self):
+        self.zombie_db_client = mock_client_factory.create()
+        self.db_client = self.zombie_db_client.mock
+        self.db_client.blob_collection.create_index([('hash', 1), ('size', 1)], unique=True)
+
+    def test_store_blob_puts_data_in_gridfs(self):
+        data = os.urandom(128)
+        file_id = blob_store.store_blob(self.db_client, data)
+        self.assertEqual(1, self.db_client.grid_fs.put.call_count)
+        self.assertEqual(data, self.db_client.grid_fs.get(file_id).read())
+
+    def test_store_blob_reuses_identical_data(self):
+        data = os.urandom(128)
+        file_id = blob_store.store_blob(self.db_client, data)
+        self.assertEqual(file_id, blob_store.store_blob(self.db_client, bytes(data)))
+        self.assertEqual(1, self.db_client.grid_fs.put.call_count)
+        self.assertEqual(2, self.db_client.blob_collection.find_one({'file_id': file_id})['references'])
+
+    def test_store_blob_does_not_reuse_different_data(self):
+        file_id_1 = blob_store.store_blob(self.db_client, os.urandom(128))
+        file_id_2 = blob_store.store_blob(self.db_client, os.urandom(128))
+        self.assertNotEqual(file_id_1, file_id_2)
+        self.assertEqual(2, self.db_client.grid_fs.put.call_count)
+
+    def test_release_blob_only_deletes_after_last_reference(self):
+        data = os.urandom(128)
+        file_id = blob_store.store_blob(self.db_client, data)
+        blob_store.store_blob(self.db_client, data)
+
+        self.assertFalse(blob_store.release_blob(self.db_client, file_id))
+        self.assertFalse(self.db_client.grid_fs.delete.called)
+        self.assertTrue(blob_store.release_blob(self.db_client, file_id))
+        self.assertEqual(1, self.db_client.grid_fs.delete.call_count)
+        self.assertIsNone(self.db_client.blob_collection.find_one({'file_id': file_id}))
+
+    def test_release_blob_stores_again_after_delete(self):
+        data = os.urandom(128)
+        file_id = blob_store.store_blob(self.db_client, data)
+        blob_store.release_blob(self.db_client, file_id)
+        blob_store.store_blob(self.db_client, data)
+        self.assertEqual(2, self.db_client.grid_fs.put.call_count)
+
+    def test_release_blob_deletes_files_that_are_not_reference_counted(self):
+        file_id = self.db_client.grid_fs.put(os.urandom(128))
+        self.assertTrue(blob_store.release_blob(self.db_client, file_id))
+        self.assertEqual(1, self.db_client.grid_fs.delete.call_count)
+
+    def test_load_blob_reads_from_gridfs(self):
+        data = os.urandom(128)
+        file_id = self.db_client.grid_fs.put(data)
+        self.assertEqual(data, blob_store.load_blob(self.db_client, file_id))
+        self.assertEqual(1, self.db_client.grid_fs.get.call_count)
+
+    def test_load_blob_uses_cache(self):
+        data = os.urandom(128)
+        file_id = self.db_client.grid_fs.put(data)
+        self.db_client.blob_cache = mock.create_autospec(blob_cache.BlobCache)
+        self.db_client.blob_cache.get.return_value = None
+        self.assertEqual(data, blob_store.load_blob(self.db_client, file_id))
+        self.assertIn(mock.call(file_id, data), self.db_client.blob_cache.put.call_args_list)
+
+        self.db_client.blob_cache.get.return_value = data
+        self.assertEqual(data, blob_store.load_blob(self.db_client, file_id))
+        self.assertEqual(1, self.db_client.grid_fs.get.call_count)
+
+    def test_release_blob_removes_deleted_files_from_cache(self):
+        file_id = blob_store.store_blob(self.db_client, os.urandom(128))
+        self.db_client.blob_cache = mock.create_autospec(blob_cache.BlobCache)
+        blob_store.release_blob(self.db_client, file_id)
+        self.assertIn(mock.call(file_id), self.db_client.blob_cache.remove.call_args_list)
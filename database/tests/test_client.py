@@ -8,6 +8,7 @@ import pymongo.database
 import gridfs
 import importlib
 import database.client
+import database.blob_cache
 
 
 class TestDatabaseClient(unittest.TestCase):
@@ -242,6 +243,75 @@ class TestDatabaseClient(unittest.TestCase):
         self.assertTrue(database_instance.__getitem__.called)
         self.assertIn(mock.call(collection_name), database_instance.__getitem__.call_args_list)
 
+    @mock.patch('database.client.os.makedirs', autospec=os.makedirs)
+    @mock.patch('database.client.gridfs.GridFS', autospec=gridfs.GridFS)
+    @mock.patch('database.client.pymongo.MongoClient', autospec=pymongo.MongoClient)
+    def test_can_configure_blob_collection(self, mock_mongoclient, *_):
+        database_instance = mock.create_autospec(pymongo.database.Database)
+        mock_mongoclient.return_value.__getitem__.return_value = database_instance
+
+        collection_name = 'test_collection_name_' + str(random.uniform(-10000, 10000))
+        db_client = database.client.DatabaseClient({
+            'database_config': {
+                'collections': {
+                    'blob_collection': collection_name
+                }
+            }
+        })
+        _ = db_client.blob_collection
+        self.assertTrue(database_instance.__getitem__.called)
+        self.assertIn(mock.call(collection_name), database_instance.__getitem__.call_args_list)
+
+    @mock.patch('database.client.os.makedirs', autospec=os.makedirs)
+    @mock.patch('database.client.gridfs.GridFS', autospec=gridfs.GridFS)
+    @mock.patch('database.client.pymongo.MongoClient', autospec=pymongo.MongoClient)
+    def test_blob_cache_is_disabled_by_default(self, *_):
+        db_client = database.client.DatabaseClient({})
+        self.assertIsNone(db_client.blob_cache)
+
+    @mock.patch('database.client.database.blob_cache.BlobCache', autospec=database.blob_cache.BlobCache)
+    @mock.patch('database.client.os.makedirs', autospec=os.makedirs)
+    @mock.patch('database.client.gridfs.GridFS', autospec=gridfs.GridFS)
+    @mock.patch('database.client.pymongo.MongoClient', autospec=pymongo.MongoClient)
+    def test_can_configure_blob_cache(self, _, __, ___, mock_blob_cache):
+        folder = 'test_folder_' + str(random.uniform(-10000, 10000))
+        max_size = random.randint(1000, 100000)
+        db_client = database.client.DatabaseClient({
+            'database_config': {
+                'blob_cache': {
+                    'folder': folder,
+                    'max_size': max_size
+                }
+            }
+        })
+        self.assertTrue(mock_blob_cache.called)
+        self.assertEqual(mock.call(folder=folder, max_size=max_size), mock_blob_cache.call_args)
+        self.assertEqual(mock_blob_cache.return_value, db_client.blob_cache)
+
+    @mock.patch('database.client.os.makedirs', autospec=os.makedirs)
+    @mock.patch('database.client.gridfs.GridFS', autospec=gridfs.GridFS)
+    @mock.patch('database.client.pymongo.MongoClient', autospec=pymongo.MongoClient)
+    def test_creates_unique_blob_hash_index(self, mock_mongoclient, *_):
+        database_instance = mock.create_autospec(pymongo.database.Database)
+        mock_mongoclient.return_value.__getitem__.return_value = database_instance
+        mock_collection = database_instance.__getitem__.return_value
+
+        database.client.DatabaseClient({})
+        self.assertIn(mock.call([('hash', pymongo.ASCENDING), ('size', pymongo.ASCENDING)], unique=True),
+                      mock_collection.create_index.call_args_list)
+
+    @mock.patch('database.client.os.makedirs', autospec=os.makedirs)
+    @mock.patch('database.client.gridfs.GridFS', autospec=gridfs.GridFS)
+    @mock.patch('database.client.pymongo.MongoClient', autospec=pymongo.MongoClient)
+    def test_creates_image_hash_index(self, mock_mongoclient, *_):
+        database_instance = mock.create_autospec(pymongo.database.Database)
+        mock_mongoclient.return_value.__getitem__.return_value = database_instance
+        mock_collection = database_instance.__getitem__.return_value
+
+        database.client.DatabaseClient({})
+        self.assertIn(mock.call([('metadata.hash', pymongo.ASCENDING), ('metadata_hash', pymongo.ASCENDING)]),
+                      mock_collection.create_index.call_args_list)
+
     @mock.patch('database.client.os.makedirs', autospec=os.makedirs)
     @mock.patch('database.client.gridfs.GridFS', autospec=gridfs.GridFS)
     @mock.patch('database.client.pymongo.MongoClient', autospec=pymongo.MongoClient)
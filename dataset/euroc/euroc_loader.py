@@ -5,6 +5,8 @@ import xxhash
 import cv2
 import transforms3d as tf3d
 import util.associate
+import util.trajectory
+import util.prefetch
 import metadata.camera_intrinsics as cam_intr
 import metadata.image_metadata as imeta
 import util.transform as tf
@@ -56,27 +58,21 @@ def read_trajectory(trajectory_filepath):
     """
     Read the ground-truth camera trajectory from file
     :param trajectory_filepath:
-    :return: A map of timestamp to camera pose.
+    :return: A map of timestamp to camera pose, as a util.trajectory.Trajectory
     """
-    trajectory = {}
-    first_pose = None
     with open(trajectory_filepath, 'r') as trajectory_file:
-        for line in trajectory_file:
-            if line.startswith('#'):
-                # This line is a comment, skip and continue
-                continue
-            parts = line.split(',')
-            if len(parts) >= 8:
-                timestamp, tx, ty, tz, qw, qx, qy, qz = parts[0:8]
-                pose = make_camera_pose(float(tx), float(ty), float(tz),
-                                        float(qx), float(qy), float(qz), float(qw))
-                # Find the pose relative to the first frame, which we fix as 0,0,0
-                if first_pose is None:
-                    first_pose = pose
-                    trajectory[float(timestamp)] = tf.Transform()
-                else:
-                    trajectory[float(timestamp)] = first_pose.find_relative(pose)
-    return trajectory
+        trajectory = util.trajectory.read_trajectory_file(trajectory_file, delimiter=',', w_first=True)
+    if len(trajectory) <= 0:
+        return trajectory
+
+    # Change the coordinate frame the same way as make_camera_pose, for all the poses at once
+    trajectory = util.trajectory.Trajectory(
+        timestamps=trajectory.timestamps,
+        locations=trajectory.locations[:, (2, 0, 1)] * (1, -1, -1),
+        rotations=trajectory.rotations[:, (0, 3, 1, 2)] * (1, 1, -1, -1)
+    )
+    # Find the poses relative to the first frame, which we fix as 0,0,0
+    return trajectory.find_relative(trajectory[trajectory.timestamps[0]])
 
 
 def associate_data(root_map, *args):
@@ -145,10 +141,19 @@ def get_camera_calibration(sensor_yaml_path):
     return extrinsics, intrinsics
 
 
-def import_dataset(root_folder, db_client):
+def import_dataset(root_folder, db_client, num_workers=None, max_frames_in_flight=32, checkpoint=None):
     """
-    Load a TUM image sequences into the database.
-    :return:
+    Load a EuRoC image sequences into the database.
+    Stereo pairs are read and decoded on a pool of worker threads, and handed to the image collection builder
+    in timestamp order as they become available, so that reading images overlaps with saving them.
+    :param root_folder: The folder containing the sequence
+    :param db_client: The database client
+    :param num_workers: The number of threads used to read images. Default None, which uses the number of CPUs.
+    :param max_frames_in_flight: The number of stereo frames to read ahead of saving them, which is also the number
+    of frames saved to the database at once. At most twice this many frames are held in memory. Default 32.
+    :param checkpoint: A dataset.import_checkpoint.ImportCheckpoint to record progress in, and to resume from.
+    Default None.
+    :return: The id of the imported image collection, or None if the folder doesn't contain a EuRoC sequence
     """
     if not os.path.isdir(root_folder):
         return None
@@ -168,37 +173,65 @@ def import_dataset(root_folder, db_client):
 
     left_image_files = read_image_filenames(left_rgb_path)
     left_extrinsics, left_intrinsics = get_camera_calibration(left_camera_intrinsics_path)
-    right_image_files = read_image_filenames(left_rgb_path)
+    right_image_files = read_image_filenames(right_rgb_path)
     right_extrinsics, right_intrinsics = get_camera_calibration(right_camera_intrinsics_path)
     trajectory = read_trajectory(trajectory_path)
 
     # Step 2: Associate the different data types by timestamp. Trajectory last because it's bigger than the stereo.
     all_metadata = associate_data(left_image_files, right_image_files, trajectory)
 
-    # Step 3: Load the images from the metadata
-    builder = dataset.image_collection_builder.ImageCollectionBuilder(db_client)
-    for timestamp, left_image_file, right_image_file, robot_pose in all_metadata:
-        left_data = cv2.imread(os.path.join(root_folder, 'cam0', 'data', left_image_file), cv2.IMREAD_COLOR)
-        right_data = cv2.imread(os.path.join(root_folder, 'cam1', 'data', right_image_file), cv2.IMREAD_COLOR)
-        left_data = np.ascontiguousarray(left_data[:, :, ::-1])
-        right_data = np.ascontiguousarray(right_data[:, :, ::-1])
-
-        left_pose = robot_pose.find_independent(left_extrinsics)
-        right_pose = robot_pose.find_independent(right_extrinsics)
-
-        builder.add_image(image=core.image_entity.StereoImageEntity(
-            left_data=left_data,
-            right_data=right_data,
-            metadata=imeta.ImageMetadata(
-                hash_=xxhash.xxh64(left_data).digest(),
-                camera_pose=left_pose,
-                right_camera_pose=right_pose,
-                intrinsics=left_intrinsics,
-                right_intrinsics=right_intrinsics,
-                source_type=imeta.ImageSourceType.REAL_WORLD,
-                environment_type=imeta.EnvironmentType.INDOOR_CLOSE,
-                light_level=imeta.LightingLevel.WELL_LIT,
-                time_of_day=imeta.TimeOfDay.DAY,
-            )
-        ), timestamp=timestamp)
+    # Skip any frames that were saved before the import was interrupted
+    max_frames_in_flight = max(1, int(max_frames_in_flight))
+    builder = dataset.image_collection_builder.ImageCollectionBuilder(db_client, batch_size=max_frames_in_flight,
+                                                                      checkpoint=checkpoint)
+    all_metadata = [frame_metadata for frame_metadata in all_metadata if not builder.has_image(frame_metadata[0])]
+
+    # Step 3: Load the images from the metadata.
+    # OpenCV releases the GIL while decoding, so the frames can be read on threads.
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    frame_loader = util.prefetch.OrderedPrefetcher(
+        load=lambda idx: read_stereo_frame(root_folder, all_metadata[idx][1], all_metadata[idx][2]),
+        keys=range(len(all_metadata)),
+        depth=max_frames_in_flight,
+        num_workers=max(1, min(int(num_workers), max_frames_in_flight))
+    )
+    try:
+        for idx, (left_data, right_data, image_hash) in frame_loader:
+            timestamp, _, _, robot_pose = all_metadata[idx]
+            left_pose = robot_pose.find_independent(left_extrinsics)
+            right_pose = robot_pose.find_independent(right_extrinsics)
+
+            builder.add_image(image=core.image_entity.StereoImageEntity(
+                left_data=left_data,
+                right_data=right_data,
+                metadata=imeta.ImageMetadata(
+                    hash_=image_hash,
+                    camera_pose=left_pose,
+                    right_camera_pose=right_pose,
+                    intrinsics=left_intrinsics,
+                    right_intrinsics=right_intrinsics,
+                    source_type=imeta.ImageSourceType.REAL_WORLD,
+                    environment_type=imeta.EnvironmentType.INDOOR_CLOSE,
+                    light_level=imeta.LightingLevel.WELL_LIT,
+                    time_of_day=imeta.TimeOfDay.DAY,
+                )
+            ), timestamp=timestamp)
+    finally:
+        frame_loader.close()
     return builder.save()
+
+
+def read_stereo_frame(root_folder, left_image_file, right_image_file):
+    """
+    Read and decode the left and right images for a single frame. This is called from worker threads.
+    :param root_folder: The folder containing the sequence
+    :param left_image_file: The file name of the left image, within the cam0 data folder
+    :param right_image_file: The file name of the right image, within the cam1 data folder
+    :return: The left image, the right image, and the hash of the left image
+    """
+    left_data = cv2.imread(os.path.join(root_folder, 'cam0', 'data', left_image_file), cv2.IMREAD_COLOR)
+    right_data = cv2.imread(os.path.join(root_folder, 'cam1', 'data', right_image_file), cv2.IMREAD_COLOR)
+    left_data = np.ascontiguousarray(left_data[:, :, ::-1])
+    right_data = np.ascontiguousarray(right_data[:, :, ::-1])
+    return left_data, right_data, xxhash.xxh64(left_data).digest()
@@ -1,7 +1,13 @@
 import unittest
 import unittest.mock as mock
+import os.path
+import shutil
+import tempfile
 import numpy as np
+import cv2
 import transforms3d as tf3d
+import database.tests.mock_database_client as mock_client_factory
+import core.image_entity
 import dataset.euroc.euroc_loader as euroc_loader
 import util.transform as tf
 
@@ -133,6 +139,61 @@ class TestReadTrajectory(unittest.TestCase):
         self.assertTrue(np.all(np.isclose(arr1, arr2)), "Arrays {0} and {1} are not close".format(str(arr1), str(arr2)))
 
 
+class TestImportDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.root_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root_folder)
+        for folder in ('cam0', 'cam1'):
+            os.makedirs(os.path.join(self.root_folder, folder, 'data'))
+            with open(os.path.join(self.root_folder, folder, 'sensor.yaml'), 'w') as sensor_file:
+                sensor_file.write('T_BS:\n'
+                                  '  rows: 4\n'
+                                  '  cols: 4\n'
+                                  '  data: [1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, {0}, 0.0, 0.0, 1.0, 0.0, '
+                                  '0.0, 0.0, 0.0, 1.0]\n'
+                                  'resolution: [16, 12]\n'
+                                  'intrinsics: [10.0, 10.0, 8.0, 6.0]\n'
+                                  'distortion_coefficients: [0.0, 0.0, 0.0, 0.0]\n'.format(
+                                    0.1 if folder == 'cam1' else 0.0))
+        os.makedirs(os.path.join(self.root_folder, 'state_groundtruth_estimate0'))
+
+        self.frames = []
+        with open(os.path.join(self.root_folder, 'cam0', 'data.csv'), 'w') as left_file, \
+                open(os.path.join(self.root_folder, 'cam1', 'data.csv'), 'w') as right_file, \
+                open(os.path.join(self.root_folder, 'state_groundtruth_estimate0', 'data.csv'), 'w') as traj_file:
+            left_file.write('#timestamp [ns],filename\n')
+            right_file.write('#timestamp [ns],filename\n')
+            for idx in range(10):
+                timestamp = 1403636579763555584 + idx * 50000000
+                left_data = np.random.randint(0, 255, (12, 16, 3), dtype='uint8')
+                right_data = np.random.randint(0, 255, (12, 16, 3), dtype='uint8')
+                cv2.imwrite(os.path.join(self.root_folder, 'cam0', 'data', '{0}.png'.format(timestamp)), left_data)
+                cv2.imwrite(os.path.join(self.root_folder, 'cam1', 'data', '{0}.png'.format(timestamp)), right_data)
+                left_file.write('{0},{0}.png\n'.format(timestamp))
+                right_file.write('{0},{0}.png\n'.format(timestamp))
+                traj_file.write('{0},{1},0,0,1,0,0,0\n'.format(timestamp, idx))
+                self.frames.append((left_data, right_data))
+
+    def test_imports_stereo_frames_in_order(self):
+        db_client = mock_client_factory.create().mock
+        collection_id = euroc_loader.import_dataset(self.root_folder, db_client, num_workers=3,
+                                                    max_frames_in_flight=4)
+        s_collection = db_client.image_source_collection.find_one({'_id': collection_id})
+        self.assertEqual(len(self.frames), len(s_collection['images']))
+        for (left_data, right_data), (_, image_id) in zip(self.frames, s_collection['images']):
+            image = core.image_entity.StereoImageEntity.deserialize(
+                db_client.image_collection.find_one({'_id': image_id}), db_client)
+            self.assertTrue(np.array_equal(left_data[:, :, ::-1], image.left_data))
+            self.assertTrue(np.array_equal(right_data[:, :, ::-1], image.right_data))
+            self.assertAlmostEqual(0.1, image.right_camera_pose.location[1] - image.left_camera_pose.location[1])
+
+    def test_saves_frames_in_batches(self):
+        db_client = mock_client_factory.create().mock
+        euroc_loader.import_dataset(self.root_folder, db_client, max_frames_in_flight=4)
+        self.assertEqual(3, db_client.image_collection.insert_many.call_count)
+
+
 def extend_mock_open(mock_open):
     """
     Extend the mock_open object to allow iteration over the file object.
@@ -15,6 +15,7 @@ import dataset.generated.metadata_patch as metadata_patch
 import metadata.image_metadata as imeta
 import metadata.camera_intrinsics as intrins
 import util.dict_utils as du
+import util.prefetch
 import util.unreal_transform as ue_tf
 
 
@@ -263,7 +264,7 @@ def import_image_object(base_path, filename_format, mappings, index_padding,
         )
 
 
-def import_dataset(metadata_path, db_client):
+def import_dataset(metadata_path, db_client, checkpoint=None, num_workers=8, max_frames_in_flight=16):
     """
     Search in a given folder path for generated image datasets and import them.
     A dataset is structured as a folder full of images, containing a file called 'metadata.json'
@@ -271,8 +272,16 @@ def import_dataset(metadata_path, db_client):
     All images must be indexed, determining their order in the image sequence.
     Uses iglob to search subdirectories, so it can import many datasets at once.
 
+    Each image is made of several files, so the images are read, parsed, and hashed on a pool of worker threads,
+    and saved in batches in index order. Reading is mostly waiting on the disk, so there can be more workers than CPUs.
+
     :param metadata_path: The
     :param db_client: The client to the database to store the images in.
+    :param checkpoint: A dataset.import_checkpoint.ImportCheckpoint to record progress in, and to resume from.
+    Default None.
+    :param num_workers: The number of threads reading images. Default 8.
+    :param max_frames_in_flight: The number of images to read ahead of saving them, which is also the number
+    of images saved to the database at once. At most twice this many images are held in memory. Default 16.
     :return: The ids of the newly imported datasets
     """
     if os.path.isfile(metadata_path):
@@ -281,26 +290,38 @@ def import_dataset(metadata_path, db_client):
             metadata = json.load(metadata_file)
         metadata_patch.update_dataset_metadata(metadata)
 
-        builder = dataset.image_collection_builder.ImageCollectionBuilder(db_client)
+        max_frames_in_flight = max(1, int(max_frames_in_flight))
+        builder = dataset.image_collection_builder.ImageCollectionBuilder(db_client, batch_size=max_frames_in_flight,
+                                                                          checkpoint=checkpoint)
 
         # First, load the images.
         dataset_dir = os.path.dirname(metadata_path)
         file_extension = metadata['File Extension']
 
-        # loop over the maximum possible number of images, should break before the end of this range
-        for index in range(0, len(glob.glob(os.path.join(dataset_dir, '*' + file_extension)))):
-            image = import_image_object(base_path=dataset_dir,
-                                        index=index,
-                                        filename_format=metadata['Image Filename Format'],
-                                        mappings=metadata['Image Filename Format Mappings'],
-                                        index_padding=metadata['Index Padding'],
-                                        extension=file_extension,
-                                        dataset_metadata=copy.deepcopy(metadata))
-            if image is not None:
-                builder.add_image(image)
-            else:
-                # This image failed to load, lets assume we've reached the maximum range of the dataset
-                break
+        # Read the maximum possible number of images, skipping any saved before the import was interrupted
+        indexes = [index for index in range(0, len(glob.glob(os.path.join(dataset_dir, '*' + file_extension))))
+                   if not builder.has_image(index)]
+        image_loader = util.prefetch.OrderedPrefetcher(
+            load=lambda index: import_image_object(base_path=dataset_dir,
+                                                   index=index,
+                                                   filename_format=metadata['Image Filename Format'],
+                                                   mappings=metadata['Image Filename Format Mappings'],
+                                                   index_padding=metadata['Index Padding'],
+                                                   extension=file_extension,
+                                                   dataset_metadata=copy.deepcopy(metadata)),
+            keys=indexes,
+            depth=max_frames_in_flight,
+            num_workers=max(1, min(int(num_workers), max_frames_in_flight))
+        )
+        try:
+            for index, image in image_loader:
+                if image is not None:
+                    builder.add_image(image, timestamp=index)
+                else:
+                    # This image failed to load, lets assume we've reached the maximum range of the dataset
+                    break
+        finally:
+            image_loader.close()
 
         return builder.save()
     return None
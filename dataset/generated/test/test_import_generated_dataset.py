@@ -15,6 +15,7 @@ import util.dict_utils as du
 import metadata.image_metadata as imeta
 import core.image_entity
 import database.client
+import database.tests.mock_database_client as mock_client_factory
 import dataset.generated.import_generated_dataset as import_gen
 
 
@@ -385,7 +386,33 @@ class TestImportGeneratedDataset(unittest.TestCase):
         mock_open = mock.mock_open()
         with mock.patch('dataset.generated.import_generated_dataset.open', mock_open, create=True):
             import_gen.import_dataset('/temp/isfilehonest', mock_db_client)
-        self.assertEqual(1, mock_import_image.call_count)
+        # Images are read ahead, but none of them are saved
+        self.assertTrue(mock_import_image.called)
+        self.assertFalse(mock_db_client.image_source_collection.insert.called)
+
+    @mock.patch('dataset.generated.import_generated_dataset.import_image_object',
+                autospec=import_gen.import_image_object)
+    @mock.patch('dataset.generated.import_generated_dataset.glob.glob', autospec=glob.glob)
+    @mock.patch('dataset.generated.import_generated_dataset.json.load', autospec=json.load)
+    @mock.patch('dataset.generated.import_generated_dataset.os.path.isfile', autospec=os.path.isfile)
+    def test_import_dataset_ignores_images_after_failed_load(self, mock_isfile, mock_json_load, mock_glob,
+                                                             mock_import_image):
+        mock_glob.return_value = list(range(10))    # Values don't matter, only length
+        mock_isfile.return_value = True
+        mock_json_load.return_value = {
+            'File Extension': '.img',
+            'Image Filename Format': '{name}-{color}',
+            'Image Filename Format Mappings': {'name': 'yes', 'color': 'red'},
+            'Index Padding': 10
+        }
+        mock_import_image.side_effect = lambda index, **_: make_image() if index != 3 else None
+        db_client = mock_client_factory.create().mock
+        mock_open = mock.mock_open()
+        with mock.patch('dataset.generated.import_generated_dataset.open', mock_open, create=True):
+            collection_id = import_gen.import_dataset('/temp/isfilehonest', db_client, num_workers=4,
+                                                      max_frames_in_flight=2)
+        s_collection = db_client.image_source_collection.find_one({'_id': collection_id})
+        self.assertEqual([0, 1, 2], [timestamp for timestamp, _ in s_collection['images']])
 
     @mock.patch('dataset.generated.import_generated_dataset.import_image_object',
                 autospec=import_gen.import_image_object)
@@ -527,3 +554,12 @@ class TestImportGeneratedDataset(unittest.TestCase):
                             "{0} != {1}".format(str(arr1), str(arr2)))
         else:
             self.assertTrue(np.array_equal(arr1, arr2), "{0} != {1}".format(str(arr1), str(arr2)))
+
+
+def make_image():
+    data = np.random.randint(0, 255, (32, 32, 3), dtype='uint8')
+    return core.image_entity.ImageEntity(data=data, metadata=imeta.ImageMetadata(
+        source_type=imeta.ImageSourceType.SYNTHETIC,
+        hash_=np.random.bytes(8),
+        camera_pose=util.transform.Transform(location=np.random.uniform(-10, 10, 3))
+    ))
@@ -8,14 +8,31 @@ import util.database_helpers as db_help
 
 class ImageCollectionBuilder:
     """
-    A builder to create image collections within the database
+    A builder to create image collections within the database.
+    Images can either be saved as they are added, or buffered and saved in batches,
+    which is much faster when importing large datasets.
     """
 
-    def __init__(self, db_client):
+    def __init__(self, db_client, batch_size=1, checkpoint=None):
+        """
+        :param db_client: The database client
+        :param batch_size: The number of images to buffer before saving them together.
+        Default 1, which saves each image as soon as it is added.
+        :param checkpoint: A dataset.import_checkpoint.ImportCheckpoint to record saved images in,
+        so that an interrupted import can be resumed. Images already in the checkpoint are part of the collection,
+        use has_image to avoid loading them again. Default None, for no checkpoint.
+        """
         self._db_client = db_client
+        self._batch_size = max(1, int(batch_size))
+        self._checkpoint = checkpoint
+        self._pending = []
         self._image_ids = {}
         self._max_timestamp = None
         self._sequence_type = core.sequence_type.ImageSequenceType.SEQUENTIAL
+        if checkpoint is not None:
+            self._image_ids = checkpoint.load()
+            if len(self._image_ids) > 0:
+                self._max_timestamp = max(self._image_ids.keys())
 
     def set_non_sequential(self):
         """
@@ -40,10 +57,40 @@ class ImageCollectionBuilder:
         if hasattr(image, 'identifier') and image.identifier is not None:
             # Image is already in the database, just store it's id
             self._image_ids[timestamp] = image.identifier
+        elif self._batch_size > 1:
+            self._pending.append((timestamp, image))
+            if len(self._pending) >= self._batch_size:
+                self.flush()
         else:
             image_id = core.image_entity.save_image(self._db_client, image)
             if image_id is not None:
                 self._image_ids[timestamp] = image_id
+                if self._checkpoint is not None:
+                    self._checkpoint.record({timestamp: image_id})
+
+    def has_image(self, timestamp):
+        """
+        Has an image already been added at a particular timestamp.
+        When resuming from a checkpoint, importers use this to skip the images that were already saved.
+        :param timestamp: The timestamp
+        :return: True iff there is an image at that timestamp
+        """
+        return timestamp in self._image_ids or any(timestamp == pending[0] for pending in self._pending)
+
+    def flush(self):
+        """
+        Save any buffered images to the database.
+        This is done automatically when the buffer is full, and when the collection is saved.
+        :return: void
+        """
+        if len(self._pending) > 0:
+            image_ids = core.image_entity.save_images(self._db_client, [image for _, image in self._pending])
+            saved = [(timestamp, image_id) for (timestamp, _), image_id in zip(self._pending, image_ids)
+                     if image_id is not None]
+            self._image_ids.update(saved)
+            if self._checkpoint is not None:
+                self._checkpoint.record(saved)
+            self._pending = []
 
     def add_from_image_source(self, image_source, filter_function=None, offset=0):
         """
@@ -57,7 +104,7 @@ class ImageCollectionBuilder:
         the timestamps colliding
         :return:
         """
-        if (len(self._image_ids) > 0 or
+        if (len(self._image_ids) > 0 or len(self._pending) > 0 or
                 image_source.sequence_type == core.sequence_type.ImageSequenceType.NON_SEQUENTIAL):
             self._sequence_type = core.sequence_type.ImageSequenceType.NON_SEQUENTIAL
         with image_source:
@@ -74,6 +121,7 @@ class ImageCollectionBuilder:
         Checks if such an image collection already exists.
         :return: The id of the image collection in the database
         """
+        self.flush()
         if len(self._image_ids) > 0:
             return core.image_collection.ImageCollection.create_and_save(
                 db_client=self._db_client,
@@ -0,0 +1,54 @@
+# Copyright (c) 2017, John Skinner
+
+
+class ImportCheckpoint:
+    """
+    A record of the progress of a dataset import, stored on a database document such as the import task.
+    As images are saved, their timestamps and ids are added to the checkpoint,
+    so that if the import is interrupted, running it again can skip the images that are already saved
+    rather than reading, hashing, and looking up every one of them again.
+    """
+
+    def __init__(self, collection, document_id, field='import_progress'):
+        """
+        :param collection: The database collection containing the document to store the progress on
+        :param document_id: The id of the document
+        :param field: The field of the document to store the progress in. Default 'import_progress'
+        """
+        self._collection = collection
+        self._document_id = document_id
+        self._field = field
+
+    @property
+    def field(self):
+        return self._field
+
+    def load(self):
+        """
+        Read the images that have already been saved
+        :return: A dict of timestamp to image id, empty if nothing has been saved yet
+        """
+        document = self._collection.find_one({'_id': self._document_id}, {self._field: True})
+        if document is None or self._field not in document:
+            return {}
+        return {timestamp: image_id for timestamp, image_id in document[self._field]}
+
+    def record(self, image_ids):
+        """
+        Add some newly saved images to the checkpoint.
+        Only the new images are sent to the database, so this stays cheap as the import grows.
+        :param image_ids: A dict of timestamp to image id, or a list of (timestamp, image id) pairs
+        :return: void
+        """
+        if hasattr(image_ids, 'items'):
+            image_ids = image_ids.items()
+        image_ids = [[timestamp, image_id] for timestamp, image_id in image_ids]
+        if len(image_ids) > 0:
+            self._collection.update({'_id': self._document_id}, {'$push': {self._field: {'$each': image_ids}}})
+
+    def clear(self):
+        """
+        Remove the checkpoint from the database, once the import is complete
+        :return: void
+        """
+        self._collection.update({'_id': self._document_id}, {'$unset': {self._field: True}})
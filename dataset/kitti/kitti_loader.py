@@ -29,9 +29,11 @@ def make_camera_pose(pose):
     return tf.Transform(pose)
 
 
-def import_dataset(root_folder, db_client, sequence_number=0):
+def import_dataset(root_folder, db_client, sequence_number=0, checkpoint=None):
     """
     Load a KITTI image sequences into the database.
+    :param checkpoint: A dataset.import_checkpoint.ImportCheckpoint to record progress in, and to resume from.
+    Default None.
     :return:
     """
     sequence_name = "{0:02}".format(sequence_number)
@@ -39,7 +41,7 @@ def import_dataset(root_folder, db_client, sequence_number=0):
         return None
 
     data = pykitti.odometry(root_folder, sequence=sequence_name)
-    builder = dataset.image_collection_builder.ImageCollectionBuilder(db_client)
+    builder = dataset.image_collection_builder.ImageCollectionBuilder(db_client, batch_size=50, checkpoint=checkpoint)
 
     # dataset.calib:      Calibration data are accessible as a named tuple
     # dataset.timestamps: Timestamps are parsed into a list of timedelta objects
@@ -49,6 +51,9 @@ def import_dataset(root_folder, db_client, sequence_number=0):
     # dataset.rgb:        Generator to load RGB stereo pairs (cam2, cam3)
     # dataset.velo:       Generator to load velodyne scans as [x,y,z,reflectance]
     for left_image, right_image, timestamp, pose in zip(data.cam2, data.cam3, data.timestamps, data.poses):
+        if builder.has_image(timestamp.total_seconds()):
+            # Already saved before the import was interrupted
+            continue
         camera_pose = make_camera_pose(pose)
         # camera pose is for cam0, we want cam2, which is 6cm (0.06m) to the left
         camera_pose = camera_pose.find_independent(tf.Transform(location=(0, 0.06, 0), rotation=(0, 0, 0, 1),
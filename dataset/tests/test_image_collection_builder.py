@@ -5,7 +5,9 @@ import numpy as np
 import pymongo
 import bson
 import gridfs
+import xxhash
 import database.client
+import database.tests.mock_database_client as mock_client_factory
 import core.image_entity
 import core.image_source
 import core.sequence_type
@@ -13,6 +15,7 @@ import util.transform as tf
 import util.dict_utils as du
 import metadata.image_metadata as imeta
 import dataset.image_collection_builder
+import dataset.import_checkpoint
 
 
 class MockImageSource(core.image_source.ImageSource):
@@ -107,7 +110,9 @@ class TestImageCollectionBuilder(unittest.TestCase):
         image = make_image()
         subject.add_image(image)
         self.assertTrue(self.mock_db_client.image_collection.insert.called)
-        self.assertIn(mock.call(image.serialize()), self.mock_db_client.image_collection.insert.mock_calls)
+        s_image = image.serialize()
+        s_image['metadata_hash'] = core.image_entity.get_metadata_hash(s_image)
+        self.assertIn(mock.call(s_image), self.mock_db_client.image_collection.insert.mock_calls)
 
     def test_add_image_does_not_save_image_if_has_identifier(self):
         subject = dataset.image_collection_builder.ImageCollectionBuilder(self.mock_db_client)
@@ -207,7 +212,7 @@ class TestImageCollectionBuilder(unittest.TestCase):
         self.assertTrue(self.mock_db_client.image_source_collection.insert.called)
         query = self.mock_db_client.image_source_collection.insert.call_args[0][0]
         # Evaluate the query in bits, because we can't guarantee the order of the images
-        self.assertEqual({'_type', 'images', 'sequence_type'}, set(query.keys()))
+        self.assertEqual({'_type', 'images', 'sequence_type', 'image_properties'}, set(query.keys()))
         self.assertEqual('core.image_collection.ImageCollection', query['_type'])
         self.assertEqual('SEQ', query['sequence_type'])
         for idx, img_id in enumerate(ids):
@@ -245,3 +250,95 @@ class TestImageCollectionBuilder(unittest.TestCase):
         subject.save()
         self.assertTrue(self.mock_db_client.image_source_collection.insert.called)
         self.assertEqual('NON', self.mock_db_client.image_source_collection.insert.call_args[0][0]['sequence_type'])
+
+
+class TestBatchedImageCollectionBuilder(unittest.TestCase):
+
+    def setUp(self):
+        self.zombie_db_client = mock_client_factory.create()
+        self.db_client = self.zombie_db_client.mock
+
+    def test_add_image_buffers_images_until_batch_is_full(self):
+        subject = dataset.image_collection_builder.ImageCollectionBuilder(self.db_client, batch_size=3)
+        subject.add_image(make_random_image())
+        subject.add_image(make_random_image())
+        self.assertFalse(self.db_client.image_collection.insert_many.called)
+        subject.add_image(make_random_image())
+        self.assertEqual(1, self.db_client.image_collection.insert_many.call_count)
+        self.assertEqual(3, self.db_client.image_collection.find({}).count())
+
+    def test_save_saves_buffered_images(self):
+        images = [make_random_image() for _ in range(5)]
+        subject = dataset.image_collection_builder.ImageCollectionBuilder(self.db_client, batch_size=3)
+        for idx, image in enumerate(images):
+            subject.add_image(image, idx * 0.1)
+        collection_id = subject.save()
+        self.assertEqual(2, self.db_client.image_collection.insert_many.call_count)
+        self.assertFalse(self.db_client.image_collection.insert.called)
+
+        s_collection = self.db_client.image_source_collection.find_one({'_id': collection_id})
+        self.assertEqual('SEQ', s_collection['sequence_type'])
+        self.assertEqual(5, len(s_collection['images']))
+        for stamp, image_id in s_collection['images']:
+            s_image = self.db_client.image_collection.find_one({'_id': image_id})
+            self.assertEqual(images[int(round(stamp * 10))].metadata.hash, s_image['metadata']['hash'])
+
+    def test_adding_from_a_second_source_makes_sequence_non_sequential(self):
+        subject = dataset.image_collection_builder.ImageCollectionBuilder(self.db_client, batch_size=10)
+        subject.add_from_image_source(MockImageSource([make_random_image() for _ in range(2)]))
+        subject.add_from_image_source(MockImageSource([make_random_image() for _ in range(2)]), offset=100)
+        collection_id = subject.save()
+        s_collection = self.db_client.image_source_collection.find_one({'_id': collection_id})
+        self.assertEqual('NON', s_collection['sequence_type'])
+
+
+class TestImageCollectionBuilderCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.db_client = mock_client_factory.create().mock
+        task_id = self.db_client.tasks_collection.insert({})
+        self.checkpoint = dataset.import_checkpoint.ImportCheckpoint(self.db_client.tasks_collection, task_id)
+
+    def test_records_saved_images(self):
+        subject = dataset.image_collection_builder.ImageCollectionBuilder(self.db_client, batch_size=2,
+                                                                          checkpoint=self.checkpoint)
+        for idx in range(3):
+            subject.add_image(make_random_image(), idx)
+        self.assertEqual({0, 1}, set(self.checkpoint.load().keys()))
+        subject.flush()
+        self.assertEqual({0, 1, 2}, set(self.checkpoint.load().keys()))
+
+    def test_resumes_from_checkpoint(self):
+        images = [make_random_image() for _ in range(5)]
+        subject = dataset.image_collection_builder.ImageCollectionBuilder(self.db_client, checkpoint=self.checkpoint)
+        for idx in range(3):
+            subject.add_image(images[idx], idx)
+        self.db_client.image_collection.insert.reset_mock()
+
+        # Start again, as though the import was interrupted
+        subject = dataset.image_collection_builder.ImageCollectionBuilder(self.db_client, checkpoint=self.checkpoint)
+        self.assertTrue(subject.has_image(2))
+        self.assertFalse(subject.has_image(3))
+        for idx in range(5):
+            if not subject.has_image(idx):
+                subject.add_image(images[idx], idx)
+        self.assertEqual(2, self.db_client.image_collection.insert.call_count)
+
+        collection_id = subject.save()
+        s_collection = self.db_client.image_source_collection.find_one({'_id': collection_id})
+        self.assertEqual([0, 1, 2, 3, 4], [timestamp for timestamp, _ in s_collection['images']])
+
+    def test_continues_timestamps_from_checkpoint(self):
+        self.checkpoint.record({7: bson.ObjectId()})
+        subject = dataset.image_collection_builder.ImageCollectionBuilder(self.db_client, checkpoint=self.checkpoint)
+        subject.add_image(make_random_image())
+        self.assertTrue(subject.has_image(8))
+
+
+def make_random_image():
+    data = np.random.randint(0, 255, (32, 32, 3), dtype='uint8')
+    return core.image_entity.ImageEntity(data=data, metadata=imeta.ImageMetadata(
+        source_type=imeta.ImageSourceType.SYNTHETIC,
+        hash_=xxhash.xxh64(data).digest(),
+        camera_pose=tf.Transform(location=np.random.uniform(-10, 10, 3))
+    ))
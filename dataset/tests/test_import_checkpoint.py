@@ -0,0 +1,39 @@
+# Copyright (c) 2017, John Skinner
+import unittest
+import bson
+import database.tests.mock_database_client as mock_client_factory
+import dataset.import_checkpoint
+
+
+class TestImportCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.db_client = mock_client_factory.create().mock
+        self.task_id = self.db_client.tasks_collection.insert({'state': 1})
+
+    def test_load_is_empty_before_recording(self):
+        subject = dataset.import_checkpoint.ImportCheckpoint(self.db_client.tasks_collection, self.task_id)
+        self.assertEqual({}, subject.load())
+
+    def test_load_returns_recorded_images(self):
+        subject = dataset.import_checkpoint.ImportCheckpoint(self.db_client.tasks_collection, self.task_id)
+        image_ids = {idx * 0.1: bson.ObjectId() for idx in range(10)}
+        subject.record({timestamp: image_ids[timestamp] for timestamp in list(image_ids.keys())[:5]})
+        subject.record([(timestamp, image_ids[timestamp]) for timestamp in list(image_ids.keys())[5:]])
+        self.assertEqual(image_ids, subject.load())
+
+    def test_stores_progress_on_document(self):
+        subject = dataset.import_checkpoint.ImportCheckpoint(self.db_client.tasks_collection, self.task_id,
+                                                              field='my_progress')
+        image_id = bson.ObjectId()
+        subject.record({1.5: image_id})
+        s_task = self.db_client.tasks_collection.find_one({'_id': self.task_id})
+        self.assertEqual([[1.5, image_id]], s_task['my_progress'])
+        self.assertEqual(1, s_task['state'])
+
+    def test_clear_removes_progress(self):
+        subject = dataset.import_checkpoint.ImportCheckpoint(self.db_client.tasks_collection, self.task_id)
+        subject.record({1.5: bson.ObjectId()})
+        subject.clear()
+        self.assertEqual({}, subject.load())
+        self.assertNotIn('import_progress', self.db_client.tasks_collection.find_one({'_id': self.task_id}))
@@ -1,8 +1,14 @@
 # Copyright (c) 2017, John Skinner
 import unittest
+import os.path
+import shutil
+import tempfile
 import numpy as np
+import cv2
 import transforms3d as tf3d
 import util.transform as tf
+import database.tests.mock_database_client as mock_client_factory
+import core.image_entity
 import dataset.tum.tum_loader as tum_loader
 
 
@@ -85,6 +91,39 @@ class TestTUMLoader(unittest.TestCase):
         self.assertEqual([inner for inner in original_data if inner[0] > 2 and inner[0] < 8],
                          tum_loader.associate_data(int_map, float_map, str_map))
 
+    def test_import_dataset_reads_frames_in_order(self):
+        root_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root_folder)
+        os.makedirs(os.path.join(root_folder, 'rgb'))
+        os.makedirs(os.path.join(root_folder, 'depth'))
+        frames = []
+        with open(os.path.join(root_folder, 'rgb.txt'), 'w') as rgb_file, \
+                open(os.path.join(root_folder, 'depth.txt'), 'w') as depth_file, \
+                open(os.path.join(root_folder, 'groundtruth.txt'), 'w') as trajectory_file:
+            rgb_file.write('# timestamp filename\n')
+            for idx in range(10):
+                timestamp = 1.0 + idx / 30
+                rgb_data = np.random.randint(0, 255, (16, 16, 3), dtype='uint8')
+                depth_data = np.random.randint(0, 65535, (16, 16), dtype='uint16')
+                cv2.imwrite(os.path.join(root_folder, 'rgb', '{0}.png'.format(idx)), rgb_data)
+                cv2.imwrite(os.path.join(root_folder, 'depth', '{0}.png'.format(idx)), depth_data)
+                rgb_file.write('{0} rgb/{1}.png\n'.format(timestamp, idx))
+                depth_file.write('{0} depth/{1}.png\n'.format(timestamp, idx))
+                trajectory_file.write('{0} {1} 0 0 0 0 0 1\n'.format(timestamp, idx))
+                frames.append((timestamp, rgb_data, depth_data))
+
+        db_client = mock_client_factory.create().mock
+        collection_id = tum_loader.import_dataset(root_folder, db_client, num_workers=3)
+        s_collection = db_client.image_source_collection.find_one({'_id': collection_id})
+        self.assertEqual(len(frames), len(s_collection['images']))
+        for (timestamp, rgb_data, depth_data), (stamp, image_id) in zip(frames, s_collection['images']):
+            self.assertAlmostEqual(timestamp, stamp)
+            image = core.image_entity.ImageEntity.deserialize(
+                db_client.image_collection.find_one({'_id': image_id}), db_client)
+            self.assertNPEqual(rgb_data[:, :, ::-1], image.data)
+            self.assertNPEqual(depth_data / 5000, image.depth_data)
+            self.assertEqual(tum_loader.get_camera_intrinsics(root_folder), image.metadata.camera_intrinsics)
+
     def assertNPEqual(self, arr1, arr2):
         self.assertTrue(np.array_equal(arr1, arr2), "Arrays {0} and {1} are not equal".format(str(arr1), str(arr2)))
 
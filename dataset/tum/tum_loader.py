@@ -3,6 +3,8 @@ import os.path
 import xxhash
 import cv2
 import util.associate
+import util.trajectory
+import util.prefetch
 import metadata.camera_intrinsics as cam_intr
 import metadata.image_metadata as imeta
 import util.transform as tf
@@ -51,27 +53,21 @@ def read_trajectory(trajectory_filepath):
     """
     Read the ground-truth camera trajectory from file
     :param trajectory_filepath:
-    :return: A map of timestamp to camera pose.
+    :return: A map of timestamp to camera pose, as a util.trajectory.Trajectory
     """
-    trajectory = {}
-    first_pose = None
     with open(trajectory_filepath, 'r') as trajectory_file:
-        for line in trajectory_file:
-            if line.startswith('#'):
-                # This line is a comment, skip and continue
-                continue
-            parts = line.split(' ')
-            if len(parts) >= 8:
-                timestamp, tx, ty, tz, qx, qy, qz, qw = parts[0:8]
-                pose = make_camera_pose(float(tx), float(ty), float(tz),
-                                                                float(qx), float(qy), float(qz), float(qw))
-                # Find the pose relative to the first frame, which we fix as 0,0,0
-                if first_pose is None:
-                    first_pose = pose
-                    trajectory[float(timestamp)] = tf.Transform()
-                else:
-                    trajectory[float(timestamp)] = first_pose.find_relative(pose)
-    return trajectory
+        trajectory = util.trajectory.read_trajectory_file(trajectory_file, delimiter=None, w_first=False)
+    if len(trajectory) <= 0:
+        return trajectory
+
+    # Change the coordinate frame the same way as make_camera_pose, for all the poses at once
+    trajectory = util.trajectory.Trajectory(
+        timestamps=trajectory.timestamps,
+        locations=trajectory.locations[:, (2, 0, 1)] * (1, -1, -1),
+        rotations=trajectory.rotations[:, (0, 3, 1, 2)] * (1, 1, -1, -1)
+    )
+    # Find the poses relative to the first frame, which we fix as 0,0,0
+    return trajectory.find_relative(trajectory[trajectory.timestamps[0]])
 
 
 def associate_data(root_map, *args):
@@ -164,10 +160,17 @@ def get_camera_intrinsics(folder_path):
         )
 
 
-def import_dataset(root_folder, db_client):
+def import_dataset(root_folder, db_client, num_workers=None, checkpoint=None):
     """
     Load a TUM image sequences into the database.
-    :return:
+    Images are read and decoded on a pool of worker threads, and handed to the image collection builder
+    in timestamp order as they become available, so that reading images overlaps with saving them.
+    :param root_folder: The folder containing the sequence
+    :param db_client: The database client
+    :param num_workers: The number of threads used to read images. Default None, which uses the number of CPUs.
+    :param checkpoint: A dataset.import_checkpoint.ImportCheckpoint to record progress in, and to resume from.
+    Default None.
+    :return: The id of the imported image collection, or None if the folder doesn't contain a TUM sequence
     """
     if not os.path.isdir(root_folder):
         return None
@@ -187,25 +190,53 @@ def import_dataset(root_folder, db_client):
 
     # Step 2: Associate the different data types by timestamp
     all_metadata = associate_data(image_files, trajectory, depth_files)
-
-    # Step 3: Load the images from the metadata
-    builder = dataset.image_collection_builder.ImageCollectionBuilder(db_client)
-    for timestamp, image_file, camera_pose, depth_file in all_metadata:
-        rgb_data = cv2.imread(os.path.join(root_folder, image_file), cv2.IMREAD_COLOR)
-        depth_data = cv2.imread(os.path.join(root_folder, depth_file), cv2.IMREAD_UNCHANGED)
-        depth_data = depth_data / 5000  # Re-scale depth to meters
-        camera_intrinsics = get_camera_intrinsics(root_folder)
-        builder.add_image(image=core.image_entity.ImageEntity(
-            data=rgb_data[:, :, ::-1],
-            depth_data=depth_data,
-            metadata=imeta.ImageMetadata(
-                hash_=xxhash.xxh64(rgb_data).digest(),
-                camera_pose=camera_pose,
-                intrinsics=camera_intrinsics,
-                source_type=imeta.ImageSourceType.REAL_WORLD,
-                environment_type=imeta.EnvironmentType.INDOOR_CLOSE,
-                light_level=imeta.LightingLevel.WELL_LIT,
-                time_of_day=imeta.TimeOfDay.DAY,
-            )
-        ), timestamp=timestamp)
+    camera_intrinsics = get_camera_intrinsics(root_folder)
+
+    # Skip any frames that were saved before the import was interrupted
+    builder = dataset.image_collection_builder.ImageCollectionBuilder(db_client, batch_size=50, checkpoint=checkpoint)
+    all_metadata = [frame_metadata for frame_metadata in all_metadata if not builder.has_image(frame_metadata[0])]
+
+    # Step 3: Load the images from the metadata.
+    # OpenCV releases the GIL while decoding, so the frames can be read on threads.
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = max(1, int(num_workers))
+    frame_loader = util.prefetch.OrderedPrefetcher(
+        load=lambda idx: read_frame(root_folder, all_metadata[idx][1], all_metadata[idx][3]),
+        keys=range(len(all_metadata)),
+        depth=2 * num_workers,
+        num_workers=num_workers
+    )
+    try:
+        for idx, (rgb_data, depth_data, image_hash) in frame_loader:
+            timestamp, _, camera_pose, _ = all_metadata[idx]
+            builder.add_image(image=core.image_entity.ImageEntity(
+                data=rgb_data,
+                depth_data=depth_data,
+                metadata=imeta.ImageMetadata(
+                    hash_=image_hash,
+                    camera_pose=camera_pose,
+                    intrinsics=camera_intrinsics,
+                    source_type=imeta.ImageSourceType.REAL_WORLD,
+                    environment_type=imeta.EnvironmentType.INDOOR_CLOSE,
+                    light_level=imeta.LightingLevel.WELL_LIT,
+                    time_of_day=imeta.TimeOfDay.DAY,
+                )
+            ), timestamp=timestamp)
+    finally:
+        frame_loader.close()
     return builder.save()
+
+
+def read_frame(root_folder, image_file, depth_file):
+    """
+    Read and decode the images for a single frame. This is called from worker threads.
+    :param root_folder: The folder containing the sequence
+    :param image_file: The path of the RGB image, relative to the root folder
+    :param depth_file: The path of the depth image, relative to the root folder
+    :return: The RGB image, the depth image in meters, and the hash of the image
+    """
+    rgb_data = cv2.imread(os.path.join(root_folder, image_file), cv2.IMREAD_COLOR)
+    depth_data = cv2.imread(os.path.join(root_folder, depth_file), cv2.IMREAD_UNCHANGED)
+    depth_data = depth_data / 5000  # Re-scale depth to meters
+    return rgb_data[:, :, ::-1], depth_data, xxhash.xxh64(rgb_data).digest()
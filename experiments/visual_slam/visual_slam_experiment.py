@@ -9,6 +9,7 @@ import util.associate
 import util.transform as tf
 import util.dict_utils as du
 import core.image_source
+import core.image_collection
 import core.sequence_type
 import core.benchmark
 import metadata.camera_intrinsics as cam_intr
@@ -647,32 +648,14 @@ class VisualSlamExperiment(batch_analysis.experiment.Experiment):
     def _load_image_source(self, db_client, image_source_id):
         if image_source_id not in self._placeholder_image_collections:
             s_image_collection = db_client.image_source_collection.find_one({'_id': image_source_id})
-            image_ids = [img_id for _, img_id in s_image_collection['images']]
+            image_properties = core.image_collection.load_image_properties(db_client, s_image_collection)
             self._placeholder_image_collections[image_source_id] = PlaceholderImageCollection(
                 id_=s_image_collection['_id'],
-                is_labels_available=db_client.image_collection.find({
-                    '_id': {'$in': image_ids},
-                    'metadata.labelled_objects': {'$in': [[], None]}
-                }).count() <= 0,
-                is_per_pixel_labels_available=db_client.image_collection.find({
-                    '_id': {'$in': image_ids},
-                    'labels_data': None,
-                    'left_labels_data': None
-                }).count() <= 0,
-                is_normals_available=db_client.image_collection.find({
-                    '_id': {'$in': image_ids},
-                    'world_normals_data': None,
-                    'left_world_normals_data': None
-                }).count() <= 0,
-                is_depth_available=db_client.image_collection.find({
-                    '_id': {'$in': image_ids},
-                    'depth_data': None,
-                    'left_depth_data': None
-                }).count() <= 0,
-                is_stereo_available=db_client.image_collection.find({
-                    '_id': {'$in': image_ids},
-                    'right_data': None
-                }).count() <= 0,
+                is_labels_available=image_properties['is_labels_available'],
+                is_per_pixel_labels_available=image_properties['is_per_pixel_labels_available'],
+                is_normals_available=image_properties['is_normals_available'],
+                is_depth_available=image_properties['is_depth_available'],
+                is_stereo_available=image_properties['is_stereo_available'],
                 sequence_type=(core.sequence_type.ImageSequenceType.SEQUENTIAL
                                if s_image_collection['sequence_type'] == 'SEQ'
                                else core.sequence_type.ImageSequenceType.NON_SEQUENTIAL)
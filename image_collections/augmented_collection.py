@@ -74,6 +74,12 @@ class AugmentedImageCollection(core.image_source.ImageSource, database.entity.En
     def get_stereo_baseline(self):
         return self._inner.get_stereo_baseline()
 
+    def set_required_image_channels(self, channels):
+        self._inner.set_required_image_channels(channels)
+
+    def set_prefetch(self, depth, max_bytes=None):
+        self._inner.set_prefetch(depth, max_bytes)
+
     def get(self, index):
         """
         Get the image at a particular index
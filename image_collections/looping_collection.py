@@ -71,6 +71,12 @@ class LoopingCollection(core.image_source.ImageSource, database.entity.Entity):
     def get_stereo_baseline(self):
         return self._inner.get_stereo_baseline()
 
+    def set_required_image_channels(self, channels):
+        self._inner.set_required_image_channels(channels)
+
+    def set_prefetch(self, depth, max_bytes=None):
+        self._inner.set_prefetch(depth, max_bytes)
+
     def begin(self):
         """
         Start all the image sources, we're ready to start returning images.
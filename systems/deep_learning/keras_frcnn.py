@@ -212,6 +212,7 @@ import keras_frcnn.roi_helpers as roi_helpers
 import keras_frcnn.config
 import keras_frcnn.resnet as network
 import core.sequence_type
+import core.image_channel
 import core.trained_system
 import trials.object_detection.bounding_box_result as bbox_result
 import systems.deep_learning.config_helpers as config_help
@@ -282,6 +283,14 @@ class KerasFRCNN(core.trained_system.TrainedVisionSystem):
         """
         return True
 
+    @property
+    def required_image_channels(self):
+        """
+        Detection only uses the RGB image, the ground truth bounding boxes are in the metadata.
+        :return: A set containing only the RGB channel
+        """
+        return {core.image_channel.ImageChannel.RGB}
+
     def is_image_source_appropriate(self, image_source):
         """
         Is the dataset appropriate for testing this vision system.
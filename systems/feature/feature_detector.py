@@ -6,6 +6,7 @@ import cv2
 
 import core.system
 import core.sequence_type
+import core.image_channel
 import trials.feature_detection.feature_detector_result as detector_result
 
 
@@ -57,6 +58,14 @@ class FeatureDetector(core.system.VisionSystem, metaclass=abc.ABCMeta):
         """
         return True
 
+    @property
+    def required_image_channels(self):
+        """
+        Feature detectors only look at the greyscale image
+        :return: A set containing only the RGB channel
+        """
+        return {core.image_channel.ImageChannel.RGB}
+
     def is_image_source_appropriate(self, image_source):
         """
         Is the dataset appropriate for testing this vision system.
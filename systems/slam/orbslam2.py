@@ -1,6 +1,6 @@
 # Copyright (c) 2017, John Skinner
 import os
-import time
+import logging
 import numpy as np
 import re
 import signal
@@ -10,10 +10,12 @@ import enum
 import transforms3d as tf3d
 import core.system
 import core.sequence_type
+import core.image_channel
 import core.trial_result
 import trials.slam.visual_slam
 import util.transform as tf
 import util.dict_utils as du
+import util.shared_frame_buffer
 
 
 # Try and use LibYAML where available, fall back to the python implementation
@@ -45,6 +47,8 @@ class ORBSLAM2(core.system.VisionSystem):
             'Camera': {
                 # Camera calibration and distortion parameters (OpenCV)
                 # Most of these get overridden with the camera intrinsics at the start of the run.
+                'width': 640,
+                'height': 480,
                 'fx': 640,
                 'fy': 480,
                 'cx': 320,
@@ -108,7 +112,7 @@ class ORBSLAM2(core.system.VisionSystem):
         self._expected_completion_timeout = 300     # This is how long we wait after the dataset is finished
         self._settings_file = None
         self._child_process = None
-        self._input_queue = None
+        self._frame_buffer = None
         self._output_queue = None
         self._gt_trajectory = None
 
@@ -129,6 +133,18 @@ class ORBSLAM2(core.system.VisionSystem):
         """
         return False
 
+    @property
+    def required_image_channels(self):
+        """
+        ORBSLAM only needs the images for its current sensor mode
+        :return: A set of core.image_channel.ImageChannel
+        """
+        if self._mode == SensorMode.STEREO:
+            return {core.image_channel.ImageChannel.RGB, core.image_channel.ImageChannel.RIGHT_RGB}
+        elif self._mode == SensorMode.RGBD:
+            return {core.image_channel.ImageChannel.RGB, core.image_channel.ImageChannel.DEPTH}
+        return {core.image_channel.ImageChannel.RGB}
+
     def is_image_source_appropriate(self, image_source):
         """
         Is the dataset appropriate for testing this vision system.
@@ -149,7 +165,7 @@ class ORBSLAM2(core.system.VisionSystem):
         """
         if self._child_process is None:
             self._orbslam_settings['Camera']['width'] = camera_intrinsics.width
-            self._orbslam_settings['Camera']['height'] = camera_intrinsics.width
+            self._orbslam_settings['Camera']['height'] = camera_intrinsics.height
             self._orbslam_settings['Camera']['bf'] = (camera_intrinsics.fx * self._orbslam_settings['Camera']['bf']
                                                       / self._orbslam_settings['Camera']['fx'])
             self._orbslam_settings['Camera']['fx'] = camera_intrinsics.fx
@@ -183,11 +199,11 @@ class ORBSLAM2(core.system.VisionSystem):
 
         self.save_settings()  # we have to save the settings, so that orb-slam can load them
         self._gt_trajectory = {}
-        self._input_queue = multiprocessing.Queue()
+        self._frame_buffer = util.shared_frame_buffer.SharedFrameBuffer(self._get_frame_layout())
         self._output_queue = multiprocessing.Queue()
         self._child_process = multiprocessing.Process(target=run_orbslam,
                                                       args=(self._output_queue,
-                                                            self._input_queue,
+                                                            self._frame_buffer,
                                                             self._vocabulary_file,
                                                             self._settings_file,
                                                             self._mode))
@@ -205,7 +221,7 @@ class ORBSLAM2(core.system.VisionSystem):
                 os.remove(self._settings_file)  # Delete the settings file
             self._settings_file = None
             self._child_process = None
-            self._input_queue = None
+            self._frame_buffer = None
             self._output_queue = None
             self._gt_trajectory = None
         return started
@@ -218,23 +234,22 @@ class ORBSLAM2(core.system.VisionSystem):
         :param timestamp: A timestamp or index associated with this image. Sometimes None.
         :return: void
         """
-        if self._input_queue is not None:
-            # Wait here, to throttle the input rate to the queue, and prevent it from growing too large
-            delay_time = 0
-            while self._input_queue.qsize() > 10 and delay_time < 10:
-                time.sleep(1)
-                delay_time += 1
-
+        if self._frame_buffer is not None:
             # Add the camera pose to the ground-truth trajectory
             self._gt_trajectory[timestamp] = image.camera_pose
 
             # Send different input based on the running mode
             if self._mode == SensorMode.MONOCULAR:
-                self._input_queue.put((np.copy(image.data), None, timestamp))
+                frame = (image.data,)
             elif self._mode == SensorMode.STEREO:
-                self._input_queue.put((np.copy(image.left_data), np.copy(image.right_data), timestamp))
-            elif self._mode == SensorMode.RGBD:
-                self._input_queue.put((np.copy(image.data), np.copy(image.depth_data), timestamp))
+                frame = (image.left_data, image.right_data)
+            else:
+                frame = (image.data, image.depth_data)
+            # This blocks while the frame buffer is full, throttling the input to the rate ORBSLAM can handle
+            if not self._frame_buffer.put(frame, timestamp, timeout=self._expected_completion_timeout):
+                logging.getLogger(__name__).warning(
+                    "ORBSLAM2 did not accept frame {0} within {1} seconds, skipping it.".format(
+                        timestamp, self._expected_completion_timeout))
 
     def finish_trial(self):
         """
@@ -243,9 +258,9 @@ class ORBSLAM2(core.system.VisionSystem):
         :return:
         :rtype TrialResult:
         """
-        if self._input_queue is None:
+        if self._frame_buffer is None:
             return None
-        self._input_queue.put(None)     # This will end the main loop, see run_orbslam, below
+        self._frame_buffer.close()     # This will end the main loop, see run_orbslam, below
         try:
             trajectory_list, tracking_stats = self._output_queue.get(block=True,
                                                                      timeout=self._expected_completion_timeout)
@@ -288,7 +303,7 @@ class ORBSLAM2(core.system.VisionSystem):
             os.remove(self._settings_file)  # Delete the settings file
         self._settings_file = None
         self._child_process = None
-        self._input_queue = None
+        self._frame_buffer = None
         self._output_queue = None
         self._gt_trajectory = None
         return result
@@ -296,6 +311,19 @@ class ORBSLAM2(core.system.VisionSystem):
     def get_settings(self):
         return self._orbslam_settings
 
+    def _get_frame_layout(self):
+        """
+        Get the shape and type of the images sent to ORBSLAM for each frame, based on the camera resolution.
+        Images are sent as 8-bit RGB, and depth as 32-bit float, which is what ORBSLAM uses internally.
+        :return: A list of shape, dtype pairs, as used by SharedFrameBuffer
+        """
+        shape = (int(self._orbslam_settings['Camera']['height']), int(self._orbslam_settings['Camera']['width']))
+        if self._mode == SensorMode.MONOCULAR:
+            return [(shape + (3,), np.uint8)]
+        elif self._mode == SensorMode.STEREO:
+            return [(shape + (3,), np.uint8), (shape + (3,), np.uint8)]
+        return [(shape + (3,), np.uint8), (shape, np.float32)]
+
     def save_settings(self):
         if self._settings_file is None:
             # Choose a new settings file
@@ -422,19 +450,18 @@ def make_relative_pose(x: float, y: float, z: float, qx: float, qy: float, qz: f
     return tf.Transform(pose)
 
 
-def run_orbslam(output_queue, input_queue, vocab_file, settings_file, mode):
+def run_orbslam(output_queue, frame_buffer, vocab_file, settings_file, mode):
     """
     Actually run the orbslam system. This is done in a separate process to isolate memory leaks,
     and in case it crashes.
     :param output_queue:
-    :param input_queue:
+    :param frame_buffer: A util.shared_frame_buffer.SharedFrameBuffer, from which to read images
     :param vocab_file:
     :param settings_file:
     :param mode:
     :return:
     """
     import orbslam2
-    import logging
     import trials.slam.tracking_state
 
     logging.getLogger(__name__).info("Starting ORBSLAM2...")
@@ -453,15 +480,17 @@ def run_orbslam(output_queue, input_queue, vocab_file, settings_file, mode):
 
     running = True
     while running:
-        in_data = input_queue.get(block=True)
+        in_data = frame_buffer.get()
         if isinstance(in_data, tuple) and len(in_data) == 3:
-            img1, img2, timestamp = in_data
+            slot, images, timestamp = in_data
             if mode == SensorMode.MONOCULAR:
-                orbslam_system.process_image_mono(img1, timestamp)
+                orbslam_system.process_image_mono(images[0], timestamp)
             elif mode == SensorMode.STEREO:
-                orbslam_system.process_image_stereo(img1, img2, timestamp)
+                orbslam_system.process_image_stereo(images[0], images[1], timestamp)
             elif mode == SensorMode.RGBD:
-                orbslam_system.process_image_rgbd(img1, img2, timestamp)
+                orbslam_system.process_image_rgbd(images[0], images[1], timestamp)
+            # ORBSLAM is done with the images, they can be overwritten
+            frame_buffer.release(slot)
 
             tracking_state = orbslam_system.get_tracking_state()
             if (tracking_state == orbslam2.TrackingState.SYSTEM_NOT_READY or
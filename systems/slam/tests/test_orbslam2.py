@@ -9,8 +9,10 @@ import bson.objectid as oid
 import database.tests.test_entity
 import util.dict_utils as du
 import metadata.image_metadata as imeta
+import metadata.camera_intrinsics as cam_intr
 import core.sequence_type
 import core.image
+import util.shared_frame_buffer
 import systems.slam.orbslam2
 import orbslam2
 
@@ -139,29 +141,36 @@ class TestORBSLAM2(database.tests.test_entity.EntityContract, unittest.TestCase)
         self.assertFalse(mock_process.start.called)
         self.assertFalse(mock_open.called)
 
+    @mock.patch('systems.slam.orbslam2.util.shared_frame_buffer.SharedFrameBuffer',
+                autospec=util.shared_frame_buffer.SharedFrameBuffer)
     @mock.patch('systems.slam.orbslam2.multiprocessing', autospec=multiprocessing)
-    def test_process_image_sends_image_and_depth_to_subprocess(self, mock_multiprocessing):
+    def test_process_image_sends_image_and_depth_to_subprocess(self, mock_multiprocessing, mock_buffer_class):
         mock_process = mock.create_autospec(multiprocessing.Process)
-        mock_queue = mock.create_autospec(multiprocessing.queues.Queue)     # Have to be specific to get the class
-        mock_queue.qsize.return_value = 0
         mock_multiprocessing.Process.return_value = mock_process
-        mock_multiprocessing.Queue.return_value = mock_queue
+        mock_buffer = mock_buffer_class.return_value
+        mock_buffer.put.return_value = True
 
         mock_image_data = np.random.randint(0, 255, (32, 32, 3), dtype='uint8')
-        mock_depth_data = np.random.randint(0, 255, (32, 32, 3), dtype='uint8')
+        mock_depth_data = np.random.uniform(0, 10, (32, 32))
         image = core.image.Image(data=mock_image_data, depth_data=mock_depth_data, metadata=imeta.ImageMetadata(
             source_type=imeta.ImageSourceType.SYNTHETIC,
             hash_=b'\x00\x00\x00\x00\x00\x00\x00\x01'
         ))
 
-        subject = self.make_instance()
+        subject = self.make_instance(mode=systems.slam.orbslam2.SensorMode.RGBD)
+        subject.set_camera_intrinsics(cam_intr.CameraIntrinsics(32, 32, 20, 20, 16, 16))
         with mock.patch('systems.slam.orbslam2.open', mock.mock_open(), create=True):
             subject.start_trial(core.sequence_type.ImageSequenceType.SEQUENTIAL)
         self.assertTrue(mock_multiprocessing.Process.called)
-        self.assertIn(mock_queue, mock_multiprocessing.Process.call_args[1]['args'])
+        self.assertIn(mock_buffer, mock_multiprocessing.Process.call_args[1]['args'])
+        self.assertEqual([((32, 32, 3), np.uint8), ((32, 32), np.float32)], mock_buffer_class.call_args[0][0])
 
         subject.process_image(image, 12)
-        self.assertTrue(mock_queue.put.called)
+        self.assertTrue(mock_buffer.put.called)
+        frame, timestamp = mock_buffer.put.call_args[0]
+        self.assertEqual(12, timestamp)
+        self.assertIs(mock_image_data, frame[0])
+        self.assertIs(mock_depth_data, frame[1])
 
     @mock.patch('systems.slam.orbslam2.os', autospec=os)
     @mock.patch('systems.slam.orbslam2.multiprocessing', autospec=multiprocessing)
@@ -184,14 +193,29 @@ class TestORBSLAM2(database.tests.test_entity.EntityContract, unittest.TestCase)
 class TestRunOrbslam(unittest.TestCase):
 
     def test_calls_initialize_and_shutdown(self):
-        mock_input_queue = mock.create_autospec(multiprocessing.queues.Queue)
-        mock_input_queue.get.side_effect = [None, None]
+        mock_frame_buffer = mock.create_autospec(util.shared_frame_buffer.SharedFrameBuffer)
+        mock_frame_buffer.get.side_effect = [None, None]
         mock_output_queue = mock.create_autospec(multiprocessing.queues.Queue)
         mock_orbslam = mock.create_autospec(orbslam2)
         mock_system = mock.create_autospec(orbslam2.System)
         mock_orbslam.System.return_value = mock_system
         with mock.patch.dict('sys.modules', orbslam2=mock_orbslam):
-            systems.slam.orbslam2.run_orbslam(mock_output_queue, mock_input_queue, '', '',
-                                              systems.slam.orbslam2.SensorMode.RGBD, (1280, 720))
+            systems.slam.orbslam2.run_orbslam(mock_output_queue, mock_frame_buffer, '', '',
+                                              systems.slam.orbslam2.SensorMode.RGBD)
         self.assertTrue(mock_system.initialize.called)
         self.assertTrue(mock_system.shutdown.called)
+
+    def test_releases_frames_after_processing(self):
+        image = np.zeros((4, 4, 3), dtype=np.uint8)
+        depth = np.zeros((4, 4), dtype=np.float32)
+        mock_frame_buffer = mock.create_autospec(util.shared_frame_buffer.SharedFrameBuffer)
+        mock_frame_buffer.get.side_effect = [(3, [image, depth], 1.2), None]
+        mock_output_queue = mock.create_autospec(multiprocessing.queues.Queue)
+        mock_orbslam = mock.create_autospec(orbslam2)
+        mock_system = mock.create_autospec(orbslam2.System)
+        mock_orbslam.System.return_value = mock_system
+        with mock.patch.dict('sys.modules', orbslam2=mock_orbslam):
+            systems.slam.orbslam2.run_orbslam(mock_output_queue, mock_frame_buffer, '', '',
+                                              systems.slam.orbslam2.SensorMode.RGBD)
+        self.assertIn(mock.call(image, depth, 1.2), mock_system.process_image_rgbd.call_args_list)
+        self.assertIn(mock.call(3), mock_frame_buffer.release.call_args_list)
@@ -4,6 +4,7 @@ import cv2  # TODO: Replace with a lighter library, maybe pillow
 import viso2 as libviso2
 
 import core.sequence_type
+import core.image_channel
 import core.system
 import core.trial_result
 import trials.visual_odometry.visual_odometry_result as vo_result
@@ -33,6 +34,10 @@ class LibVisOSystem(core.system.VisionSystem):
     def is_deterministic(self):
         return True
 
+    @property
+    def required_image_channels(self):
+        return {core.image_channel.ImageChannel.RGB, core.image_channel.ImageChannel.RIGHT_RGB}
+
     def set_camera_intrinsics(self, camera_intrinsics):
         """
         Set the camera intrinisics for libviso2
@@ -0,0 +1,259 @@
+# Copyright (c) 2017, John Skinner
+import abc
+import json
+import pickle
+import struct
+import zlib
+import numpy as np
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+
+# Encoded arrays start with this, followed by the length of a json header, the header, and then the payload.
+# Pickled arrays never start with these bytes, so data stored before codecs were introduced can still be read.
+MAGIC = b'RVAC'
+_HEADER_LENGTH = struct.Struct('<I')
+
+
+class ArrayCodec(metaclass=abc.ABCMeta):
+    """
+    A way of turning numpy arrays into bytes and back again.
+    Codecs are registered by name, which is stored with each encoded array,
+    so that the array can be decoded without knowing in advance how it was stored.
+    """
+
+    @property
+    @abc.abstractmethod
+    def name(self):
+        """
+        The unique name of this codec, which is stored with the encoded data.
+        :return: A string
+        """
+        pass
+
+    def can_encode(self, array):
+        """
+        Can this codec store this particular array.
+        Some codecs only handle specific types or shapes of arrays.
+        :param array: The numpy array to store
+        :return: True iff the array can be encoded by this codec
+        """
+        return True
+
+    @abc.abstractmethod
+    def encode(self, array, **kwargs):
+        """
+        Encode an array as bytes.
+        :param array: The numpy array to encode.
+        :param kwargs: Settings for the codec. Any settings needed to decode should be returned in the parameters.
+        :return: The encoded bytes, and a dict of parameters needed to decode it. The dtype and shape are always stored.
+        """
+        pass
+
+    @abc.abstractmethod
+    def decode(self, data, dtype, shape, **kwargs):
+        """
+        Turn bytes produced by encode back into an array
+        :param data: The encoded bytes
+        :param dtype: The dtype of the original array
+        :param shape: The shape of the original array
+        :param kwargs: The parameters returned from encode
+        :return: A numpy array
+        """
+        pass
+
+
+class PickleCodec(ArrayCodec):
+    """
+    Plain pickle, which is how image data was originally stored.
+    Handles anything, but is uncompressed.
+    """
+
+    @property
+    def name(self):
+        return 'pickle'
+
+    def encode(self, array, **kwargs):
+        return pickle.dumps(array, protocol=pickle.HIGHEST_PROTOCOL), {}
+
+    def decode(self, data, dtype, shape, **kwargs):
+        return pickle.loads(data)
+
+
+class ZlibCodec(ArrayCodec):
+    """
+    Lossless zlib compression of the raw array bytes.
+    By default, the bytes are shuffled so that the bytes at the same position in each element are stored together,
+    which compresses floating point data such as depth images much better.
+    """
+
+    def __init__(self, shuffle=True, level=6):
+        self._shuffle = bool(shuffle)
+        self._level = int(level)
+
+    @property
+    def name(self):
+        return 'shuffle_zlib' if self._shuffle else 'zlib'
+
+    def can_encode(self, array):
+        return array.dtype.kind in 'biuf'
+
+    def encode(self, array, **kwargs):
+        array = np.ascontiguousarray(array)
+        if self._shuffle and array.dtype.itemsize > 1:
+            raw = array.view(np.uint8).reshape(-1, array.dtype.itemsize).T.tobytes()
+        else:
+            raw = array.tobytes()
+        return zlib.compress(raw, self._level), {}
+
+    def decode(self, data, dtype, shape, **kwargs):
+        dtype = np.dtype(dtype)
+        raw = zlib.decompress(data)
+        if self._shuffle and dtype.itemsize > 1:
+            raw = np.frombuffer(raw, dtype=np.uint8).reshape(dtype.itemsize, -1).T.tobytes()
+        return np.frombuffer(raw, dtype=dtype).reshape(shape).copy()
+
+
+class PNGCodec(ArrayCodec):
+    """
+    Lossless PNG compression, for 8 or 16-bit images like RGB images and labels.
+    Requires OpenCV.
+    """
+
+    @property
+    def name(self):
+        return 'png'
+
+    def can_encode(self, array):
+        return (cv2 is not None and array.dtype in (np.uint8, np.uint16) and
+                (array.ndim == 2 or (array.ndim == 3 and array.shape[2] in (1, 3, 4))) and array.size > 0)
+
+    def encode(self, array, **kwargs):
+        success, data = cv2.imencode('.png', np.ascontiguousarray(array))
+        if not success:
+            raise ValueError("Could not encode array of shape {0} as a png".format(array.shape))
+        return data.tobytes(), {}
+
+    def decode(self, data, dtype, shape, **kwargs):
+        array = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        return array.reshape(shape)
+
+
+class QuantisedCodec(ArrayCodec):
+    """
+    Lossy compression of floating point arrays, by quantising them to 16-bit integers and then compressing them.
+    Values are stored as round((value - offset) / scale), so the default scale keeps depth to the nearest millimetre
+    up to 65 meters. Values outside that range are clipped, and NaNs are preserved.
+    Never chosen automatically, pass codec='quantised_uint16' to use it.
+    """
+
+    def __init__(self, scale=0.001, offset=0.0):
+        self._scale = float(scale)
+        self._offset = float(offset)
+        self._inner = ZlibCodec(shuffle=True)
+
+    @property
+    def name(self):
+        return 'quantised_uint16'
+
+    def can_encode(self, array):
+        return array.dtype.kind == 'f'
+
+    def encode(self, array, scale=None, offset=None, **kwargs):
+        scale = self._scale if scale is None else float(scale)
+        offset = self._offset if offset is None else float(offset)
+        nan_mask = np.isnan(array)
+        quantised = np.clip(np.round((np.nan_to_num(array) - offset) / scale), 0, 65534).astype(np.uint16)
+        quantised[nan_mask] = 65535
+        data, _ = self._inner.encode(quantised)
+        return data, {'scale': scale, 'offset': offset}
+
+    def decode(self, data, dtype, shape, scale=None, offset=None, **kwargs):
+        quantised = self._inner.decode(data, np.uint16, shape)
+        array = (quantised.astype(np.float64) * scale + offset).astype(dtype)
+        array[quantised == 65535] = np.nan
+        return array
+
+
+_codecs = {}
+
+
+def register_codec(codec):
+    """
+    Register a codec, so that it can be used to encode and decode arrays.
+    Replaces any existing codec with the same name.
+    :param codec: An ArrayCodec instance
+    :return: void
+    """
+    _codecs[codec.name] = codec
+
+
+def get_codec(name):
+    """
+    Get a registered codec by name
+    :param name: The name of the codec
+    :return: The ArrayCodec, or None if no such codec is registered
+    """
+    return _codecs.get(name, None)
+
+
+def choose_codec(array):
+    """
+    Pick a default lossless codec for a particular array.
+    8 and 16-bit images use png, other numeric arrays use shuffled zlib, and everything else is pickled.
+    :param array: The numpy array to encode
+    :return: The name of the codec to use
+    """
+    for name in ('png', 'shuffle_zlib'):
+        if name in _codecs and _codecs[name].can_encode(array):
+            return name
+    return 'pickle'
+
+
+def encode_array(array, codec=None, **kwargs):
+    """
+    Encode an array to bytes, recording the codec used so that decode_array can read it back.
+    :param array: The numpy array to encode
+    :param codec: The name of the codec to use. Default None, which picks a lossless codec based on the array type.
+    If the given codec cannot encode the array, the default is used instead.
+    :param kwargs: Additional settings passed to the codec
+    :return: The encoded bytes
+    """
+    array = np.asarray(array)
+    if codec is None or codec not in _codecs or not _codecs[codec].can_encode(array):
+        codec = choose_codec(array)
+    payload, params = _codecs[codec].encode(array, **kwargs)
+    header = json.dumps({
+        'codec': codec,
+        'dtype': array.dtype.str,
+        'shape': list(array.shape),
+        'params': params
+    }).encode('utf-8')
+    return MAGIC + _HEADER_LENGTH.pack(len(header)) + header + payload
+
+
+def decode_array(data):
+    """
+    Decode bytes produced by encode_array, or a plain pickled array.
+    :param data: The encoded bytes
+    :return: The decoded numpy array
+    """
+    if not data.startswith(MAGIC):
+        return pickle.loads(data)
+    start = len(MAGIC) + _HEADER_LENGTH.size
+    header_length, = _HEADER_LENGTH.unpack(data[len(MAGIC):start])
+    header = json.loads(data[start:start + header_length].decode('utf-8'))
+    codec = get_codec(header['codec'])
+    if codec is None:
+        raise ValueError("Cannot decode array, unknown codec '{0}'".format(header['codec']))
+    return codec.decode(data[start + header_length:], np.dtype(header['dtype']), tuple(header['shape']),
+                        **header['params'])
+
+
+register_codec(PickleCodec())
+register_codec(ZlibCodec(shuffle=False))
+register_codec(ZlibCodec(shuffle=True))
+register_codec(PNGCodec())
+register_codec(QuantisedCodec())
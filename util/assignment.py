@@ -0,0 +1,97 @@
+# Copyright (c) 2017, John Skinner
+import numpy as np
+
+
+def greedy_assignment(first_indexes, second_indexes):
+    """
+    Greedily assign candidate matches between two sets, such that each item is matched at most once.
+    The candidates must already be sorted from best to worst. Taking them one at a time,
+    a candidate is accepted if neither of its items has been matched yet.
+
+    Rather than a loop over the candidates, this is done in rounds: each round accepts every candidate
+    that is the best remaining candidate for both of its items, and then removes all the other candidates
+    for those items. This accepts exactly the same candidates as taking them one at a time.
+    :param first_indexes: An array of the index of the first item for each candidate match
+    :param second_indexes: An array of the index of the second item for each candidate match, the same length
+    :return: An array of the positions of the accepted candidates, in order
+    """
+    first_indexes = np.asarray(first_indexes, dtype=np.int64)
+    second_indexes = np.asarray(second_indexes, dtype=np.int64)
+    if len(first_indexes) <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    accepted = []
+    used_first = np.zeros(np.max(first_indexes) + 1, dtype=bool)
+    used_second = np.zeros(np.max(second_indexes) + 1, dtype=bool)
+    remaining = np.arange(len(first_indexes))
+    while len(remaining) > 0:
+        # Since the candidates are sorted, the first remaining candidate for each item is its best
+        _, best_first = np.unique(first_indexes[remaining], return_index=True)
+        _, best_second = np.unique(second_indexes[remaining], return_index=True)
+        is_best = np.zeros(len(remaining), dtype=np.int8)
+        is_best[best_first] += 1
+        is_best[best_second] += 1
+        accept = remaining[is_best == 2]
+        accepted.append(accept)
+
+        used_first[first_indexes[accept]] = True
+        used_second[second_indexes[accept]] = True
+        remaining = remaining[~used_first[first_indexes[remaining]] & ~used_second[second_indexes[remaining]]]
+    return np.sort(np.concatenate(accepted))
+
+
+def optimal_assignment(scores):
+    """
+    Find the assignment between rows and columns that maximizes the total score,
+    using the Hungarian algorithm (Kuhn-Munkres, with potentials), in O(n^2 m) time.
+    Each row is assigned to at most one column, and each column to at most one row.
+    The matrix may be rectangular, in which case some rows or columns are left unassigned.
+    :param scores: An NxM array of scores for assigning each row to each column
+    :return: Two integer arrays of the same length, the assigned rows in increasing order and their columns
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if scores.ndim != 2 or scores.size <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    transposed = scores.shape[0] > scores.shape[1]
+    cost = -(scores.T if transposed else scores)
+    num_rows, num_cols = cost.shape
+
+    # Arrays are 1-indexed, with row and column 0 as a placeholder for the row being added
+    row_potential = np.zeros(num_rows + 1)
+    col_potential = np.zeros(num_cols + 1)
+    col_match = np.zeros(num_cols + 1, dtype=np.int64)
+    way = np.zeros(num_cols + 1, dtype=np.int64)
+    for row in range(1, num_rows + 1):
+        col_match[0] = row
+        col = 0
+        min_slack = np.full(num_cols + 1, np.inf)
+        used = np.zeros(num_cols + 1, dtype=bool)
+        while True:
+            used[col] = True
+            current_row = col_match[col]
+            slack = cost[current_row - 1] - row_potential[current_row] - col_potential[1:]
+            improved = ~used[1:] & (slack < min_slack[1:])
+            min_slack[1:][improved] = slack[improved]
+            way[1:][improved] = col
+
+            free_slack = np.where(used[1:], np.inf, min_slack[1:])
+            next_col = int(np.argmin(free_slack)) + 1
+            delta = free_slack[next_col - 1]
+            row_potential[col_match[used]] += delta
+            col_potential[used] -= delta
+            min_slack[~used] -= delta
+            col = next_col
+            if col_match[col] == 0:
+                break
+        # Flip the augmenting path
+        while col != 0:
+            previous = way[col]
+            col_match[col] = col_match[previous]
+            col = previous
+
+    cols = np.nonzero(col_match[1:])[0]
+    rows = col_match[1:][cols] - 1
+    if transposed:
+        rows, cols = cols, rows
+    order = np.argsort(rows)
+    return rows[order], cols[order]
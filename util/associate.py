@@ -48,6 +48,10 @@ the depth.txt file, and joins them by finding the best matches.
 """
 
 
+import heapq
+import numpy as np
+
+
 def associate(first_list, second_list, offset, max_difference):
     """
     Associate two dictionaries of (stamp,data). As the time stamps never match exactly, we aim
@@ -63,19 +67,104 @@ def associate(first_list, second_list, offset, max_difference):
     matches -- list of matched tuples ((stamp1,data1),(stamp2,data2))
 
     """
-    first_keys = list(first_list.keys())  # copy both keys lists, so we can remove from them later
+    first_keys = list(first_list.keys())
     second_keys = list(second_list.keys())
-    potential_matches = [(abs(a - (b + offset)), a, b)
-                         for a in first_keys
-                         for b in second_keys
-                         if abs(a - (b + offset)) < max_difference]
-    potential_matches.sort()
+    first_indexes, second_indexes = associate_arrays(first_keys, second_keys, offset, max_difference)
+    return [(first_keys[idx1], second_keys[idx2]) for idx1, idx2 in zip(first_indexes, second_indexes)]
+
+
+def associate_arrays(first_stamps, second_stamps, offset, max_difference):
+    """
+    Associate two arrays of timestamps, giving the same matches as 'associate', but as indexes into the arrays.
+
+    The original algorithm considers every pair of stamps closer than the max difference, and greedily takes
+    the closest pairs first, breaking ties on the first stamp and then the second.
+    Instead of listing all those pairs, this uses the fact that in one dimension, the closest remaining pair
+    is always next to each other when the stamps from both lists are sorted together.
+    So we only need to track the pairs that are adjacent in the sorted order, and when a pair is matched,
+    the stamps either side of it become adjacent. This takes O(n log n) time, rather than O(n^2).
+
+    :param first_stamps: An array or list of timestamps. These should be distinct.
+    :param second_stamps: Another array or list of distinct timestamps
+    :param offset: A time offset added to the second stamps before comparing them
+    :param max_difference: The maximum difference between matching stamps, exclusive
+    :return: Two integer arrays of the same length, the indexes of the matched first stamps,
+    and the indexes of the second stamps they were matched to, sorted by the first stamp.
+    """
+    first_stamps = np.asarray(first_stamps, dtype=np.float64).ravel()
+    second_stamps = np.asarray(second_stamps, dtype=np.float64).ravel()
+    num_first = len(first_stamps)
+    if num_first <= 0 or len(second_stamps) <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # Sort all the stamps together, marking which list each came from
+    values = np.concatenate((first_stamps, second_stamps + offset))
+    order = np.argsort(values, kind='mergesort')
+    sorted_values = values[order]
+    is_second = order >= num_first
+
+    # Find the adjacent pairs with one stamp from each list, which are close enough to match
+    candidates = np.nonzero((is_second[:-1] != is_second[1:]) &
+                            (np.abs(sorted_values[:-1] - sorted_values[1:]) < max_difference))[0]
+
+    # The rest is inherently sequential, plain python lists are faster to index than arrays
+    order = order.tolist()
+    is_second = is_second.tolist()
+    sorted_values = sorted_values.tolist()
+    values = values.tolist()
+    heap = [_make_candidate(pos, pos + 1, order, sorted_values, values, num_first) for pos in candidates.tolist()]
+    heapq.heapify(heap)
+
+    # A doubly-linked list over the sorted positions, so we can find which stamps become adjacent
+    num_values = len(sorted_values)
+    prev_pos = list(range(-1, num_values - 1))
+    next_pos = list(range(1, num_values + 1))
+    matched = [False] * num_values
     matches = []
-    for diff, a, b in potential_matches:
-        if a in first_keys and b in second_keys:
-            first_keys.remove(a)
-            second_keys.remove(b)
-            matches.append((a, b))
-
-    matches.sort()
-    return matches
+    while len(heap) > 0:
+        _, _, _, lower, upper = heapq.heappop(heap)
+        if matched[lower] or matched[upper]:
+            continue
+        matched[lower] = True
+        matched[upper] = True
+        matches.append((order[lower], order[upper]) if is_second[upper] else (order[upper], order[lower]))
+
+        # Remove the matched pair, which makes the stamps either side of it adjacent
+        before = prev_pos[lower]
+        after = next_pos[upper]
+        if before >= 0:
+            next_pos[before] = after
+        if after < num_values:
+            prev_pos[after] = before
+        if (before >= 0 and after < num_values and is_second[before] != is_second[after] and
+                abs(sorted_values[before] - sorted_values[after]) < max_difference):
+            heapq.heappush(heap, _make_candidate(before, after, order, sorted_values, values, num_first))
+
+    if len(matches) <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    matches = np.array(matches, dtype=np.int64)
+    first_indexes = matches[:, 0]
+    second_indexes = matches[:, 1] - num_first
+    match_order = np.lexsort((second_stamps[second_indexes], first_stamps[first_indexes]))
+    return first_indexes[match_order], second_indexes[match_order]
+
+
+def _make_candidate(lower, upper, order, sorted_values, values, num_first):
+    """
+    Make a heap entry for a possible match between two adjacent stamps.
+    Entries are ordered the same way as the original algorithm sorts potential matches,
+    by the difference, then the first stamp, then the second stamp.
+    :param lower: The sorted position of the lower stamp
+    :param upper: The sorted position of the upper stamp
+    :param order: The sorting order, mapping sorted positions to indexes in the combined stamps
+    :param sorted_values: The sorted stamps, with the offset added to the second stamps
+    :param values: All the stamps, first then second, with the offset added to the second stamps
+    :param num_first: The number of first stamps
+    :return: A tuple (difference, first stamp, second stamp, lower, upper)
+    """
+    diff = abs(sorted_values[upper] - sorted_values[lower])
+    if order[lower] < num_first:
+        first_idx, second_idx = order[lower], order[upper]
+    else:
+        first_idx, second_idx = order[upper], order[lower]
+    return diff, values[first_idx], values[second_idx], lower, upper
@@ -0,0 +1,104 @@
+# Copyright (c) 2017, John Skinner
+import collections
+import concurrent.futures
+
+
+class OrderedPrefetcher:
+    """
+    Load a sequence of items ahead of time on background threads, while returning them in the original order.
+    This lets slow I/O like reading from the database overlap with processing the previous items.
+
+    Memory use is bounded two ways: at most 'depth' items are loaded ahead, and if a byte budget is given,
+    the depth is reduced so that the loaded items, at the average size seen so far, fit within the budget.
+    At least one item is always loaded ahead.
+    """
+
+    def __init__(self, load, keys, depth, max_bytes=None, num_workers=None, get_size=None):
+        """
+        :param load: A function to load a single item, given its key. Called from worker threads.
+        :param keys: The keys to load, in the order they will be returned
+        :param depth: The maximum number of items to load ahead of the consumer
+        :param max_bytes: The maximum size of items loaded ahead, in bytes. Default None, for no limit.
+        :param num_workers: The number of worker threads. Default None, which uses min(depth, 4)
+        :param get_size: A function giving the size of a loaded item in bytes, required to enforce max_bytes.
+        """
+        self._load = load
+        self._keys = list(keys)
+        self._depth = max(1, int(depth))
+        self._max_bytes = max_bytes
+        self._get_size = get_size
+        if num_workers is None:
+            num_workers = min(self._depth, 4)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(num_workers)))
+        self._pending = collections.deque()
+        self._next_submit = 0
+        self._total_size = 0
+        self._num_sized = 0
+        self._fill()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.is_complete():
+            raise StopIteration
+        return self.get_next()
+
+    def is_complete(self):
+        """
+        Have all the items been returned
+        :return: True iff there are no more items
+        """
+        return len(self._pending) <= 0 and self._next_submit >= len(self._keys)
+
+    def get_next(self):
+        """
+        Get the next item in order, waiting for it to finish loading if necessary.
+        Any exception raised while loading the item is raised here.
+        :return: The key and the loaded item, or None, None if there are no more items
+        """
+        if self.is_complete():
+            return None, None
+        key, future = self._pending.popleft()
+        try:
+            item = future.result()
+        finally:
+            # Start loading more before we hand this item back, so that they load while it is being processed
+            self._fill()
+        if self._get_size is not None and item is not None:
+            self._total_size += self._get_size(item)
+            self._num_sized += 1
+        return key, item
+
+    def close(self):
+        """
+        Stop loading items. Items that have already started loading will finish in the background.
+        :return: void
+        """
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._next_submit = len(self._keys)
+        self._executor.shutdown(wait=False)
+
+    @property
+    def read_ahead(self):
+        """
+        The number of items that can currently be loaded ahead, limited by the depth and byte budget
+        :return: An integer, at least 1
+        """
+        if self._max_bytes is None or self._num_sized <= 0 or self._total_size <= 0:
+            return self._depth
+        average_size = self._total_size / self._num_sized
+        return max(1, min(self._depth, int(self._max_bytes // average_size)))
+
+    def _fill(self):
+        """
+        Submit more items to load, until we are the read ahead distance in front of the consumer
+        :return: void
+        """
+        limit = self.read_ahead
+        while len(self._pending) < limit and self._next_submit < len(self._keys):
+            key = self._keys[self._next_submit]
+            self._pending.append((key, self._executor.submit(self._load, key)))
+            self._next_submit += 1
@@ -0,0 +1,147 @@
+# Copyright (c) 2017, John Skinner
+import ctypes
+import multiprocessing
+import numpy as np
+
+
+class SharedFrameBuffer:
+    """
+    A ring buffer of image frames in shared memory, for sending images to a subprocess without pickling them.
+    This is for systems that run a native library in a separate process, to isolate crashes and memory leaks.
+
+    The buffer is divided into a fixed number of slots, each of which holds one frame made up of several arrays,
+    such as an RGB image and a depth image. All the frames must have the same layout, given when the buffer is created.
+    The producer copies each frame into a free slot, and only the slot index and timestamp are sent over a queue.
+    The consumer reads the arrays directly out of shared memory, and must release each slot when it is done with it.
+    Slots must be released in the order they were received, which is always the case for a single consumer.
+
+    The buffer must be created before the subprocess is started, and passed to it as an argument.
+    Usage:
+    ```
+    frame_buffer = SharedFrameBuffer([((480, 640, 3), np.uint8), ((480, 640), np.float32)])
+    process = multiprocessing.Process(target=consumer, args=(frame_buffer,))
+    process.start()
+    frame_buffer.put((image, depth), timestamp)
+    frame_buffer.close()
+
+    def consumer(frame_buffer):
+        frame = frame_buffer.get()
+        while frame is not None:
+            slot, (image, depth), timestamp = frame
+            <do stuff>
+            frame_buffer.release(slot)
+            frame = frame_buffer.get()
+    ```
+    """
+
+    def __init__(self, frame_layout, num_slots=10):
+        """
+        Allocate the shared memory for the buffer.
+        :param frame_layout: A list of (shape, dtype) pairs, one for each array in each frame.
+        :param num_slots: The number of frames that can be in the buffer at once. This limits how far ahead
+        the producer can get from the consumer. Default 10.
+        """
+        self._layout = []
+        self._offsets = []
+        offset = 0
+        for shape, dtype in frame_layout:
+            shape = tuple(int(dim) for dim in shape)
+            dtype = np.dtype(dtype)
+            # Keep each array aligned for its data type
+            offset = int(np.ceil(offset / dtype.alignment)) * dtype.alignment
+            self._layout.append((shape, dtype))
+            self._offsets.append(offset)
+            offset += int(np.prod(shape)) * dtype.itemsize
+        self._slot_size = int(np.ceil(offset / 8)) * 8
+        self._num_slots = max(1, int(num_slots))
+
+        self._memory = multiprocessing.RawArray(ctypes.c_uint8, self._slot_size * self._num_slots)
+        self._free_slots = multiprocessing.Semaphore(self._num_slots)
+        self._queue = multiprocessing.Queue()
+        self._next_slot = 0
+        self._views = None
+
+    def __getstate__(self):
+        # The numpy views into the shared memory are recreated in each process
+        state = self.__dict__.copy()
+        state['_views'] = None
+        return state
+
+    @property
+    def num_slots(self):
+        return self._num_slots
+
+    @property
+    def frame_layout(self):
+        return list(self._layout)
+
+    def put(self, arrays, timestamp, timeout=None):
+        """
+        Copy a frame into the next free slot, and tell the consumer about it.
+        Blocks until a slot is free, so that the producer cannot get too far ahead of the consumer.
+        :param arrays: The arrays in this frame, matching the frame layout. They are converted to the layout dtype.
+        :param timestamp: The timestamp of the frame, sent to the consumer with it
+        :param timeout: The maximum time to wait for a free slot, in seconds. Default None, which waits forever.
+        :return: True if the frame was sent, False if there was no free slot within the timeout
+        """
+        if len(arrays) != len(self._layout):
+            raise ValueError("Expected {0} arrays in each frame, got {1}".format(len(self._layout), len(arrays)))
+        for array, (shape, _) in zip(arrays, self._layout):
+            if np.shape(array) != shape:
+                raise ValueError("Frame array of shape {0} does not match the buffer shape {1}".format(
+                    np.shape(array), shape))
+        if not self._free_slots.acquire(timeout=timeout):
+            return False
+        slot = self._next_slot
+        self._next_slot = (slot + 1) % self._num_slots
+        for view, array in zip(self._get_views()[slot], arrays):
+            np.copyto(view, array, casting='unsafe')
+        self._queue.put((slot, timestamp))
+        return True
+
+    def get(self, timeout=None):
+        """
+        Get the next frame from the buffer. The arrays are views into shared memory, not copies,
+        and are only valid until the slot is released.
+        :param timeout: The maximum time to wait for a frame, in seconds. Default None, which waits forever.
+        Raises queue.Empty if no frame arrives before the timeout.
+        :return: The slot index, a list of arrays, and the timestamp, or None if the producer has closed the buffer.
+        """
+        message = self._queue.get(block=True, timeout=timeout)
+        if message is None:
+            return None
+        slot, timestamp = message
+        return slot, self._get_views()[slot], timestamp
+
+    def release(self, slot):
+        """
+        Mark a slot as free to be overwritten, once the consumer has finished with the frame in it.
+        :param slot: The slot index returned by get
+        :return: void
+        """
+        self._free_slots.release()
+
+    def close(self):
+        """
+        Tell the consumer that there are no more frames. Get will return None after all the frames so far.
+        :return: void
+        """
+        self._queue.put(None)
+
+    def _get_views(self):
+        """
+        Get numpy arrays for each slot, which share memory with the buffer.
+        :return: A list of lists of arrays, indexed by slot, then by position in the frame layout
+        """
+        if self._views is None:
+            memory = np.frombuffer(self._memory, dtype=np.uint8)
+            self._views = []
+            for slot in range(self._num_slots):
+                slot_start = slot * self._slot_size
+                slot_views = []
+                for (shape, dtype), offset in zip(self._layout, self._offsets):
+                    start = slot_start + offset
+                    size = int(np.prod(shape)) * dtype.itemsize
+                    slot_views.append(memory[start:start + size].view(dtype).reshape(shape))
+                self._views.append(slot_views)
+        return self._views
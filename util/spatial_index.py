@@ -0,0 +1,173 @@
+# Copyright (c) 2017, John Skinner
+import itertools
+import numpy as np
+
+
+class GridIndex:
+    """
+    A spatial index over a set of points, for finding the points within a radius of many query points at once.
+    Points are hashed into a uniform grid of cells, so that each query only has to check the points
+    in the cells around it, rather than every point. This fills the role of a KD-tree radius query,
+    using only numpy, and works best when the cell size is about the same as the search radius.
+
+    Within each cell the points are kept in the order they were given, so that searches can be limited to
+    the points before a given index, such as the poses earlier in a trajectory.
+    """
+
+    def __init__(self, points, cell_size):
+        """
+        Build the index.
+        :param points: An NxD array of points, for any number of dimensions D
+        :param cell_size: The size of the grid cells. Should be about the size of the search radius.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        if points.ndim != 2:
+            points = points.reshape(len(points), -1) if points.size > 0 else points.reshape(0, 1)
+        self._points = points
+        num_points, num_dims = self._points.shape
+        if cell_size <= 0:
+            raise ValueError("Grid cell size must be positive, got {0}".format(cell_size))
+
+        if num_points > 0:
+            self._origin = self._points.min(axis=0)
+            # Make the cells bigger if we need to, so that the cell coordinates can be packed into a single integer
+            extent = float(np.max(self._points.max(axis=0) - self._origin))
+            cell_size = max(float(cell_size), extent / 2 ** (62 // max(num_dims, 1) - 2))
+        else:
+            self._origin = np.zeros(num_dims)
+        self._cell_size = float(cell_size)
+
+        cells = self._get_cells(self._points)
+        self._grid_shape = cells.max(axis=0) + 1 if num_points > 0 else np.ones(num_dims, dtype=np.int64)
+        self._strides = np.ones(num_dims, dtype=np.int64)
+        for dim in range(num_dims - 2, -1, -1):
+            self._strides[dim] = self._strides[dim + 1] * self._grid_shape[dim + 1]
+
+        # Give each occupied cell a dense id, and sort the points by cell, then by their original index
+        self._cell_keys, cell_ids = np.unique(np.dot(cells, self._strides), return_inverse=True)
+        sort_keys = cell_ids.astype(np.int64) * num_points + np.arange(num_points)
+        self._order = np.argsort(sort_keys, kind='mergesort')
+        self._sorted_keys = sort_keys[self._order]
+
+    @property
+    def cell_size(self):
+        return self._cell_size
+
+    def __len__(self):
+        return len(self._points)
+
+    def query_radius(self, queries, radius, max_index=None):
+        """
+        Find all the points strictly within a given distance of each query point.
+        :param queries: An MxD array of query points
+        :param radius: The search radius
+        :param max_index: Optional array of length M. If given, only points with index less than this
+        are returned for each query.
+        :return: Three arrays of the same length: the index of the query, the index of the point within radius,
+        and the square distance between them. These are sorted by query index, then point index.
+        """
+        queries = self._check_queries(queries)
+        radius_squared = radius * radius
+        query_indexes = [np.zeros(0, dtype=np.int64)]
+        point_indexes = [np.zeros(0, dtype=np.int64)]
+        square_distances = [np.zeros(0)]
+        for starts, ends in self._find_candidate_ranges(queries, radius, max_index):
+            counts = ends - starts
+            total = int(np.sum(counts))
+            if total <= 0:
+                continue
+            candidate_queries = np.repeat(np.arange(len(queries)), counts)
+            positions = np.arange(total) - np.repeat(np.cumsum(counts) - counts - starts, counts)
+            candidate_points = self._order[positions]
+            diff = queries[candidate_queries] - self._points[candidate_points]
+            square_dist = np.sum(diff * diff, axis=1)
+            within = square_dist < radius_squared
+            query_indexes.append(candidate_queries[within])
+            point_indexes.append(candidate_points[within])
+            square_distances.append(square_dist[within])
+
+        query_indexes = np.concatenate(query_indexes)
+        point_indexes = np.concatenate(point_indexes)
+        square_distances = np.concatenate(square_distances)
+        order = np.lexsort((point_indexes, query_indexes))
+        return query_indexes[order], point_indexes[order], square_distances[order]
+
+    def any_within(self, queries, radius, max_index=None):
+        """
+        Check whether there is any point strictly within a given distance of each query point.
+        This stops checking the points for each query as soon as one is found,
+        so it is cheaper than query_radius when there are many points close together.
+        :param queries: An MxD array of query points
+        :param radius: The search radius
+        :param max_index: Optional array of length M. If given, only points with index less than this
+        are considered for each query.
+        :return: A boolean array of length M
+        """
+        queries = self._check_queries(queries)
+        radius_squared = radius * radius
+        found = np.zeros(len(queries), dtype=bool)
+        for starts, ends in self._find_candidate_ranges(queries, radius, max_index):
+            # Check the first candidate for every query, then the second for the queries still not found, etc.
+            pending = np.nonzero(~found & (ends > starts))[0]
+            step = 0
+            while len(pending) > 0:
+                candidate_points = self._order[starts[pending] + step]
+                diff = queries[pending] - self._points[candidate_points]
+                within = np.sum(diff * diff, axis=1) < radius_squared
+                found[pending[within]] = True
+                step += 1
+                pending = pending[~within]
+                pending = pending[starts[pending] + step < ends[pending]]
+        return found
+
+    def _check_queries(self, queries):
+        """
+        Make sure the queries are an array with the same dimensions as the points
+        :param queries: The query points
+        :return: An MxD array
+        """
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, self._points.shape[1])
+        return queries
+
+    def _get_cells(self, points):
+        """
+        Get the grid cell coordinates for some points
+        :param points: An NxD array
+        :return: An NxD integer array
+        """
+        return np.floor((points - self._origin) / self._cell_size).astype(np.int64)
+
+    def _find_candidate_ranges(self, queries, radius, max_index=None):
+        """
+        Find the candidate points in each neighbouring cell, for each query.
+        The candidates are contiguous ranges in the sorted order of the points.
+        :param queries: An MxD array of query points
+        :param radius: The search radius, which decides how many cells around each query are checked
+        :param max_index: Optional array of length M, only points with a lower index are candidates
+        :return: A generator of pairs of arrays, the start and end of the range for each query,
+        one pair for each neighbouring cell
+        """
+        num_points = len(self._points)
+        if num_points <= 0 or len(queries) <= 0:
+            return
+        if max_index is None:
+            max_index = np.full(len(queries), num_points, dtype=np.int64)
+        else:
+            max_index = np.clip(np.asarray(max_index, dtype=np.int64).reshape(-1), 0, num_points)
+
+        query_cells = self._get_cells(queries)
+        reach = max(int(np.ceil(radius / self._cell_size)), 0)
+        for offset in itertools.product(range(-reach, reach + 1), repeat=queries.shape[1]):
+            cells = query_cells + np.array(offset, dtype=np.int64)
+            valid = np.all((cells >= 0) & (cells < self._grid_shape), axis=1)
+            keys = np.dot(np.where(valid[:, np.newaxis], cells, 0), self._strides)
+            cell_ids = np.searchsorted(self._cell_keys, keys)
+            valid &= cell_ids < len(self._cell_keys)
+            valid[valid] &= self._cell_keys[cell_ids[valid]] == keys[valid]
+            if not np.any(valid):
+                continue
+            cell_ids = cell_ids.astype(np.int64) * num_points
+            starts = np.searchsorted(self._sorted_keys, cell_ids, side='left')
+            ends = np.searchsorted(self._sorted_keys, cell_ids + max_index, side='left')
+            ends = np.where(valid, ends, starts)
+            yield starts, ends
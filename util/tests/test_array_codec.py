@@ -0,0 +1,98 @@
+# Copyright (c) 2017, John Skinner
+import unittest
+import pickle
+import numpy as np
+import util.array_codec as ac
+
+
+class TestArrayCodec(unittest.TestCase):
+
+    def test_encodes_and_decodes_rgb_images_losslessly(self):
+        data = np.random.randint(0, 255, (32, 48, 3), dtype='uint8')
+        result = ac.decode_array(ac.encode_array(data))
+        self.assertEqual(data.dtype, result.dtype)
+        self.assertTrue(np.array_equal(data, result))
+
+    def test_encodes_and_decodes_single_channel_images_losslessly(self):
+        for data in [np.random.randint(0, 255, (32, 48), dtype='uint8'),
+                     np.random.randint(0, 255, (32, 48, 1), dtype='uint8'),
+                     np.random.randint(0, 65535, (32, 48), dtype='uint16')]:
+            result = ac.decode_array(ac.encode_array(data))
+            self.assertEqual(data.dtype, result.dtype)
+            self.assertEqual(data.shape, result.shape)
+            self.assertTrue(np.array_equal(data, result))
+
+    def test_encodes_and_decodes_float_arrays_losslessly(self):
+        for data in [np.random.uniform(0, 100, (32, 48)),
+                     np.random.uniform(-1, 1, (32, 48, 3)).astype(np.float32)]:
+            result = ac.decode_array(ac.encode_array(data))
+            self.assertEqual(data.dtype, result.dtype)
+            self.assertTrue(np.array_equal(data, result))
+
+    def test_handles_non_contiguous_arrays(self):
+        data = np.random.randint(0, 255, (32, 48, 3), dtype='uint8')[:, :, ::-1]
+        self.assertTrue(np.array_equal(data, ac.decode_array(ac.encode_array(data))))
+        depth = np.random.uniform(0, 100, (32, 48))[::2, ::3]
+        self.assertTrue(np.array_equal(depth, ac.decode_array(ac.encode_array(depth))))
+
+    def test_compresses_images(self):
+        data = np.zeros((64, 64, 3), dtype='uint8')
+        data[10:30, 10:30, :] = 255
+        self.assertLess(len(ac.encode_array(data)), len(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)))
+        depth = np.full((64, 64), 2.5)
+        self.assertLess(len(ac.encode_array(depth)), len(pickle.dumps(depth, protocol=pickle.HIGHEST_PROTOCOL)))
+
+    def test_uses_specified_codec(self):
+        data = np.random.randint(0, 255, (32, 48, 3), dtype='uint8')
+        encoded = ac.encode_array(data, codec='zlib')
+        self.assertIn(b'"codec": "zlib"', encoded)
+        self.assertTrue(np.array_equal(data, ac.decode_array(encoded)))
+
+    def test_falls_back_to_default_codec_if_specified_codec_cannot_encode(self):
+        data = np.random.randint(0, 255, (32, 48, 3), dtype='uint8')
+        encoded = ac.encode_array(data, codec='quantised_uint16')
+        self.assertIn(b'"codec": "png"', encoded)
+        self.assertTrue(np.array_equal(data, ac.decode_array(encoded)))
+
+    def test_quantised_codec_is_accurate_to_scale(self):
+        depth = np.random.uniform(0, 60, (32, 48))
+        depth[3, 4] = np.nan
+        result = ac.decode_array(ac.encode_array(depth, codec='quantised_uint16', scale=0.001))
+        self.assertEqual(depth.dtype, result.dtype)
+        self.assertTrue(np.isnan(result[3, 4]))
+        mask = np.logical_not(np.isnan(depth))
+        self.assertTrue(np.all(np.abs(depth[mask] - result[mask]) <= 0.0005 + 1e-9))
+
+    def test_pickles_arrays_that_cannot_be_compressed(self):
+        data = np.array(['a', 'bc', 'def'], dtype=object)
+        result = ac.decode_array(ac.encode_array(data))
+        self.assertTrue(np.array_equal(data, result))
+
+    def test_decodes_pickled_arrays(self):
+        data = np.random.uniform(0, 100, (32, 48))
+        result = ac.decode_array(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+        self.assertTrue(np.array_equal(data, result))
+
+    def test_can_register_new_codecs(self):
+        class FlipCodec(ac.ArrayCodec):
+            @property
+            def name(self):
+                return 'test_flip'
+
+            def encode(self, array, **kwargs):
+                return array[::-1].tobytes(), {}
+
+            def decode(self, data, dtype, shape, **kwargs):
+                return np.frombuffer(data, dtype=dtype).reshape(shape)[::-1]
+
+        ac.register_codec(FlipCodec())
+        data = np.random.uniform(0, 100, (32, 48))
+        encoded = ac.encode_array(data, codec='test_flip')
+        self.assertIn(b'"codec": "test_flip"', encoded)
+        self.assertTrue(np.array_equal(data, ac.decode_array(encoded)))
+
+    def test_decode_raises_for_unknown_codec(self):
+        encoded = ac.encode_array(np.random.uniform(0, 100, (32, 48)))
+        encoded = encoded.replace(b'shuffle_zlib', b'not_a_codec!')
+        with self.assertRaises(ValueError):
+            ac.decode_array(encoded)
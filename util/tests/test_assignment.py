@@ -0,0 +1,53 @@
+# Copyright (c) 2017, John Skinner
+import unittest
+import itertools
+import numpy as np
+import util.assignment as assignment
+
+
+class TestGreedyAssignment(unittest.TestCase):
+
+    def test_matches_sequential_assignment(self):
+        random = np.random.RandomState(1132)
+        for _ in range(20):
+            first = random.randint(0, 20, 200)
+            second = random.randint(0, 15, 200)
+            expected = []
+            used_first = set()
+            used_second = set()
+            for idx, (item1, item2) in enumerate(zip(first, second)):
+                if item1 not in used_first and item2 not in used_second:
+                    used_first.add(item1)
+                    used_second.add(item2)
+                    expected.append(idx)
+            self.assertEqual(expected, list(assignment.greedy_assignment(first, second)))
+
+    def test_handles_no_candidates(self):
+        self.assertEqual(0, len(assignment.greedy_assignment([], [])))
+
+
+class TestOptimalAssignment(unittest.TestCase):
+
+    def test_finds_maximum_total_score(self):
+        random = np.random.RandomState(5514)
+        for shape in ((3, 3), (4, 6), (6, 4), (5, 5), (1, 4)):
+            for _ in range(10):
+                scores = random.randint(0, 10, shape).astype(float)
+                rows, cols = assignment.optimal_assignment(scores)
+                self.assertEqual(min(shape), len(rows))
+                self.assertEqual(len(rows), len(set(rows)))
+                self.assertEqual(len(cols), len(set(cols)))
+                self.assertEqual(sorted(rows), list(rows))
+                self.assertEqual(brute_force_best(scores), np.sum(scores[rows, cols]))
+
+    def test_handles_empty_scores(self):
+        rows, cols = assignment.optimal_assignment(np.zeros((0, 3)))
+        self.assertEqual(0, len(rows))
+        self.assertEqual(0, len(cols))
+
+
+def brute_force_best(scores):
+    if scores.shape[0] > scores.shape[1]:
+        scores = scores.T
+    return max(sum(scores[row, col] for row, col in enumerate(cols))
+               for cols in itertools.permutations(range(scores.shape[1]), scores.shape[0]))
@@ -0,0 +1,73 @@
+# Copyright (c) 2017, John Skinner
+import unittest
+import numpy as np
+import util.associate as ass
+
+
+class TestAssociate(unittest.TestCase):
+
+    def test_matches_identical_stamps(self):
+        first = {idx / 10: idx for idx in range(10)}
+        second = {idx / 10: -idx for idx in range(10)}
+        self.assertEqual([(idx / 10, idx / 10) for idx in range(10)], ass.associate(first, second, 0, 0.01))
+
+    def test_applies_offset(self):
+        first = {1.0: 'a', 2.0: 'b'}
+        second = {0.5: 'c', 1.5: 'd'}
+        self.assertEqual([(1.0, 0.5), (2.0, 1.5)], ass.associate(first, second, offset=0.5, max_difference=0.1))
+
+    def test_does_not_match_beyond_max_difference(self):
+        self.assertEqual([], ass.associate({1.0: 1}, {1.5: 1}, 0, 0.5))
+        self.assertEqual([(1.0, 1.5)], ass.associate({1.0: 1}, {1.5: 1}, 0, 0.51))
+
+    def test_empty(self):
+        self.assertEqual([], ass.associate({}, {1.0: 1}, 0, 1))
+        self.assertEqual([], ass.associate({1.0: 1}, {}, 0, 1))
+
+    def test_same_as_exhaustive_greedy_matching(self):
+        random = np.random.RandomState(16523)
+        for _ in range(200):
+            first = {float(stamp): True for stamp in random.uniform(0, 20, random.randint(1, 50))}
+            second = {float(stamp): True for stamp in random.uniform(0, 20, random.randint(1, 50))}
+            offset = random.uniform(-1, 1)
+            max_difference = random.uniform(0, 3)
+            self.assertEqual(exhaustive_associate(first, second, offset, max_difference),
+                             ass.associate(first, second, offset, max_difference))
+
+    def test_same_as_exhaustive_greedy_matching_with_ties(self):
+        random = np.random.RandomState(5322)
+        for _ in range(200):
+            first = {int(stamp): True for stamp in random.randint(0, 30, random.randint(1, 30))}
+            second = {int(stamp): True for stamp in random.randint(0, 30, random.randint(1, 30))}
+            offset = int(random.randint(-3, 3))
+            max_difference = int(random.randint(1, 6))
+            self.assertEqual(exhaustive_associate(first, second, offset, max_difference),
+                             ass.associate(first, second, offset, max_difference))
+
+    def test_associate_arrays_returns_indexes(self):
+        first = np.array([3.0, 1.0, 2.0])
+        second = np.array([2.05, 0.95, 10])
+        first_indexes, second_indexes = ass.associate_arrays(first, second, 0, 0.1)
+        self.assertEqual([1, 2], first_indexes.tolist())
+        self.assertEqual([1, 0], second_indexes.tolist())
+
+
+def exhaustive_associate(first_list, second_list, offset, max_difference):
+    """
+    The original quadratic association algorithm, to check the results are the same
+    """
+    first_keys = list(first_list.keys())
+    second_keys = list(second_list.keys())
+    potential_matches = [(abs(a - (b + offset)), a, b)
+                         for a in first_keys
+                         for b in second_keys
+                         if abs(a - (b + offset)) < max_difference]
+    potential_matches.sort()
+    matches = []
+    for diff, a, b in potential_matches:
+        if a in first_keys and b in second_keys:
+            first_keys.remove(a)
+            second_keys.remove(b)
+            matches.append((a, b))
+    matches.sort()
+    return matches
@@ -0,0 +1,77 @@
+# Copyright (c) 2017, John Skinner
+import unittest
+import threading
+import util.prefetch as prefetch
+
+
+class TestOrderedPrefetcher(unittest.TestCase):
+
+    def test_returns_items_in_order(self):
+        subject = prefetch.OrderedPrefetcher(load=lambda key: key * 2, keys=range(20), depth=4)
+        results = list(subject)
+        self.assertEqual([(key, key * 2) for key in range(20)], results)
+        self.assertTrue(subject.is_complete())
+        self.assertEqual((None, None), subject.get_next())
+        subject.close()
+
+    def test_loads_ahead_of_consumer(self):
+        loaded = []
+        lock = threading.Lock()
+
+        def load(key):
+            with lock:
+                loaded.append(key)
+            return key
+
+        subject = prefetch.OrderedPrefetcher(load=load, keys=range(20), depth=5, num_workers=1)
+        subject.get_next()
+        subject.close()    # Waits for nothing, but stops more loading
+        self.assertLessEqual(len(loaded), 6)
+        self.assertIn(0, loaded)
+
+    def test_does_not_load_more_than_depth_ahead(self):
+        gate = threading.Event()
+        started = []
+
+        def load(key):
+            started.append(key)
+            gate.wait(5)
+            return key
+
+        subject = prefetch.OrderedPrefetcher(load=load, keys=range(20), depth=3, num_workers=8)
+        self.assertEqual(3, subject.read_ahead)
+        gate.set()
+        self.assertEqual((0, 0), subject.get_next())
+        subject.close()
+        self.assertLessEqual(len(started), 4)
+
+    def test_byte_budget_limits_read_ahead(self):
+        subject = prefetch.OrderedPrefetcher(load=lambda key: key, keys=range(20), depth=10,
+                                             max_bytes=250, get_size=lambda _: 100)
+        self.assertEqual(10, subject.read_ahead)
+        subject.get_next()
+        self.assertEqual(2, subject.read_ahead)
+        self.assertEqual(list(range(1, 20)), [key for key, _ in subject])
+        subject.close()
+
+    def test_read_ahead_is_at_least_one(self):
+        subject = prefetch.OrderedPrefetcher(load=lambda key: key, keys=range(5), depth=10,
+                                             max_bytes=10, get_size=lambda _: 100)
+        subject.get_next()
+        self.assertEqual(1, subject.read_ahead)
+        self.assertEqual(list(range(1, 5)), [key for key, _ in subject])
+        subject.close()
+
+    def test_raises_load_exceptions_from_get_next(self):
+        def load(key):
+            if key == 2:
+                raise ValueError("Failed to load")
+            return key
+
+        subject = prefetch.OrderedPrefetcher(load=load, keys=range(5), depth=3)
+        self.assertEqual((0, 0), subject.get_next())
+        self.assertEqual((1, 1), subject.get_next())
+        with self.assertRaises(ValueError):
+            subject.get_next()
+        self.assertEqual((3, 3), subject.get_next())
+        subject.close()
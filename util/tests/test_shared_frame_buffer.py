@@ -0,0 +1,87 @@
+# Copyright (c) 2017, John Skinner
+import unittest
+import multiprocessing
+import numpy as np
+import util.shared_frame_buffer as sfb
+
+
+def sum_frames(frame_buffer, output_queue):
+    """
+    A consumer to run in a subprocess, sending back the sum of each frame it receives
+    """
+    frame = frame_buffer.get(timeout=10)
+    while frame is not None:
+        slot, arrays, timestamp = frame
+        output_queue.put((timestamp, [float(np.sum(array)) for array in arrays]))
+        frame_buffer.release(slot)
+        frame = frame_buffer.get(timeout=10)
+    output_queue.put(None)
+
+
+class TestSharedFrameBuffer(unittest.TestCase):
+
+    def test_sends_frames_in_order(self):
+        subject = sfb.SharedFrameBuffer([((4, 5, 3), np.uint8), ((4, 5), np.float32)], num_slots=3)
+        frames = [(np.random.randint(0, 255, (4, 5, 3), dtype=np.uint8),
+                   np.random.uniform(0, 10, (4, 5)).astype(np.float32)) for _ in range(3)]
+        for idx, frame in enumerate(frames):
+            self.assertTrue(subject.put(frame, idx * 0.1))
+        for idx, frame in enumerate(frames):
+            slot, arrays, timestamp = subject.get(timeout=1)
+            self.assertEqual(idx * 0.1, timestamp)
+            self.assertEqual(np.uint8, arrays[0].dtype)
+            self.assertEqual(np.float32, arrays[1].dtype)
+            self.assertTrue(np.array_equal(frame[0], arrays[0]))
+            self.assertTrue(np.array_equal(frame[1], arrays[1]))
+            subject.release(slot)
+        subject.close()
+        self.assertIsNone(subject.get(timeout=1))
+
+    def test_put_waits_for_a_free_slot(self):
+        subject = sfb.SharedFrameBuffer([((2, 2), np.uint8)], num_slots=2)
+        self.assertTrue(subject.put((np.zeros((2, 2)),), 1))
+        self.assertTrue(subject.put((np.ones((2, 2)),), 2))
+        self.assertFalse(subject.put((np.ones((2, 2)),), 3, timeout=0.01))
+
+        slot, arrays, timestamp = subject.get(timeout=1)
+        self.assertEqual(1, timestamp)
+        self.assertTrue(np.array_equal(np.zeros((2, 2)), arrays[0]))
+        subject.release(slot)
+        self.assertTrue(subject.put((2 * np.ones((2, 2)),), 3, timeout=0.01))
+
+    def test_reuses_slots_in_order(self):
+        subject = sfb.SharedFrameBuffer([((2, 2), np.uint8)], num_slots=2)
+        for idx in range(6):
+            self.assertTrue(subject.put((idx * np.ones((2, 2)),), idx, timeout=1))
+            slot, arrays, timestamp = subject.get(timeout=1)
+            self.assertEqual(idx % 2, slot)
+            self.assertEqual(idx, timestamp)
+            self.assertTrue(np.array_equal(idx * np.ones((2, 2)), arrays[0]))
+            subject.release(slot)
+
+    def test_put_checks_frame_layout(self):
+        subject = sfb.SharedFrameBuffer([((4, 5, 3), np.uint8), ((4, 5), np.float32)])
+        with self.assertRaises(ValueError):
+            subject.put((np.zeros((4, 5, 3)),), 1)
+        with self.assertRaises(ValueError):
+            subject.put((np.zeros((4, 5, 3)), np.zeros((5, 4))), 1)
+
+    def test_sends_frames_to_subprocess(self):
+        subject = sfb.SharedFrameBuffer([((8, 6, 3), np.uint8), ((8, 6), np.float32)], num_slots=2)
+        output_queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=sum_frames, args=(subject, output_queue))
+        process.start()
+
+        frames = [(np.random.randint(0, 255, (8, 6, 3), dtype=np.uint8),
+                   np.random.uniform(0, 10, (8, 6)).astype(np.float32)) for _ in range(5)]
+        for idx, frame in enumerate(frames):
+            self.assertTrue(subject.put(frame, idx, timeout=10))
+        subject.close()
+
+        for idx, frame in enumerate(frames):
+            timestamp, sums = output_queue.get(timeout=10)
+            self.assertEqual(idx, timestamp)
+            self.assertAlmostEqual(float(np.sum(frame[0])), sums[0])
+            self.assertAlmostEqual(float(np.sum(frame[1])), sums[1], places=3)
+        self.assertIsNone(output_queue.get(timeout=10))
+        process.join(timeout=10)
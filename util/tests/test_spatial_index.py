@@ -0,0 +1,67 @@
+# Copyright (c) 2017, John Skinner
+import unittest
+import numpy as np
+import util.spatial_index as spatial_index
+
+
+class TestGridIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.random = np.random.RandomState(8823)
+
+    def test_query_radius_matches_brute_force(self):
+        for num_dims in (1, 2, 3):
+            points = self.random.uniform(-50, 50, (300, num_dims))
+            queries = self.random.uniform(-60, 60, (100, num_dims))
+            for radius, cell_size in ((5, 5), (5, 2), (5, 11)):
+                index = spatial_index.GridIndex(points, cell_size)
+                query_idx, point_idx, square_dist = index.query_radius(queries, radius)
+                expected_query, expected_point, expected_dist = brute_force_pairs(points, queries, radius)
+                self.assertTrue(np.array_equal(expected_query, query_idx))
+                self.assertTrue(np.array_equal(expected_point, point_idx))
+                self.assertTrue(np.allclose(expected_dist, square_dist))
+
+    def test_query_radius_respects_max_index(self):
+        points = self.random.uniform(-50, 50, (300, 3))
+        queries = self.random.uniform(-50, 50, (100, 3))
+        max_index = self.random.randint(0, 301, 100)
+        index = spatial_index.GridIndex(points, 10)
+        query_idx, point_idx, _ = index.query_radius(queries, 10, max_index=max_index)
+        expected_query, expected_point, _ = brute_force_pairs(points, queries, 10)
+        keep = expected_point < max_index[expected_query]
+        self.assertTrue(np.array_equal(expected_query[keep], query_idx))
+        self.assertTrue(np.array_equal(expected_point[keep], point_idx))
+
+    def test_any_within_matches_brute_force(self):
+        points = np.concatenate((self.random.uniform(-50, 50, (200, 3)), np.zeros((100, 3))))
+        queries = np.concatenate((self.random.uniform(-50, 50, (100, 3)), np.zeros((10, 3))))
+        max_index = self.random.randint(0, 301, len(queries))
+        index = spatial_index.GridIndex(points, 8)
+        found = index.any_within(queries, 8, max_index=max_index)
+        query_idx, point_idx, _ = brute_force_pairs(points, queries, 8)
+        expected = np.zeros(len(queries), dtype=bool)
+        expected[query_idx[point_idx < max_index[query_idx]]] = True
+        self.assertTrue(np.array_equal(expected, found))
+
+    def test_distance_must_be_strictly_less_than_radius(self):
+        index = spatial_index.GridIndex([(0, 0), (3, 4)], 5)
+        query_idx, point_idx, _ = index.query_radius([(0, 0)], 5)
+        self.assertEqual([0], list(point_idx))
+        self.assertEqual([False], list(index.any_within([(3, 9)], 5)))
+
+    def test_handles_empty_points(self):
+        index = spatial_index.GridIndex(np.zeros((0, 3)), 1)
+        self.assertEqual(0, len(index))
+        self.assertEqual(0, len(index.query_radius([(1, 2, 3)], 1)[0]))
+        self.assertEqual([False], list(index.any_within([(1, 2, 3)], 1)))
+
+    def test_raises_for_non_positive_cell_size(self):
+        with self.assertRaises(ValueError):
+            spatial_index.GridIndex([(1, 2, 3)], 0)
+
+
+def brute_force_pairs(points, queries, radius):
+    diff = queries[:, np.newaxis, :] - points[np.newaxis, :, :]
+    square_dist = np.sum(diff * diff, axis=2)
+    query_idx, point_idx = np.nonzero(square_dist < radius * radius)
+    return query_idx, point_idx, square_dist[query_idx, point_idx]
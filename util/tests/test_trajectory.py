@@ -0,0 +1,180 @@
+# Copyright (c) 2017, John Skinner
+import unittest
+import io
+import numpy as np
+import transforms3d as tf3d
+import util.transform as tf
+import util.trajectory as traj
+
+
+class TestTrajectory(unittest.TestCase):
+
+    def test_behaves_like_a_dict(self):
+        poses = {float(time): make_random_pose() for time in np.random.uniform(0, 100, 20)}
+        trajectory = make_trajectory(poses)
+        self.assertEqual(len(poses), len(trajectory))
+        self.assertEqual(sorted(poses.keys()), list(trajectory.keys()))
+        for time, pose in poses.items():
+            self.assertIn(time, trajectory)
+            self.assertNPClose(pose.location, trajectory[time].location)
+            self.assertNPClose(pose.rotation_quat(True), trajectory[time].rotation_quat(True))
+        self.assertNotIn(-1.0, trajectory)
+        self.assertNotIn('a', trajectory)
+        with self.assertRaises(KeyError):
+            _ = trajectory[-1.0]
+
+    def test_keeps_last_duplicate_timestamp(self):
+        trajectory = traj.Trajectory([2, 1, 2], [(1, 0, 0), (2, 0, 0), (3, 0, 0)],
+                                     [(1, 0, 0, 0), (1, 0, 0, 0), (1, 0, 0, 0)])
+        self.assertEqual([1.0, 2.0], list(trajectory.keys()))
+        self.assertNPEqual((3, 0, 0), trajectory[2].location)
+
+    def test_arrays_are_read_only(self):
+        trajectory = make_trajectory({1.0: make_random_pose()})
+        with self.assertRaises(ValueError):
+            trajectory.locations[0, 0] = 10
+
+    def test_find_relative_matches_transform(self):
+        poses = {float(time): make_random_pose() for time in range(20)}
+        base_pose = make_random_pose()
+        relative = make_trajectory(poses).find_relative(base_pose)
+        for time, pose in poses.items():
+            expected = base_pose.find_relative(pose)
+            self.assertNPClose(expected.location, relative[time].location)
+            self.assertNPClose(expected.rotation_quat(True), relative[time].rotation_quat(True))
+
+    def test_find_relative_to_trajectory_matches_transform(self):
+        poses = {float(time): make_random_pose() for time in range(20)}
+        base_poses = {time: make_random_pose() for time in poses.keys()}
+        relative = make_trajectory(poses).find_relative(make_trajectory(base_poses))
+        for time, pose in poses.items():
+            expected = base_poses[time].find_relative(pose)
+            self.assertNPClose(expected.location, relative[time].location)
+            self.assertNPClose(expected.rotation_quat(True), relative[time].rotation_quat(True))
+
+    def test_find_independent_matches_transform(self):
+        poses = {float(time): make_random_pose() for time in range(20)}
+        base_pose = make_random_pose()
+        independent = make_trajectory(poses).find_independent(base_pose)
+        for time, pose in poses.items():
+            expected = base_pose.find_independent(pose)
+            self.assertNPClose(expected.location, independent[time].location)
+            self.assertNPClose(expected.rotation_quat(True), independent[time].rotation_quat(True))
+
+    def test_find_independent_of_trajectory_matches_transform(self):
+        poses = {float(time): make_random_pose() for time in range(20)}
+        base_poses = {time: make_random_pose() for time in poses.keys()}
+        independent = make_trajectory(poses).find_independent(make_trajectory(base_poses))
+        for time, pose in poses.items():
+            expected = base_poses[time].find_independent(pose)
+            self.assertNPClose(expected.location, independent[time].location)
+            self.assertNPClose(expected.rotation_quat(True), independent[time].rotation_quat(True))
+
+    def test_find_relative_raises_for_different_timestamps(self):
+        trajectory = make_trajectory({float(time): make_random_pose() for time in range(5)})
+        other = make_trajectory({float(time) + 0.5: make_random_pose() for time in range(5)})
+        with self.assertRaises(ValueError):
+            trajectory.find_relative(other)
+        with self.assertRaises(ValueError):
+            trajectory.find_independent(other)
+
+    def test_from_poses(self):
+        poses = {float(time): make_random_pose() for time in np.random.uniform(0, 100, 20)}
+        trajectory = traj.Trajectory.from_poses(poses)
+        self.assertEqual(sorted(poses.keys()), list(trajectory.keys()))
+        for time, pose in poses.items():
+            self.assertNPClose(pose.location, trajectory[time].location)
+            self.assertNPClose(pose.rotation_quat(True), trajectory[time].rotation_quat(True))
+        self.assertIs(trajectory, traj.Trajectory.from_poses(trajectory))
+
+    def test_to_dict(self):
+        poses = {float(time): make_random_pose() for time in range(10)}
+        result = make_trajectory(poses).to_dict()
+        self.assertIsInstance(result, dict)
+        self.assertEqual(set(poses.keys()), set(result.keys()))
+        for time, pose in poses.items():
+            self.assertNPClose(pose.location, result[time].location)
+
+    def test_transform_matrices_matches_transform(self):
+        poses = {float(time): make_random_pose() for time in range(10)}
+        matrices = make_trajectory(poses).transform_matrices
+        self.assertEqual((10, 4, 4), matrices.shape)
+        for idx, time in enumerate(sorted(poses.keys())):
+            self.assertNPClose(poses[time].transform_matrix, matrices[idx])
+
+    def test_between_and_slicing(self):
+        trajectory = make_trajectory({float(time): make_random_pose() for time in range(10)})
+        self.assertEqual([3.0, 4.0, 5.0], list(trajectory.between(2.5, 6).keys()))
+        self.assertEqual([3.0, 4.0, 5.0], list(trajectory[2.5:6].keys()))
+        self.assertEqual([0.0, 1.0], list(trajectory[:2].keys()))
+        self.assertEqual([8.0, 9.0], list(trajectory[8:].keys()))
+        self.assertEqual(0, len(trajectory[20:]))
+        self.assertNPEqual(trajectory[4.0].location, trajectory[2.5:6][4.0].location)
+        with self.assertRaises(ValueError):
+            _ = trajectory[0:10:2]
+
+    def test_read_trajectory_file(self):
+        trajectory_file = io.StringIO("# timestamp tx ty tz qx qy qz qw\n"
+                                      "1.5 1 2 3 0 0 0 1\n"
+                                      "1.25 4 5 6 0 0 0.7071067811865476 0.7071067811865476 extra\n")
+        trajectory = traj.read_trajectory_file(trajectory_file)
+        self.assertEqual([1.25, 1.5], list(trajectory.keys()))
+        self.assertNPEqual((4, 5, 6), trajectory[1.25].location)
+        self.assertNPClose((0.7071067811865476, 0, 0, 0.7071067811865476), trajectory[1.25].rotation_quat(True))
+        self.assertNPEqual((1, 0, 0, 0), trajectory[1.5].rotation_quat(True))
+
+    def test_read_trajectory_file_w_first(self):
+        trajectory_file = io.StringIO("1.5,1,2,3,0,0,0,2,0.1,0.2\n")
+        trajectory = traj.read_trajectory_file(trajectory_file, delimiter=',', w_first=True)
+        self.assertNPEqual((1, 2, 3), trajectory[1.5].location)
+        self.assertNPEqual((0, 0, 0, 1), trajectory[1.5].rotation_quat(True))
+
+    def assertNPEqual(self, arr1, arr2):
+        self.assertTrue(np.array_equal(arr1, arr2), "Arrays {0} and {1} are not equal".format(str(arr1), str(arr2)))
+
+    def assertNPClose(self, arr1, arr2):
+        self.assertTrue(np.all(np.isclose(arr1, arr2)), "Arrays {0} and {1} are not close".format(str(arr1), str(arr2)))
+
+
+class TestQuaternionFunctions(unittest.TestCase):
+
+    def test_quat_multiply_matches_transforms3d(self):
+        quats1 = [make_random_pose().rotation_quat(True) for _ in range(10)]
+        quats2 = [make_random_pose().rotation_quat(True) for _ in range(10)]
+        result = traj.quat_multiply(quats1, quats2)
+        for idx in range(10):
+            self.assertTrue(np.allclose(tf3d.quaternions.qmult(quats1[idx], quats2[idx]), result[idx]))
+
+    def test_quat_inverse_matches_transforms3d(self):
+        quats = [make_random_pose().rotation_quat(True) for _ in range(10)]
+        result = traj.quat_inverse(quats)
+        for idx in range(10):
+            self.assertTrue(np.allclose(tf3d.quaternions.qinverse(quats[idx]), result[idx]))
+
+    def test_quat_inverse_inverts_non_unit_quaternions(self):
+        quats = np.random.uniform(-1, 1, (10, 4))
+        self.assertTrue(np.allclose(np.tile((1, 0, 0, 0), (10, 1)),
+                                    traj.quat_multiply(quats, traj.quat_inverse(quats))))
+
+    def test_quat_to_matrices_matches_transforms3d(self):
+        quats = [make_random_pose().rotation_quat(True) for _ in range(10)]
+        result = traj.quat_to_matrices(quats)
+        for idx in range(10):
+            self.assertTrue(np.allclose(tf3d.quaternions.quat2mat(quats[idx]), result[idx]))
+
+    def test_rotate_vectors_matches_transforms3d(self):
+        vectors = np.random.uniform(-10, 10, (10, 3))
+        quats = [make_random_pose().rotation_quat(True) for _ in range(10)]
+        result = traj.rotate_vectors(vectors, quats)
+        for idx in range(10):
+            self.assertTrue(np.allclose(tf3d.quaternions.rotate_vector(vectors[idx], quats[idx]), result[idx]))
+
+
+def make_random_pose():
+    return tf.Transform(location=np.random.uniform(-100, 100, 3), rotation=np.random.uniform(-np.pi, np.pi, 3))
+
+
+def make_trajectory(poses):
+    times = list(poses.keys())
+    return traj.Trajectory(times, [poses[time].location for time in times],
+                           [poses[time].rotation_quat(True) for time in times])
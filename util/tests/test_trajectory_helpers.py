@@ -0,0 +1,50 @@
+# Copyright (c) 2017, John Skinner
+import unittest
+import numpy as np
+import bson
+import database.tests.mock_database_client as mock_client_factory
+import util.transform as tf
+import util.trajectory
+import util.trajectory_helpers as traj_help
+
+
+class TestGetTrajectoryForImageSource(unittest.TestCase):
+
+    def setUp(self):
+        self.zombie_db_client = mock_client_factory.create()
+        self.db_client = self.zombie_db_client.mock
+
+    def test_returns_trajectory_relative_to_first_pose(self):
+        poses = {float(time): tf.Transform(location=np.random.uniform(-100, 100, 3),
+                                           rotation=np.random.uniform(-np.pi, np.pi, 3))
+                 for time in range(10)}
+        images = []
+        for time, pose in poses.items():
+            image_id = self.db_client.image_collection.insert_one({
+                'metadata': {'camera_pose': pose.serialize()}
+            }).inserted_id
+            images.append((time, image_id))
+        collection_id = self.db_client.image_source_collection.insert_one({'images': images}).inserted_id
+
+        trajectory = traj_help.get_trajectory_for_image_source(self.db_client, collection_id)
+        self.assertIsInstance(trajectory, util.trajectory.Trajectory)
+        self.assertEqual(sorted(poses.keys()), list(trajectory.keys()))
+        for time, pose in poses.items():
+            expected = poses[0.0].find_relative(pose)
+            self.assertTrue(np.allclose(expected.location, trajectory[time].location))
+            self.assertTrue(np.allclose(expected.rotation_quat(True), trajectory[time].rotation_quat(True)))
+
+    def test_skips_missing_images(self):
+        image_id = self.db_client.image_collection.insert_one({
+            'metadata': {'camera_pose': tf.Transform(location=(1, 2, 3)).serialize()}
+        }).inserted_id
+        collection_id = self.db_client.image_source_collection.insert_one({
+            'images': [(1.0, bson.ObjectId()), (2.0, image_id)]
+        }).inserted_id
+        trajectory = traj_help.get_trajectory_for_image_source(self.db_client, collection_id)
+        self.assertEqual([2.0], list(trajectory.keys()))
+        self.assertTrue(np.allclose((0, 0, 0), trajectory[2.0].location))
+
+    def test_returns_empty_trajectory_for_missing_collection(self):
+        trajectory = traj_help.get_trajectory_for_image_source(self.db_client, bson.ObjectId())
+        self.assertEqual(0, len(trajectory))
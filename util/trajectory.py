@@ -0,0 +1,275 @@
+# Copyright (c) 2017, John Skinner
+import collections.abc
+import numpy as np
+import util.transform as tf
+
+
+class Trajectory(collections.abc.Mapping):
+    """
+    A camera trajectory, stored as arrays of timestamps, locations, and orientations,
+    rather than as a dict of individual Transform objects.
+    This lets operations on the whole trajectory be done as vectorised numpy operations.
+
+    For compatibility with code expecting a dict of timestamp to pose, this behaves as a read-only mapping
+    from timestamp to util.transform.Transform. Transform objects are created as they are accessed.
+    Timestamps are always kept in sorted order, and iterating gives them in that order.
+    Indexing with a slice of times, such as trajectory[10.0:20.0], gives the part of the trajectory between them.
+    """
+
+    def __init__(self, timestamps, locations, rotations):
+        """
+        :param timestamps: An array of N timestamps. These do not need to be sorted.
+        If there are duplicates, the last one is kept, like building a dict.
+        :param locations: An Nx3 array of locations
+        :param rotations: An Nx4 array of unit quaternion orientations, scalar first (w, x, y, z)
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64).reshape(-1)
+        locations = np.asarray(locations, dtype=np.float64).reshape(-1, 3)
+        rotations = np.asarray(rotations, dtype=np.float64).reshape(-1, 4)
+        if len(locations) != len(timestamps) or len(rotations) != len(timestamps):
+            raise ValueError("Trajectory has {0} timestamps, but {1} locations and {2} rotations".format(
+                len(timestamps), len(locations), len(rotations)))
+
+        # Sort by time, keeping the last of any duplicate timestamps
+        order = np.argsort(timestamps, kind='mergesort')
+        if len(order) > 1:
+            sorted_stamps = timestamps[order]
+            keep = np.ones(len(order), dtype=bool)
+            keep[:-1] = sorted_stamps[:-1] != sorted_stamps[1:]
+            order = order[keep]
+        self._timestamps = timestamps[order]
+        self._locations = locations[order]
+        self._rotations = rotations[order]
+        for array in (self._timestamps, self._locations, self._rotations):
+            array.flags.writeable = False
+
+    @classmethod
+    def from_poses(cls, poses):
+        """
+        Make a trajectory from a dict of timestamp to pose, or any other mapping.
+        :param poses: A mapping from timestamp to util.transform.Transform. If this is already a Trajectory,
+        it is returned unchanged.
+        :return: A Trajectory
+        """
+        if isinstance(poses, Trajectory):
+            return poses
+        timestamps = list(poses.keys())
+        return cls(
+            timestamps=timestamps,
+            locations=[poses[timestamp].location for timestamp in timestamps],
+            rotations=[poses[timestamp].rotation_quat(w_first=True) for timestamp in timestamps]
+        )
+
+    @property
+    def timestamps(self):
+        """
+        The sorted timestamps, as a read-only array
+        :return: An array of length N
+        """
+        return self._timestamps
+
+    @property
+    def locations(self):
+        """
+        The locations of each pose, as a read-only array
+        :return: An Nx3 array
+        """
+        return self._locations
+
+    @property
+    def rotations(self):
+        """
+        The orientation of each pose as a unit quaternion, scalar first, as a read-only array
+        :return: An Nx4 array
+        """
+        return self._rotations
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    def __iter__(self):
+        return iter(self._timestamps.tolist())
+
+    def __contains__(self, timestamp):
+        return self._find_index(timestamp) is not None
+
+    def __getitem__(self, timestamp):
+        if isinstance(timestamp, slice):
+            if timestamp.step is not None:
+                raise ValueError("Trajectories cannot be sliced with a step")
+            return self.between(timestamp.start, timestamp.stop)
+        idx = self._find_index(timestamp)
+        if idx is None:
+            raise KeyError(timestamp)
+        return tf.Transform(location=self._locations[idx], rotation=self._rotations[idx], w_first=True)
+
+    def __eq__(self, other):
+        if isinstance(other, Trajectory):
+            return (np.array_equal(self._timestamps, other._timestamps) and
+                    np.array_equal(self._locations, other._locations) and
+                    np.array_equal(self._rotations, other._rotations))
+        return super().__eq__(other)
+
+    __hash__ = None
+
+    @property
+    def transform_matrices(self):
+        """
+        Get the homogenous transformation matrix for every pose, like Transform.transform_matrix
+        :return: An Nx4x4 array
+        """
+        matrices = np.zeros((len(self._timestamps), 4, 4))
+        matrices[:, 0:3, 0:3] = quat_to_matrices(self._rotations)
+        matrices[:, 0:3, 3] = self._locations
+        matrices[:, 3, 3] = 1
+        return matrices
+
+    def between(self, start=None, end=None):
+        """
+        Get the part of the trajectory between two times.
+        :param start: The earliest time to include. Default None, for the start of the trajectory.
+        :param end: The time to stop at, which is not included. Default None, for the end of the trajectory.
+        :return: A new Trajectory
+        """
+        first = 0 if start is None else int(np.searchsorted(self._timestamps, start, side='left'))
+        last = len(self._timestamps) if end is None else int(np.searchsorted(self._timestamps, end, side='left'))
+        return Trajectory(self._timestamps[first:last], self._locations[first:last], self._rotations[first:last])
+
+    def to_dict(self):
+        """
+        Convert to a dict of timestamp to util.transform.Transform, creating all the Transform objects at once.
+        :return: A dict
+        """
+        return {timestamp: self[timestamp] for timestamp in self}
+
+    def find_relative(self, pose):
+        """
+        Find every pose in the trajectory relative to another pose, as pose.find_relative does for one pose.
+        :param pose: A Transform, or a Trajectory with the same timestamps to find each pose relative to
+        the pose at the same time.
+        :return: A new Trajectory with the same timestamps
+        """
+        base_locations, base_rotations = self._get_other_poses(pose)
+        inv_rot = quat_inverse(base_rotations)
+        return Trajectory(
+            timestamps=self._timestamps,
+            locations=rotate_vectors(self._locations - base_locations, inv_rot),
+            rotations=quat_multiply(inv_rot, self._rotations)
+        )
+
+    def find_independent(self, pose):
+        """
+        Convert every pose in the trajectory from being relative to another pose,
+        as pose.find_independent does for one pose.
+        :param pose: A Transform, or a Trajectory with the same timestamps to make each pose independent of
+        the pose at the same time.
+        :return: A new Trajectory with the same timestamps
+        """
+        base_locations, base_rotations = self._get_other_poses(pose)
+        return Trajectory(
+            timestamps=self._timestamps,
+            locations=base_locations + rotate_vectors(self._locations, base_rotations),
+            rotations=quat_multiply(base_rotations, self._rotations)
+        )
+
+    def _get_other_poses(self, pose):
+        """
+        Get the location and rotation arrays for a pose or trajectory we're combining with this one
+        :param pose: A Transform or Trajectory
+        :return: An array of locations and an array of rotations, which broadcast against this trajectory
+        """
+        if isinstance(pose, Trajectory):
+            if not np.array_equal(self._timestamps, pose._timestamps):
+                raise ValueError("Trajectories must have the same timestamps to be combined")
+            return pose._locations, pose._rotations
+        return pose.location, pose.rotation_quat(w_first=True)
+
+    def _find_index(self, timestamp):
+        """
+        Find the index of a timestamp in the trajectory. The timestamp must match exactly.
+        :param timestamp: The timestamp to find
+        :return: The index, or None if the timestamp is not in the trajectory
+        """
+        try:
+            timestamp = float(timestamp)
+        except (TypeError, ValueError):
+            return None
+        idx = int(np.searchsorted(self._timestamps, timestamp))
+        if idx < len(self._timestamps) and self._timestamps[idx] == timestamp:
+            return idx
+        return None
+
+
+def read_trajectory_file(trajectory_file, delimiter=None, w_first=False):
+    """
+    Read a trajectory from a text file with one pose per line, all in one numpy parse.
+    Each line must start with the timestamp, the location (x, y, z), and the orientation as a quaternion.
+    Any further columns are ignored, as are lines starting with '#'.
+    No changes are made to the coordinate frame, that is up to the caller.
+    :param trajectory_file: The path of the file, or an open file object
+    :param delimiter: The string separating the columns. Default None, for any whitespace.
+    :param w_first: Is the scalar part of the quaternion before the vector part in the file. Default False.
+    :return: A Trajectory object
+    """
+    data = np.loadtxt(trajectory_file, dtype=np.float64, comments='#', delimiter=delimiter,
+                      usecols=range(8), ndmin=2, encoding='utf-8')
+    rotations = data[:, 4:8] if w_first else data[:, (7, 4, 5, 6)]
+    rotations = rotations / np.linalg.norm(rotations, axis=1, keepdims=True)
+    return Trajectory(timestamps=data[:, 0], locations=data[:, 1:4], rotations=rotations)
+
+
+def quat_multiply(quat1, quat2):
+    """
+    Multiply quaternions, scalar first, like transforms3d.quaternions.qmult.
+    Either argument may be a single quaternion, or an Nx4 array of quaternions.
+    :param quat1: The left quaternion(s)
+    :param quat2: The right quaternion(s)
+    :return: The product quaternions, as an array
+    """
+    w1, x1, y1, z1 = np.moveaxis(np.asarray(quat1, dtype=np.float64), -1, 0)
+    w2, x2, y2, z2 = np.moveaxis(np.asarray(quat2, dtype=np.float64), -1, 0)
+    return np.stack((
+        w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+        w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+        w1 * y2 + y1 * w2 + z1 * x2 - x1 * z2,
+        w1 * z2 + z1 * w2 + x1 * y2 - y1 * x2
+    ), axis=-1)
+
+
+def quat_inverse(quat):
+    """
+    Invert quaternions, scalar first. For unit quaternions this is the same as transforms3d.quaternions.qinverse
+    :param quat: A single quaternion, or an Nx4 array of quaternions
+    :return: The inverse quaternions
+    """
+    quat = np.asarray(quat, dtype=np.float64)
+    return quat * np.array((1, -1, -1, -1)) / np.sum(quat * quat, axis=-1, keepdims=True)
+
+
+def rotate_vectors(vectors, quat):
+    """
+    Rotate vectors by unit quaternions, scalar first, like transforms3d.quaternions.rotate_vector
+    :param vectors: A single vector, or an Nx3 array of vectors
+    :param quat: A single unit quaternion, or an Nx4 array of unit quaternions
+    :return: The rotated vectors
+    """
+    vectors = np.asarray(vectors, dtype=np.float64)
+    quat = np.asarray(quat, dtype=np.float64)
+    scalar = quat[..., 0:1]
+    axis = quat[..., 1:4]
+    cross = 2 * np.cross(axis, vectors)
+    return vectors + scalar * cross + np.cross(axis, cross)
+
+
+def quat_to_matrices(quat):
+    """
+    Convert unit quaternions, scalar first, to rotation matrices, like transforms3d.quaternions.quat2mat
+    :param quat: A single unit quaternion, or an Nx4 array of unit quaternions
+    :return: A 3x3 rotation matrix, or an Nx3x3 array of matrices
+    """
+    w, x, y, z = np.moveaxis(np.asarray(quat, dtype=np.float64), -1, 0)
+    return np.stack((
+        np.stack((1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)), axis=-1),
+        np.stack((2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)), axis=-1),
+        np.stack((2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)), axis=-1)
+    ), axis=-2)
@@ -3,6 +3,7 @@ import typing
 import database.client
 import bson
 import util.transform as tf
+import util.trajectory
 
 
 def get_trajectory_for_image_source(db_client: database.client.DatabaseClient,
@@ -16,20 +17,26 @@ def get_trajectory_for_image_source(db_client: database.client.DatabaseClient,
     but does not have the same world coordinates.
     :param db_client: The database client
     :param image_collection_id: The id of the image collection to load
-    :return: A trajectory, a map of timestamp to camera pose. Ignores right-camera for stereo
+    :return: A util.trajectory.Trajectory, which maps timestamp to camera pose. Ignores right-camera for stereo
     """
     images = db_client.image_source_collection.find_one({'_id': image_collection_id, 'images': {'$exists': True}},
                                                         {'images': True})
-    trajectory = {}
-    if images is not None:
-        first_pose = None
-        for timestamp, image_id in images['images']:
-            position_result = db_client.image_collection.find_one({'_id': image_id}, {'metadata.camera_pose': True})
-            if position_result is not None:
-                current_pose = tf.Transform.deserialize(position_result['metadata']['camera_pose'])
-                if first_pose is None:
-                    trajectory[timestamp] = tf.Transform()
-                    first_pose = current_pose
-                else:
-                    trajectory[timestamp] = first_pose.find_relative(current_pose)
-    return trajectory
+    if images is None or len(images['images']) <= 0:
+        return util.trajectory.Trajectory([], [], [])
+
+    # Fetch all the poses in one query, rather than one query per image
+    poses = {}
+    for position_result in db_client.image_collection.find(
+            {'_id': {'$in': [image_id for _, image_id in images['images']]}},
+            {'metadata.camera_pose': True}):
+        poses[position_result['_id']] = tf.Transform.deserialize(position_result['metadata']['camera_pose'])
+
+    found = [(timestamp, poses[image_id]) for timestamp, image_id in images['images'] if image_id in poses]
+    if len(found) <= 0:
+        return util.trajectory.Trajectory([], [], [])
+    trajectory = util.trajectory.Trajectory(
+        timestamps=[timestamp for timestamp, _ in found],
+        locations=[pose.location for _, pose in found],
+        rotations=[pose.rotation_quat(w_first=True) for _, pose in found]
+    )
+    return trajectory.find_relative(found[0][1])